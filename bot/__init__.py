@@ -1,13 +1,54 @@
-import logging
 import telebot
+from telebot import apihelper
 from telebot.handler_backends import State, StatesGroup
-from telebot.storage import StateMemoryStorage
 
 from django.conf import settings
 
+from .logs import setup_logging
+from .outbound import OutboundScheduler
+from .storage import DatabaseStateStorage
+from .transport import Transport
+
 # Получение комманд
 commands = settings.BOT_COMMANDS
-state_storage = StateMemoryStorage()
+# Состояния хранятся в БД, чтобы их видели все процессы
+state_storage = DatabaseStateStorage(
+    cache_size=settings.BOT_STATE_CACHE_SIZE,
+    cache_ttl=settings.BOT_STATE_CACHE_TTL,
+    default_ttl=settings.BOT_STATE_TTL,
+    ttls=settings.BOT_STATE_TTLS,
+    max_entries=settings.BOT_STATE_MAX_ENTRIES,
+    sweep_interval=settings.BOT_STATE_SWEEP_INTERVAL,
+    touch_interval=settings.BOT_STATE_TOUCH_INTERVAL,
+)
+
+# Пул соединений и таймауты запросов к Bot API
+transport = Transport(
+    pool_size=settings.BOT_API_POOL_SIZE,
+    connect_timeout=settings.BOT_API_CONNECT_TIMEOUT,
+    read_timeout=settings.BOT_API_READ_TIMEOUT,
+    upload_timeout=settings.BOT_API_UPLOAD_TIMEOUT,
+    connect_retries=settings.BOT_API_CONNECT_RETRIES,
+)
+# Сессию могли задать заранее, например заглушкой в тестах
+if apihelper.session is None:
+    apihelper.session = transport.session()
+
+# Все исходящие запросы к Bot API идут через планировщик с лимитами
+outbound = OutboundScheduler(
+    global_rate=settings.BOT_RATE_GLOBAL,
+    chat_rate=settings.BOT_RATE_CHAT,
+    group_per_minute=settings.BOT_RATE_GROUP_PER_MINUTE,
+    burst=settings.BOT_RATE_BURST,
+    max_retries=settings.BOT_API_MAX_RETRIES,
+    transport=transport,
+    max_wait=settings.BOT_RATE_MAX_WAIT,
+)
+apihelper.CUSTOM_REQUEST_SENDER = outbound.request_sender
+
+# Другой сервер Bot API, например локальная заглушка для тестов
+if settings.BOT_API_URL:
+    apihelper.API_URL = settings.BOT_API_URL
 
 # Инициализация бота
 bot = telebot.TeleBot(
@@ -20,12 +61,16 @@ bot = telebot.TeleBot(
 class UsersStates(StatesGroup):
     help_request = State()
 
-# Установка комманд для бота
-bot.set_my_commands(commands)
-
-logging.info(f'@{bot.get_me().username} started')
+# Команды и данные бота регистрируются при развёртывании (set_webhook), а не при импорте
 
 logger = telebot.logger
-logger.setLevel(logging.INFO)
 
-logging.basicConfig(level=logging.INFO, filename="ai_log.log", filemode="w")
\ No newline at end of file
+# Запись логов идёт в отдельном потоке через очередь
+setup_logging(
+    settings.BOT_LOG_FILE,
+    level=settings.BOT_LOG_LEVEL,
+    max_bytes=settings.BOT_LOG_MAX_BYTES,
+    backups=settings.BOT_LOG_BACKUPS,
+    debug_sample=settings.BOT_LOG_DEBUG_SAMPLE,
+    rotate=settings.BOT_LOG_ROTATE,
+)
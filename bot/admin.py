@@ -1,7 +1,6 @@
 from django.contrib import admin
 
-from .models import GeneralInfo, Place, Session, OptionalInfo
-from .views import refresh_general
+from .models import GeneralInfo, Place, Session, OptionalInfo, HelpTicket
 
 @admin.register(Place)
 class PlaceAdmin(admin.ModelAdmin):
@@ -18,6 +17,12 @@ class OptionalInfoAdmin(admin.ModelAdmin):
     '''
     prepopulated_fields = {"slug": ("title",)}
 
+    def save_model(self, request, obj, form, change):
+        # Сброс file_id, если файл или способ отправки изменились
+        if 'file' in form.changed_data or 'is_photo' in form.changed_data:
+            obj.file_id = None
+        super().save_model(request, obj, form, change)
+
 
 @admin.register(GeneralInfo)
 class GeneralInfoAdmin(admin.ModelAdmin):
@@ -25,12 +30,6 @@ class GeneralInfoAdmin(admin.ModelAdmin):
         Общая информация
     '''
 
-    def save_model(self, request, obj, form, change):   
-        # Обновление данных при сохранении
-        super().save_model(request, obj, form, change)
-        refresh_general()
-        return
-
 
 @admin.register(Session)
 class ProjectAdmim(admin.ModelAdmin):
@@ -38,3 +37,20 @@ class ProjectAdmim(admin.ModelAdmin):
         Модель для проекта
     '''
     prepopulated_fields = {"slug": ("title",)}
+
+    def save_model(self, request, obj, form, change):
+        # Сброс file_id, если постер заменили
+        if 'image' in form.changed_data:
+            obj.image_file_id = None
+        super().save_model(request, obj, form, change)
+
+
+@admin.register(HelpTicket)
+class HelpTicketAdmin(admin.ModelAdmin):
+    '''
+        Запросы помощи и их доставка админам
+    '''
+    list_display = ('created', 'username', 'user_id', 'status', 'attempts', 'sent')
+    list_filter = ('status',)
+    search_fields = ('username', 'text')
+    readonly_fields = ('user_id', 'chat_id', 'username', 'text', 'delivered', 'attempts', 'created', 'sent')
@@ -0,0 +1,296 @@
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+
+from telebot import asyncio_helper
+from telebot.async_telebot import AsyncTeleBot, ExceptionHandler
+from telebot.asyncio_helper import ApiTelegramException
+from telebot.types import Update, CallbackQuery, Message, InlineQuery
+
+from bot import logger, outbound, state_storage, UsersStates
+from .handlers.asyncio_common import replace_message, replace_with_file
+from .handlers.common import (
+    HELP_TEXT, HELP_SENT_TEXT, FAQ_TEXT, FAQ_EXPIRED_TEXT, SESSIONS_RETURN_TEXT, SESSION_NOT_FOUND_TEXT,
+    PLACES_TEXT, PLACE_NOT_FOUND_TEXT, INFOS_TEXT, INFO_NOT_FOUND_TEXT, MAIN_LISTS,
+)
+from .callbacks import CallbackRouter
+from .catalog import catalog, first_markup, cancel_markup, faq_markup, is_cursor
+from .faq import faq_index
+from .inline import inline_catalog, inline_button, parse_offset
+from .tickets import ticket_dispatcher
+from .ingest import update_chat_id
+from .logs import log_context
+from .routers import handler_reads
+from .metrics import timed, track_update, help_requests
+from .storage import AsyncDatabaseStateStorage
+
+# Один пул соединений aiohttp на весь процесс
+asyncio_helper.REQUEST_LIMIT = settings.BOT_ASYNC_POOL_SIZE
+asyncio_helper.REQUEST_TIMEOUT = settings.BOT_ASYNC_TIMEOUT
+if settings.BOT_API_URL:
+    asyncio_helper.API_URL = settings.BOT_API_URL
+# Те же лимиты на исходящие запросы, что и в синхронном рантайме
+asyncio_helper._process_request = outbound.wrap_async(asyncio_helper._process_request)
+
+
+class OwnerExceptionHandler(ExceptionHandler):
+    '''
+        Уведомление владельца о необработанных ошибках, как в синхронном index
+    '''
+
+    async def handle(self, exception):
+        if isinstance(exception, ApiTelegramException):
+            logger.error("Telegram exception. %s", exception, exc_info=exception)
+            return True
+
+        logger.error("Unhandled exception. %s", exception, exc_info=exception)
+        try:
+            await abot.send_message(settings.OWNER_ID, f'Error from index: {exception}')
+        except Exception as e:
+            logger.error('Не удалось уведомить владельца: %s', e)
+        return True
+
+
+# Асинхронный бот для BOT_RUNTIME = 'async'
+abot = AsyncTeleBot(
+    settings.BOT_TOKEN,
+    state_storage=AsyncDatabaseStateStorage(state_storage),
+    exception_handler=OwnerExceptionHandler(),
+)
+
+
+async def process_update(update: Update):
+    '''
+        Обработка одного обновления в асинхронном рантайме
+    '''
+    try:
+        with log_context(update_id=update.update_id, chat_id=update_chat_id(update)), track_update('async'), handler_reads():
+            await abot.process_new_updates([update])
+    except ConnectionError as e:
+        logger.error("Connection error. %s", e, exc_info=True)
+
+
+@abot.message_handler(commands=["start"])
+@timed
+async def start_command(message: Message):
+    '''
+        Команда старт
+    '''
+    logger.debug("Команда /start в чате %s от пользователя %s", message.chat.id, message.from_user.id)
+    current = await catalog.aget()
+    await abot.send_message(
+        chat_id=message.chat.id,
+        text=current.general.start_text,
+        parse_mode='html',
+        reply_markup=first_markup
+        )
+
+
+@abot.message_handler(commands=["help"])
+@timed
+async def help_command(message: Message):
+    '''
+        Команда help
+    '''
+    await abot.send_message(
+        chat_id=message.chat.id,
+        text=HELP_TEXT,
+        parse_mode='html',
+        reply_markup=cancel_markup
+        )
+    await abot.set_state(user_id=message.from_user.id, state=UsersStates.help_request, chat_id=message.chat.id)
+
+
+@abot.inline_handler(func=lambda query: True)
+@timed
+async def inline_query_handler(query: InlineQuery):
+    '''
+        Поиск смен, мест и статей по началу слов названия из любого чата
+    '''
+    index = inline_catalog.get(await catalog.aget())
+    results, next_offset = index.search(query.query, parse_offset(query.offset), settings.BOT_INLINE_PAGE_SIZE)
+    await abot.answer_inline_query(
+        query.id,
+        results,
+        cache_time=settings.BOT_INLINE_CACHE_TIME,
+        next_offset=next_offset,
+        button=inline_button
+        )
+
+
+# Все нажатия Inline-кнопок разбираются одним обработчиком через роутер
+router = CallbackRouter()
+
+
+@abot.callback_query_handler(func=lambda call: True)
+async def callback_dispatcher(call: CallbackQuery):
+    return await router.dispatch(call)
+
+
+@router.fallback
+async def stale_callback(call: CallbackQuery, call_value):
+    '''
+        Кнопка устаревшего или неизвестного формата: возврат в начало
+    '''
+    current = await catalog.aget()
+    await replace_message(call, abot, first_markup, current.general.start_text)
+
+
+@router.route('m')
+async def main_callbacks(call: CallbackQuery, call_value: str):
+    '''
+        Обработка нажатий основных Inline-кнопок
+    '''
+    logger.debug('Нажата Inline-кнопка. Значение %s', call_value)
+
+    current = await catalog.aget()
+    if call_value == 'cancel':
+        await replace_message(call, abot, first_markup, current.general.start_text)
+        await abot.delete_state(user_id=call.from_user.id, chat_id=call.message.chat.id)
+
+    # Вопрос, на который в предложенных статьях не нашлось ответа
+    elif call_value == 'escalate':
+        async with abot.retrieve_data(user_id=call.from_user.id, chat_id=call.message.chat.id) as data:
+            text = data.pop('help_request', None)
+        if text is None:
+            return await replace_message(call, abot, first_markup, FAQ_EXPIRED_TEXT)
+        help_requests.inc('escalated')
+        await send_help_request(call.message, call.from_user, text)
+
+    elif call_value == 'return':
+        await replace_message(call, abot, first_markup, current.general.start_text)
+
+    elif call_value in MAIN_LISTS:
+        objects, tag, text, empty_text = MAIN_LISTS[call_value]
+        await abot.edit_message_text(
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            text=text if getattr(current, objects) else empty_text,
+            reply_markup=await current.apage(tag)
+            )
+
+
+@router.route('s')
+async def session_callback(call: CallbackQuery, session_key):
+    '''
+        Подробнее о смене
+    '''
+    current = await catalog.aget()
+
+    if session_key == '' or is_cursor(session_key):
+        return await replace_message(call, abot, await current.apage('s', session_key), SESSIONS_RETURN_TEXT)
+
+    session = current.session(session_key)
+    if session is None:
+        return await abot.edit_message_text(
+            chat_id=call.message.chat.id,
+            message_id=call.message.message_id,
+            text=SESSION_NOT_FOUND_TEXT,
+            reply_markup=current.return_markup
+            )
+
+    markup = current.session_markups[session.pk]
+    if not session.image is None and not session.image == '':
+        return await replace_with_file(
+            call,
+            abot,
+            session,
+            'image',
+            'image_file_id',
+            as_photo=True,
+            caption=session.message_text(),
+            markup=markup
+            )
+    return await replace_message(call, abot, markup, session.message_text())
+
+
+@router.route('p')
+async def place_callback(call: CallbackQuery, place_key):
+    '''
+        Подробнее о месте проведения
+    '''
+    current = await catalog.aget()
+
+    if place_key == '' or is_cursor(place_key):
+        messages_count = 2 if call.message.content_type == 'location' else 1
+        return await replace_message(call, abot, await current.apage('p', place_key), PLACES_TEXT, messages_count)
+
+    markup = current.place_markup
+    place = current.place(place_key)
+    if place is None:
+        return await replace_message(call, abot, markup, PLACE_NOT_FOUND_TEXT)
+
+    if not place.latitude is None and not place.longitude is None:
+        await replace_message(call, abot, None, place.message_text())
+        await abot.send_location(
+            chat_id=call.message.chat.id,
+            latitude=place.latitude,
+            longitude=place.longitude,
+            reply_markup=markup
+        )
+    else:
+        await replace_message(call, abot, markup, place.message_text())
+
+
+@router.route('i')
+async def optional_info_callback(call: CallbackQuery, info_key):
+    '''
+        Дополнительная информация
+    '''
+    current = await catalog.aget()
+
+    if info_key == '' or is_cursor(info_key):
+        return await replace_message(call, abot, await current.apage('i', info_key), INFOS_TEXT)
+
+    markup = current.info_markup
+    info = current.info(info_key)
+    if info is None:
+        return await replace_message(call, abot, markup, INFO_NOT_FOUND_TEXT)
+
+    if info.file is None or info.file == '':
+        return await replace_message(call, abot, markup, info.message_text())
+
+    return await replace_with_file(
+        call,
+        abot,
+        info,
+        'file',
+        'file_id',
+        as_photo=info.is_photo,
+        caption=info.message_text(),
+        markup=markup
+        )
+
+
+async def send_help_request(message: Message, user, text: str):
+    '''
+        Сохранение запроса для рассылки админам и подтверждение пользователю
+    '''
+    await ticket_dispatcher.asubmit(user.id, message.chat.id, user.username, text)
+    await abot.send_message(
+        chat_id=message.chat.id,
+        text=HELP_SENT_TEXT,
+        parse_mode='html',
+        disable_web_page_preview=True
+        )
+
+
+@abot.message_handler()
+@timed
+async def messages_handler(message: Message):
+    state = await abot.get_state(user_id=message.from_user.id, chat_id=message.chat.id)
+    if state == UsersStates.help_request.name:
+        # Сначала предлагаются подходящие статьи, вопрос сохраняется до решения пользователя
+        matches = await sync_to_async(faq_index.search)(await catalog.aget(), message.text or '', settings.BOT_FAQ_RESULTS, settings.BOT_FAQ_THRESHOLD)
+        if matches:
+            logger.info('Вопрос в /help: найдено ответов %s, лучшая оценка %s', len(matches), matches[0][0])
+            help_requests.inc('suggested')
+            await abot.add_data(user_id=message.from_user.id, chat_id=message.chat.id, help_request=message.text)
+            return await abot.send_message(
+                chat_id=message.chat.id,
+                text=FAQ_TEXT,
+                reply_markup=faq_markup(matches)
+                )
+
+        help_requests.inc('forwarded')
+        await send_help_request(message, message.from_user, message.text)
@@ -0,0 +1,74 @@
+from typing import Union
+
+from telebot import logger
+
+from .metrics import timed
+
+# Версия формата callback_data: '<версия><тег>:<аргумент>', например '1s:12'
+VERSION = '1'
+# Telegram ограничивает callback_data 64 байтами
+MAX_LENGTH = 64
+
+# Префиксы старого формата 'main.sessions', 's.<slug>' и т. д.
+LEGACY_TAGS = {'main': 'm', 's': 's', 'p': 'p', 'i': 'i'}
+
+
+def encode(tag: str, arg: Union[int, str] = '') -> str:
+    '''
+        Компактная callback_data: короткий тег и pk объекта или действие
+    '''
+    data = f'{VERSION}{tag}:{arg}'
+    if len(data.encode()) > MAX_LENGTH:
+        raise ValueError(f'callback_data длиннее {MAX_LENGTH} байт: {data}')
+    return data
+
+
+def decode(data: str):
+    '''
+        Разбор callback_data в (тег, аргумент).
+        Числовой аргумент текущего формата - pk (int), у кнопок старого формата
+        аргумент остаётся слагом (str). Нераспознанные данные дают тег None
+    '''
+    if data.startswith(VERSION):
+        tag, sep, arg = data[len(VERSION):].partition(':')
+        if sep:
+            return tag, int(arg) if arg.isdigit() else arg
+
+    prefix, sep, arg = data.partition('.')
+    tag = LEGACY_TAGS.get(prefix)
+    if sep and tag is not None:
+        if tag != 'm' and arg == 'return':
+            arg = ''
+        return tag, arg
+
+    return None, data
+
+
+class CallbackRouter:
+    '''
+        Маршрутизация нажатий Inline-кнопок по тегу callback_data за O(1).
+        Обработчик получает (call, аргумент); устаревшие и неизвестные кнопки
+        уходят в fallback. Время каждого обработчика учитывается в метриках
+    '''
+
+    def __init__(self):
+        self._routes = {}
+        self._fallback = None
+
+    def route(self, tag: str):
+        def decorator(handler):
+            self._routes[tag] = timed(handler)
+            return handler
+        return decorator
+
+    def fallback(self, handler):
+        self._fallback = timed(handler)
+        return handler
+
+    def dispatch(self, call):
+        tag, arg = decode(call.data or '')
+        handler = self._routes.get(tag)
+        if handler is None:
+            logger.info('Неизвестная кнопка: %s', call.data)
+            handler = self._fallback
+        return handler(call, arg)
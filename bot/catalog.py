@@ -0,0 +1,287 @@
+import threading
+import time
+
+from django.conf import settings
+from django.db.models import F
+
+from telebot.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from .callbacks import encode
+from .models import GeneralInfo, Session, Place, OptionalInfo, CatalogVersion
+
+
+# Основная клавиатура
+first_markup = InlineKeyboardMarkup(row_width=1)
+first_markup.add(
+    InlineKeyboardButton(text='Смены', callback_data=encode('m', 'sessions')),
+    InlineKeyboardButton(text='Места проведения', callback_data=encode('m', 'places')),
+    InlineKeyboardButton(text='Дополнительная информация', callback_data=encode('m', 'more_info'))
+)
+first_markup = first_markup.to_json()
+
+# Клавиатура отмены запроса помощи
+cancel_markup = InlineKeyboardMarkup(keyboard=[[InlineKeyboardButton(text='Отмена', callback_data=encode('m', 'cancel'))]]).to_json()
+
+
+def _return_button(callback_data=encode('m', 'return'), text='Вернуться ↩️'):
+    return InlineKeyboardButton(text=text, callback_data=callback_data)
+
+
+# Модели списков по тегу кнопки
+PAGE_MODELS = {'s': Session, 'p': Place, 'i': OptionalInfo}
+
+
+def is_cursor(key) -> bool:
+    '''
+        Аргумент кнопки листания: '>pk' - страница после pk, '<pk' - страница до pk
+    '''
+    return isinstance(key, str) and key[:1] in ('<', '>') and key[1:].isdigit()
+
+
+def _page_query(tag: str, cursor: str):
+    '''
+        Запрос одной страницы по индексу pk (keyset) с запасом в одну строку,
+        чтобы узнать, есть ли следующая. Возвращает (запрос, идёт ли он назад)
+    '''
+    rows = PAGE_MODELS[tag].objects.only('title').order_by('pk')
+    size = settings.BOT_MENU_PAGE_SIZE + 1
+    if cursor.startswith('<'):
+        return rows.filter(pk__lt=int(cursor[1:])).order_by('-pk')[:size], True
+    if cursor.startswith('>'):
+        return rows.filter(pk__gt=int(cursor[1:]))[:size], False
+    return rows[:size], False
+
+
+def _page_markup(tag: str, cursor: str, rows: list, backwards: bool):
+    '''
+        Клавиатура страницы: объекты, листание и кнопка возврата
+    '''
+    more = len(rows) > settings.BOT_MENU_PAGE_SIZE
+    rows = rows[:settings.BOT_MENU_PAGE_SIZE]
+    if backwards:
+        rows.reverse()
+
+    markup = InlineKeyboardMarkup(row_width=2)
+    for obj in rows:
+        markup.row(InlineKeyboardButton(text=obj.title, callback_data=encode(tag, obj.pk)))
+
+    # Назад листается от первой строки страницы, вперёд - от последней
+    navigation = []
+    if rows and (more if backwards else cursor != ''):
+        navigation.append(InlineKeyboardButton(text='◀️', callback_data=encode(tag, f'<{rows[0].pk}')))
+    if rows and (cursor != '' if backwards else more):
+        navigation.append(InlineKeyboardButton(text='▶️', callback_data=encode(tag, f'>{rows[-1].pk}')))
+    if navigation:
+        markup.row(*navigation)
+    markup.row(_return_button())
+    return markup.to_json()
+
+
+def _session_markup(session: Session):
+    '''
+        Клавиатура под описанием смены
+    '''
+    markup = InlineKeyboardMarkup(row_width=1)
+    if not session.form_url is None and session.form_url.strip() != '':
+        markup.add(InlineKeyboardButton(text='Записаться!', url=session.form_url))
+
+    markup.add(_return_button(encode('s'), 'К списку смен 📃'))
+    markup.add(_return_button(text='В начало ↩️'))
+    return markup.to_json()
+
+
+def faq_markup(matches):
+    '''
+        Клавиатура с подходящими ответами на вопрос, отправкой вопроса админам и отменой
+    '''
+    markup = InlineKeyboardMarkup(row_width=1)
+    for _, (tag, pk), title in matches:
+        markup.add(InlineKeyboardButton(text=title, callback_data=encode(tag, pk)))
+    markup.add(InlineKeyboardButton(text='Нет ответа, написать в поддержку ✉️', callback_data=encode('m', 'escalate')))
+    markup.add(InlineKeyboardButton(text='Отмена', callback_data=encode('m', 'cancel')))
+    return markup.to_json()
+
+
+class CatalogSnapshot:
+    '''
+        Неизменяемый срез каталога: объекты по pk и готовые клавиатуры.
+        Клавиатуры хранятся уже сериализованными в JSON
+    '''
+
+    def __init__(self, version: int, general: GeneralInfo, sessions: list, places: list, infos: list):
+        self.version = version
+        self.general = general or GeneralInfo()
+
+        self.sessions = {session.pk: session for session in sessions}
+        self.places = {place.pk: place for place in places}
+        self.infos = {info.pk: info for info in infos}
+
+        # Слаги нужны только для кнопок старого формата
+        self._slugs = {
+            's': {session.slug: session.pk for session in sessions},
+            'p': {place.slug: place.pk for place in places},
+            'i': {info.slug: info.pk for info in infos},
+        }
+
+        return_markup = InlineKeyboardMarkup(row_width=1)
+        return_markup.add(_return_button())
+        self.return_markup = return_markup.to_json()
+        # Страницы списков: (тег, курсор) -> клавиатура, заполняются при первом показе.
+        # Курсор приходит из callback_data, поэтому кэшируются только курсоры от существующих объектов
+        self._pages = {}
+        self._page_objects = {'s': self.sessions, 'p': self.places, 'i': self.infos}
+        self.session_markups = {pk: _session_markup(session) for pk, session in self.sessions.items()}
+
+        place_markup = InlineKeyboardMarkup(row_width=1)
+        place_markup.add(_return_button(encode('p'), 'К списку мест 📃'))
+        place_markup.add(_return_button(text='В начало ↩️'))
+        self.place_markup = place_markup.to_json()
+
+        info_markup = InlineKeyboardMarkup(row_width=1)
+        info_markup.add(_return_button(encode('i')))
+        self.info_markup = info_markup.to_json()
+
+    def _cacheable(self, tag: str, cursor: str) -> bool:
+        '''
+            Кэш не больше двух страниц на объект: подделанные курсоры обслуживаются без кэширования
+        '''
+        return cursor == '' or int(cursor[1:]) in self._page_objects[tag]
+
+    def page(self, tag: str, cursor: str = ''):
+        '''
+            Клавиатура страницы списка смен, мест или статей
+        '''
+        markup = self._pages.get((tag, cursor))
+        if markup is None:
+            rows, backwards = _page_query(tag, cursor)
+            markup = _page_markup(tag, cursor, list(rows), backwards)
+            if self._cacheable(tag, cursor):
+                self._pages[(tag, cursor)] = markup
+        return markup
+
+    async def apage(self, tag: str, cursor: str = ''):
+        markup = self._pages.get((tag, cursor))
+        if markup is None:
+            rows, backwards = _page_query(tag, cursor)
+            markup = _page_markup(tag, cursor, [row async for row in rows], backwards)
+            if self._cacheable(tag, cursor):
+                self._pages[(tag, cursor)] = markup
+        return markup
+
+    def _find(self, objects: dict, tag: str, key):
+        if isinstance(key, str):
+            key = self._slugs[tag].get(key)
+        return objects.get(key)
+
+    def session(self, key):
+        '''
+            Смена по pk или, для старых кнопок, по слагу
+        '''
+        return self._find(self.sessions, 's', key)
+
+    def place(self, key):
+        return self._find(self.places, 'p', key)
+
+    def info(self, key):
+        return self._find(self.infos, 'i', key)
+
+    @classmethod
+    def build(cls, version: int) -> 'CatalogSnapshot':
+        return cls(
+            version,
+            GeneralInfo.objects.first(),
+            list(Session.objects.select_related('place')),
+            list(Place.objects.all()),
+            list(OptionalInfo.objects.all()),
+        )
+
+    @classmethod
+    async def abuild(cls, version: int) -> 'CatalogSnapshot':
+        return cls(
+            version,
+            await GeneralInfo.objects.afirst(),
+            [session async for session in Session.objects.select_related('place')],
+            [place async for place in Place.objects.all()],
+            [info async for info in OptionalInfo.objects.all()],
+        )
+
+
+class Catalog:
+    '''
+        Кэш каталога в памяти процесса.
+        Версия каталога общая для всех процессов и хранится в БД (CatalogVersion).
+        Процесс сверяется с ней не чаще раза в BOT_CATALOG_CHECK_INTERVAL секунд
+        и лениво пересобирает срез, если версия выросла, поэтому остальные запросы
+        обработчиков бота к БД не идут
+    '''
+
+    def __init__(self):
+        self._build_lock = threading.Lock()
+        self._version = 0
+        self._checked = None
+        self._snapshot = None
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def invalidate(self):
+        '''
+            Пометить каталог устаревшим во всех процессах.
+            Можно вызывать из любого потока и процесса: из сигналов, фоновой обработки файлов, команд
+        '''
+        CatalogVersion.objects.get_or_create(pk=1)
+        CatalogVersion.objects.filter(pk=1).update(version=F('version') + 1)
+        # Этот процесс увидит новую версию при следующем обращении, не дожидаясь интервала
+        self._checked = None
+
+    def _expired(self, now: float) -> bool:
+        return self._checked is None or now - self._checked >= settings.BOT_CATALOG_CHECK_INTERVAL
+
+    def _current_version(self) -> int:
+        '''
+            Общая версия каталога, из БД не чаще раза в интервал проверки
+        '''
+        now = time.monotonic()
+        if self._expired(now):
+            self._version = CatalogVersion.objects.filter(pk=1).values_list('version', flat=True).first() or 0
+            self._checked = now
+        return self._version
+
+    async def _acurrent_version(self) -> int:
+        now = time.monotonic()
+        if self._expired(now):
+            self._version = await CatalogVersion.objects.filter(pk=1).values_list('version', flat=True).afirst() or 0
+            self._checked = now
+        return self._version
+
+    def get(self) -> CatalogSnapshot:
+        '''
+            Актуальный срез каталога
+        '''
+        version = self._current_version()
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+
+        with self._build_lock:
+            version = self._version
+            if self._snapshot is None or self._snapshot.version != version:
+                self._snapshot = CatalogSnapshot.build(version)
+            return self._snapshot
+
+    async def aget(self) -> CatalogSnapshot:
+        '''
+            Актуальный срез каталога для асинхронного рантайма
+        '''
+        version = await self._acurrent_version()
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+
+        snapshot = await CatalogSnapshot.abuild(version)
+        self._snapshot = snapshot
+        return snapshot
+
+
+catalog = Catalog()
@@ -0,0 +1,59 @@
+import threading
+from collections import OrderedDict
+
+from django.core.cache import cache
+
+
+class UpdateDeduplicator:
+    '''
+        Отсев повторно доставленных обновлений по update_id.
+        В процессе хранится кольцо последних size идентификаторов,
+        при shared=True дополнительно используется общий кэш Django (CACHES),
+        чтобы повтор не прошёл через другой процесс
+    '''
+
+    def __init__(self, size: int, shared: bool = False, ttl: int = 3600):
+        self.size = size
+        self.shared = shared
+        self.ttl = ttl
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def _key(self, update_id: int) -> str:
+        return f'bot:update:{update_id}'
+
+    def _remember(self, update_id: int) -> bool:
+        '''
+            Запоминает update_id. False, если он уже встречался
+        '''
+        with self._lock:
+            if update_id in self._seen:
+                self.dropped += 1
+                return False
+            self._seen[update_id] = None
+            if len(self._seen) > self.size:
+                self._seen.popitem(last=False)
+            return True
+
+    async def is_duplicate(self, update_id: int) -> bool:
+        if not self._remember(update_id):
+            return True
+
+        if self.shared and not await cache.aadd(self._key(update_id), 1, self.ttl):
+            with self._lock:
+                self.dropped += 1
+            return True
+        return False
+
+    async def forget(self, update_id: int):
+        '''
+            Снять отметку, если обновление не было принято и Telegram пришлёт его снова
+        '''
+        with self._lock:
+            self._seen.pop(update_id, None)
+        if self.shared:
+            await cache.adelete(self._key(update_id))
+
+    def stats(self) -> dict:
+        return {'tracked': len(self._seen), 'dropped': self.dropped}
@@ -0,0 +1,199 @@
+import asyncio
+import itertools
+import json
+import random
+import threading
+import time
+from collections import Counter, defaultdict, deque
+
+from aiohttp import web
+
+# Методы, которые возвращают True
+TRUE_METHODS = {
+    'deletemessage', 'deletemessages', 'setmycommands', 'setwebhook', 'deletewebhook',
+    'answercallbackquery', 'answerinlinequery',
+}
+# Методы, к которым применяется внедрение 429
+LIMITED_PREFIXES = ('send', 'edit', 'copy', 'forward')
+
+
+class FakeBotAPI:
+    '''
+        Заглушка Telegram Bot API для тестов и нагрузочных прогонов без сети.
+        Понимает методы, которыми пользуется бот, добавляет задержку,
+        отвечает 429 с заданной вероятностью, считает вызовы и загруженные байты
+        и хранит последние history запросов (метод, параметры) для проверок в тестах
+    '''
+
+    def __init__(self, latency: float = 0, jitter: float = 0, flood_rate: float = 0, retry_after: int = 1,
+                 bot_id: int = 123456, username: str = 'fake_nika_bot', history: int = 1000):
+        self.latency = latency
+        self.jitter = jitter
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.me = {'id': bot_id, 'is_bot': True, 'first_name': 'NIKA', 'username': username}
+
+        self._lock = threading.Lock()
+        self._message_ids = defaultdict(int)
+        self._file_ids = itertools.count(1)
+        self.calls = Counter()
+        self.uploads = Counter()
+        self.upload_bytes = Counter()
+        self.flooded = Counter()
+        self.requests = deque(maxlen=history)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'calls': dict(self.calls),
+                'uploads': dict(self.uploads),
+                'upload_bytes': dict(self.upload_bytes),
+                'flooded': dict(self.flooded),
+            }
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+            self.uploads.clear()
+            self.upload_bytes.clear()
+            self.flooded.clear()
+            self.requests.clear()
+
+    async def _params(self, request: web.Request, method: str) -> dict:
+        '''
+            Параметры из строки запроса (синхронный telebot) и тела (асинхронный), загрузки считаются
+        '''
+        params = dict(request.query)
+        if request.content_type == 'application/json':
+            params.update(await request.json())
+        elif request.can_read_body:
+            for key, value in (await request.post()).items():
+                if isinstance(value, web.FileField):
+                    size = len(value.file.read())
+                    with self._lock:
+                        self.uploads[method] += 1
+                        self.upload_bytes[method] += size
+                    params[key] = None
+                else:
+                    params[key] = value
+        return params
+
+    def _message(self, params: dict, **content) -> dict:
+        chat_id = params.get('chat_id')
+        try:
+            chat_id = int(chat_id)
+            chat = {'id': chat_id, 'type': 'private' if chat_id > 0 else 'supergroup'}
+        except (TypeError, ValueError):
+            chat = {'id': -1, 'type': 'channel', 'username': str(chat_id).lstrip('@')}
+
+        if params.get('message_id'):
+            message_id = int(params['message_id'])
+        else:
+            with self._lock:
+                self._message_ids[chat['id']] += 1
+                message_id = self._message_ids[chat['id']]
+
+        message = {'message_id': message_id, 'date': int(time.time()), 'chat': chat, 'from': self.me}
+        if params.get('reply_markup'):
+            message['reply_markup'] = json.loads(params['reply_markup'])
+        if params.get('caption'):
+            message['caption'] = params['caption']
+        message.update(content)
+        return message
+
+    def _file(self, value, kind: str) -> dict:
+        # Строка - уже загруженный file_id, иначе выдаётся новый
+        file_id = value if isinstance(value, str) and value else f'fake-{kind}-{next(self._file_ids)}'
+        return {'file_id': file_id, 'file_unique_id': f'u-{file_id}', 'file_size': 1}
+
+    def _photo(self, value) -> list:
+        return [dict(self._file(value, 'photo'), width=1280, height=1280)]
+
+    def _result(self, method: str, params: dict):
+        if method == 'getme':
+            return self.me
+        if method in TRUE_METHODS:
+            return True
+        if method in ('sendmessage', 'editmessagetext'):
+            return self._message(params, text=params.get('text', ''))
+        if method == 'sendphoto':
+            return self._message(params, photo=self._photo(params.get('photo')))
+        if method == 'senddocument':
+            return self._message(params, document=self._file(params.get('document'), 'document'))
+        if method == 'sendlocation':
+            return self._message(params, location={'latitude': float(params['latitude']), 'longitude': float(params['longitude'])})
+        if method == 'editmessagecaption':
+            return self._message(params, photo=self._photo(None))
+        if method == 'editmessagemedia':
+            media = json.loads(params['media'])
+            value = None if media['media'].startswith('attach://') else media['media']
+            if media.get('caption'):
+                params = dict(params, caption=media['caption'])
+            if media['type'] == 'photo':
+                return self._message(params, photo=self._photo(value))
+            return self._message(params, document=self._file(value, 'document'))
+        return None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        name = request.match_info['method']
+        method = name.lower()
+        params = await self._params(request, name)
+
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+
+        with self._lock:
+            self.calls[name] += 1
+            self.requests.append((name, params))
+        if method.startswith(LIMITED_PREFIXES) and random.random() < self.flood_rate:
+            with self._lock:
+                self.flooded[name] += 1
+            return web.json_response({
+                'ok': False,
+                'error_code': 429,
+                'description': f'Too Many Requests: retry after {self.retry_after}',
+                'parameters': {'retry_after': self.retry_after},
+            }, status=429)
+
+        result = self._result(method, params)
+        if result is None:
+            return web.json_response({'ok': False, 'error_code': 404, 'description': 'Not Found: method not found'}, status=404)
+        return web.json_response({'ok': True, 'result': result})
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        if request.method == 'DELETE':
+            self.reset()
+        return web.json_response(self.stats())
+
+    def make_app(self) -> web.Application:
+        # Загрузки в Telegram бывают до 50 МБ
+        app = web.Application(client_max_size=50 * 1024 * 1024)
+        app.router.add_route('*', '/bot{token}/{method}', self.handle)
+        app.router.add_route('GET', '/stats', self.handle_stats)
+        app.router.add_route('DELETE', '/stats', self.handle_stats)
+        return app
+
+
+def serve_in_thread(api: FakeBotAPI, host: str = '127.0.0.1', port: int = 0) -> str:
+    '''
+        Запуск заглушки в фоновом потоке. Возвращает адрес в формате BOT_API_URL
+    '''
+    started = threading.Event()
+    address = {}
+
+    def serve():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        # Журнал доступа aiohttp на каждый запрос заглушки засорил бы лог бота во время прогона
+        runner = web.AppRunner(api.make_app(), access_log=None)
+        loop.run_until_complete(runner.setup())
+        site = web.TCPSite(runner, host, port)
+        loop.run_until_complete(site.start())
+        address['port'] = site._server.sockets[0].getsockname()[1]
+        started.set()
+        loop.run_forever()
+
+    threading.Thread(target=serve, name='fake-bot-api', daemon=True).start()
+    started.wait()
+    return f"http://{host}:{address['port']}/bot{{0}}/{{1}}"
@@ -0,0 +1,112 @@
+import math
+import re
+import threading
+from collections import defaultdict
+
+from .models import Session, Place, OptionalInfo
+
+# Короткие служебные слова не несут смысла для поиска
+STOP_WORDS = {
+    'как', 'где', 'что', 'это', 'для', 'или', 'так', 'уже', 'она', 'они', 'оно', 'его', 'ему', 'вас', 'вам', 'нас', 'нам',
+    'мне', 'меня', 'есть', 'был', 'была', 'было', 'будет', 'когда', 'какой', 'какая', 'какие', 'можно', 'нужно',
+    'подскажите', 'пожалуйста', 'здравствуйте', 'добрый', 'день', 'вечер', 'спасибо', 'если', 'все', 'всё', 'там', 'тут',
+}
+WORD_RE = re.compile(r'[a-zа-я0-9]+')
+TAG_RE = re.compile(r'<[^>]+>')
+
+
+def trigrams(text: str) -> set:
+    '''
+        Триграммы слов текста: 'смена' -> ' см', 'сме', 'мен', 'ена', 'на '.
+        Совпадение по триграммам прощает падежные окончания и опечатки
+    '''
+    result = set()
+    for word in WORD_RE.findall(TAG_RE.sub(' ', text.lower().replace('ё', 'е'))):
+        if len(word) < 3 or word in STOP_WORDS:
+            continue
+        padded = f' {word} '
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+def document(instance):
+    '''
+        Ключ и текст документа для индекса: статьи, смены и места
+    '''
+    if isinstance(instance, OptionalInfo):
+        return ('i', instance.pk), f'{instance.title} {instance.text or ""}'
+    if isinstance(instance, Session):
+        return ('s', instance.pk), f'{instance.title} {instance.description or ""}'
+    if isinstance(instance, Place):
+        return ('p', instance.pk), f'{instance.title} {instance.description or ""}'
+    return None, None
+
+
+class FaqIndex:
+    '''
+        Инвертированный индекс по триграммам в памяти процесса.
+        Строится из среза каталога и пересобирается целиком, когда растёт общая версия каталога,
+        поэтому изменение из любого процесса попадает в индексы всех процессов.
+        Оценка совпадения - доля веса (idf) триграмм вопроса, найденных в документе, от 0 до 1
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings = defaultdict(set)
+        self._documents = {}
+        self._titles = {}
+        self._version = None
+
+    def _add(self, key, title: str, text: str):
+        grams = trigrams(text)
+        self._documents[key] = grams
+        self._titles[key] = title
+        for gram in grams:
+            self._postings[gram].add(key)
+
+    def build(self, snapshot):
+        '''
+            Индекс по объектам среза каталога, без запросов к БД
+        '''
+        with self._lock:
+            if self._version == snapshot.version:
+                return
+            self._postings.clear()
+            self._documents.clear()
+            self._titles.clear()
+            for objects in (snapshot.infos, snapshot.sessions, snapshot.places):
+                for instance in objects.values():
+                    key, text = document(instance)
+                    self._add(key, instance.title, text)
+            self._version = snapshot.version
+
+    def _idf(self, gram: str) -> float:
+        return math.log(1 + len(self._documents) / len(self._postings[gram])) if gram in self._postings else math.log(1 + len(self._documents))
+
+    def search(self, snapshot, text: str, limit: int = 3, threshold: float = 0.0) -> list:
+        '''
+            Лучшие документы для вопроса по срезу каталога: [(оценка, (тег, pk), заголовок)]
+        '''
+        if self._version != snapshot.version:
+            self.build(snapshot)
+
+        query = trigrams(text)
+        if not query:
+            return []
+
+        with self._lock:
+            weights = {gram: self._idf(gram) for gram in query}
+            total = sum(weights.values())
+            scores = defaultdict(float)
+            for gram, weight in weights.items():
+                for key in self._postings.get(gram, ()):
+                    scores[key] += weight
+
+            ranked = sorted(((score / total, key) for key, score in scores.items()), reverse=True)
+            return [(round(score, 3), key, self._titles[key]) for score, key in ranked[:limit] if score >= threshold]
+
+    def stats(self) -> dict:
+        return {'version': self._version or 0, 'documents': len(self._documents), 'trigrams': len(self._postings)}
+
+
+faq_index = FaqIndex()
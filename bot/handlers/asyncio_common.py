@@ -0,0 +1,178 @@
+from django.db import models
+
+from telebot.asyncio_helper import ApiTelegramException
+from telebot.types import InputMediaPhoto, InputMediaDocument
+
+from .. import logger
+from ..media import upload_source
+from .transitions import plan, current_file_id, is_not_modified, transition_stats
+
+
+async def _delete(call, bot, messages_count):
+    ids = [i for i in range(call.message.message_id, call.message.message_id - messages_count, -1)]
+    try:
+        await bot.delete_messages(
+            chat_id=call.message.chat.id,
+            message_ids=ids[::-1],
+        )
+    except ApiTelegramException as e:
+        logger.error('При удалении сообщения возникла ошибка: %s', e)
+
+
+async def replace_message(call, bot, markup, text, messages_count=1):
+    '''
+        Асинхронная версия replace_message из common
+    '''
+    source = call.message.content_type
+    calls = 0
+
+    if plan(source, 'text') == 'edit_text' and messages_count == 1:
+        calls += 1
+        try:
+            message = await bot.edit_message_text(
+                chat_id=call.message.chat.id,
+                message_id=call.message.message_id,
+                text=text,
+                reply_markup=markup,
+                parse_mode='html'
+                )
+            transition_stats.record(source, 'text', 'edit_text', calls)
+            return message
+        except ApiTelegramException as e:
+            if is_not_modified(e):
+                transition_stats.record(source, 'text', 'edit_text', calls)
+                return call.message
+            logger.warning('Не удалось изменить сообщение, оно будет отправлено заново: %s', e)
+
+    await _delete(call, bot, messages_count)
+    message = await bot.send_message(
+        chat_id=call.message.chat.id,
+        text=text,
+        reply_markup=markup,
+        parse_mode='html'
+        )
+    transition_stats.record(source, 'text', 'resend', calls + 2)
+    return message
+
+
+async def _store_file_id(instance: models.Model, field: str, file_id_field: str, name: str, message, as_photo: bool):
+    file_id = message.photo[-1].file_id if as_photo else message.document.file_id
+    # Сохраняем только если файл не успели заменить, пока шла загрузка
+    await type(instance).objects.filter(pk=instance.pk, **{field: name}).aupdate(**{file_id_field: file_id})
+    setattr(instance, file_id_field, file_id)
+
+
+async def _send_file(bot, chat_id, instance: models.Model, field: str, file_id_field: str, as_photo: bool, **kwargs):
+    '''
+        Отправка файла модели: (сообщение, число вызовов API)
+    '''
+    send = bot.send_photo if as_photo else bot.send_document
+    file_id = getattr(instance, file_id_field)
+    calls = 0
+
+    if file_id:
+        calls += 1
+        try:
+            return await send(chat_id, file_id, **kwargs), calls
+        except ApiTelegramException as e:
+            logger.warning('file_id для %s не принят Telegram, файл будет загружен заново: %s', instance, e)
+
+    file_field = getattr(instance, field)
+    path, thumbnail = upload_source(instance)
+    if thumbnail is not None and not as_photo:
+        kwargs['thumbnail'] = thumbnail
+    with open(path, 'rb') as file:
+        message = await send(chat_id, file, **kwargs)
+
+    await _store_file_id(instance, field, file_id_field, file_field.name, message, as_photo)
+    return message, calls + 1
+
+
+async def send_cached_file(bot, chat_id, instance: models.Model, field: str, file_id_field: str, as_photo: bool, **kwargs):
+    '''
+        Асинхронная версия send_cached_file из common
+    '''
+    return (await _send_file(bot, chat_id, instance, field, file_id_field, as_photo, **kwargs))[0]
+
+
+async def _edit_media(call, bot, instance: models.Model, field: str, file_id_field: str, as_photo: bool, caption, markup):
+    '''
+        Замена файла в сообщении: (сообщение или None при неудаче, число вызовов API)
+    '''
+    media = InputMediaPhoto if as_photo else InputMediaDocument
+    file_id = getattr(instance, file_id_field)
+    kwargs = dict(chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=markup)
+    calls = 0
+
+    if file_id:
+        calls += 1
+        try:
+            return await bot.edit_message_media(media(file_id, caption=caption, parse_mode='html'), **kwargs), calls
+        except ApiTelegramException as e:
+            if is_not_modified(e):
+                return call.message, calls
+            logger.warning('file_id для %s не принят Telegram, файл будет загружен заново: %s', instance, e)
+
+    file_field = getattr(instance, field)
+    path, _ = upload_source(instance)
+    calls += 1
+    try:
+        with open(path, 'rb') as file:
+            message = await bot.edit_message_media(media(file, caption=caption, parse_mode='html'), **kwargs)
+    except ApiTelegramException as e:
+        logger.warning('Не удалось заменить файл в сообщении, оно будет отправлено заново: %s', e)
+        return None, calls
+
+    await _store_file_id(instance, field, file_id_field, file_field.name, message, as_photo)
+    return message, calls
+
+
+async def replace_with_file(call, bot, instance: models.Model, field: str, file_id_field: str, as_photo: bool, caption, markup):
+    '''
+        Асинхронная версия replace_with_file из common
+    '''
+    source = call.message.content_type
+    target = 'photo' if as_photo else 'document'
+    file_id = getattr(instance, file_id_field)
+    operation = plan(source, target, same_file=bool(file_id) and file_id == current_file_id(call.message))
+    calls = 0
+
+    if operation == 'edit_caption':
+        calls += 1
+        try:
+            message = await bot.edit_message_caption(
+                caption=caption,
+                chat_id=call.message.chat.id,
+                message_id=call.message.message_id,
+                reply_markup=markup,
+                parse_mode='html'
+                )
+            transition_stats.record(source, target, operation, calls)
+            return message
+        except ApiTelegramException as e:
+            if is_not_modified(e):
+                transition_stats.record(source, target, operation, calls)
+                return call.message
+            operation = 'edit_media'
+
+    if operation == 'edit_media':
+        message, edit_calls = await _edit_media(call, bot, instance, field, file_id_field, as_photo, caption, markup)
+        calls += edit_calls
+        if message is not None:
+            transition_stats.record(source, target, operation, calls)
+            return message
+
+    await _delete(call, bot, 1)
+    message, send_calls = await _send_file(
+        bot,
+        call.message.chat.id,
+        instance,
+        field,
+        file_id_field,
+        as_photo,
+        caption=caption,
+        reply_markup=markup,
+        parse_mode='html'
+        )
+    transition_stats.record(source, target, 'resend', calls + 1 + send_calls)
+    return message
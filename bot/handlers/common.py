@@ -1,49 +1,234 @@
-from ..models import Session, Place
+from html import escape
 
+from django.db import models
 
-def replace_message(call, bot, markup, text, messages_count=1):
+from telebot.apihelper import ApiTelegramException
+from telebot.types import InputMediaPhoto, InputMediaDocument
+
+from .. import logger
+from ..media import upload_source
+from ..rendering import MESSAGE_MAX_LENGTH, visible_length
+from .transitions import plan, current_file_id, is_not_modified, transition_stats
+
+
+# Тексты сообщений, общие для синхронного и асинхронного рантайма
+HELP_TEXT = "Отправьте интересующий вопрос или проблему. Этот текст будет перенаправлен для дальнейшей консультации"
+HELP_SENT_TEXT = 'Ваше сообщение доставлено в службу поддержки. Вы так же можете написать лично:\n\n' \
+    '<a href="t.me/oksanozka1207">Оксана Николаевна</a>\n' \
+    '<a href="t.me/zilfia17">Зульфия Ахнафовна</a>'
+SESSIONS_TEXT = 'Вот список всех смен:'
+SESSIONS_RETURN_TEXT = 'Вот список смен'
+NO_SESSIONS_TEXT = 'Смен пока нет)'
+SESSION_NOT_FOUND_TEXT = 'Приносим извинения, смена не найдена('
+PLACES_TEXT = 'Это места, где обычно проходят смены. О каком месте Вы хотите узнать?'
+NO_PLACES_TEXT = 'Мест пока нет)'
+PLACE_NOT_FOUND_TEXT = 'Приносим извинения, данное место не найдено'
+INFOS_TEXT = 'Вот статьи, которые помогут Вам ответить на некоторые вопросов:'
+NO_INFOS_TEXT = 'Пока что нам нечего Вам рассказать)'
+INFO_NOT_FOUND_TEXT = 'Приносим извинения, статья не найдена'
+FAQ_TEXT = 'Возможно, ответ на Ваш вопрос уже есть здесь. Если нет, вопрос можно отправить в службу поддержки'
+FAQ_EXPIRED_TEXT = 'Вопрос не найден. Отправьте /help и напишите его ещё раз'
+
+# Списки главного меню: действие -> (объекты, тег кнопок, текст, текст для пустого списка)
+MAIN_LISTS = {
+    'sessions': ('sessions', 's', SESSIONS_TEXT, NO_SESSIONS_TEXT),
+    'places': ('places', 'p', PLACES_TEXT, NO_PLACES_TEXT),
+    'more_info': ('infos', 'i', INFOS_TEXT, NO_INFOS_TEXT),
+}
+
+
+def format_help_digest(user: str, texts: list) -> list:
+    '''
+        Сообщения админам с запросами одного пользователя.
+        Запросы, которые не помещаются в одно сообщение, переносятся в следующее.
+        Длина считается так, как её считает Telegram - без разметки, а обрезается исходный текст,
+        чтобы не разрезать html-сущность
+    '''
+    header = f'<strong>Пользователь {escape(user)}</strong> попросил о помощи:'
+    header_length = visible_length(header)
+    messages = []
+    text, length = header, header_length
+    for request in texts:
+        # Два символа на кавычки и два на отступ перед запросом
+        request = request[:MESSAGE_MAX_LENGTH - header_length - 4]
+        if length + len(request) + 4 > MESSAGE_MAX_LENGTH:
+            messages.append(text)
+            text, length = header, header_length
+        text += f'\n\n"{escape(request)}"'
+        length += len(request) + 4
+    messages.append(text)
+    return messages
+
+
+def _delete(call, bot, messages_count):
+    ids = [i for i in range(call.message.message_id, call.message.message_id - messages_count, -1)]
     try:
-        return bot.edit_message_text(
-            chat_id=call.message.chat.id, 
-            message_id=call.message.message_id, 
-            text=text, 
-            reply_markup=markup,
-            parse_mode='html'
-            )
-            
-    except Exception as e:
-        ids = [i for i in range(call.message.message_id, call.message.message_id - messages_count, -1)] 
-        print(ids)
         bot.delete_messages(
-            chat_id=call.message.chat.id, 
+            chat_id=call.message.chat.id,
             message_ids=ids[::-1],
         )
-        return bot.send_message(
-                chat_id=call.message.chat.id, 
-                text=text, 
+    except ApiTelegramException as e:
+        logger.error('При удалении сообщения возникла ошибка: %s', e)
+
+
+def replace_message(call, bot, markup, text, messages_count=1):
+    '''
+        Замена сообщения текстом. Текстовое сообщение редактируется,
+        фото, документ и геопозиция удаляются и отправляются заново
+    '''
+    source = call.message.content_type
+    calls = 0
+
+    if plan(source, 'text') == 'edit_text' and messages_count == 1:
+        calls += 1
+        try:
+            message = bot.edit_message_text(
+                chat_id=call.message.chat.id,
+                message_id=call.message.message_id,
+                text=text,
                 reply_markup=markup,
                 parse_mode='html'
                 )
+            transition_stats.record(source, 'text', 'edit_text', calls)
+            return message
+        except ApiTelegramException as e:
+            if is_not_modified(e):
+                transition_stats.record(source, 'text', 'edit_text', calls)
+                return call.message
+            logger.warning('Не удалось изменить сообщение, оно будет отправлено заново: %s', e)
+
+    _delete(call, bot, messages_count)
+    message = bot.send_message(
+        chat_id=call.message.chat.id,
+        text=text,
+        reply_markup=markup,
+        parse_mode='html'
+        )
+    transition_stats.record(source, 'text', 'resend', calls + 2)
+    return message
+
+
+def _store_file_id(instance: models.Model, field: str, file_id_field: str, name: str, message, as_photo: bool):
+    file_id = message.photo[-1].file_id if as_photo else message.document.file_id
+    # Сохраняем только если файл не успели заменить, пока шла загрузка
+    type(instance).objects.filter(pk=instance.pk, **{field: name}).update(**{file_id_field: file_id})
+    setattr(instance, file_id_field, file_id)
 
 
-def format_session_text(session: Session):
-    text = f'🏕️ Смена <strong>«{session.title}»</strong>'
-    if not session.place is None:
-        text += f'\n\n🗺️ Место проведения: <strong>{session.place.title}</strong>'
-    
-    if not (session.start_date is None or session.end_date is None):
-        text += f"\n📆 Даты: <strong>{str(session.start_date).replace('-', '.')}–{str(session.end_date).replace('-', '.')}</strong>"
-    
-    if not session.description is None:
-        text += f'\n\n{session.description}'
-        
-    return text
+def _send_file(bot, chat_id, instance: models.Model, field: str, file_id_field: str, as_photo: bool, **kwargs):
+    '''
+        Отправка файла модели: (сообщение, число вызовов API)
+    '''
+    send = bot.send_photo if as_photo else bot.send_document
+    file_id = getattr(instance, file_id_field)
+    calls = 0
 
+    if file_id:
+        calls += 1
+        try:
+            return send(chat_id, file_id, **kwargs), calls
+        except ApiTelegramException as e:
+            logger.warning('file_id для %s не принят Telegram, файл будет загружен заново: %s', instance, e)
 
-def format_place_text(place: Place):
-    text = f'<strong>«{place.title}»</strong>'
+    file_field = getattr(instance, field)
+    path, thumbnail = upload_source(instance)
+    if thumbnail is not None and not as_photo:
+        kwargs['thumbnail'] = thumbnail
+    with open(path, 'rb') as file:
+        message = send(chat_id, file, **kwargs)
 
-    if not place.description is None:
-        text += f'\n\n{place.description}'
-    
-    return text
\ No newline at end of file
+    _store_file_id(instance, field, file_id_field, file_field.name, message, as_photo)
+    return message, calls + 1
+
+
+def send_cached_file(bot, chat_id, instance: models.Model, field: str, file_id_field: str, as_photo: bool, **kwargs):
+    '''
+        Отправка файла модели с переиспользованием file_id.
+        Файл загружается в Telegram только если file_id ещё не сохранён или устарел
+    '''
+    return _send_file(bot, chat_id, instance, field, file_id_field, as_photo, **kwargs)[0]
+
+
+def _edit_media(call, bot, instance: models.Model, field: str, file_id_field: str, as_photo: bool, caption, markup):
+    '''
+        Замена файла в сообщении: (сообщение или None при неудаче, число вызовов API)
+    '''
+    media = InputMediaPhoto if as_photo else InputMediaDocument
+    file_id = getattr(instance, file_id_field)
+    kwargs = dict(chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=markup)
+    calls = 0
+
+    if file_id:
+        calls += 1
+        try:
+            return bot.edit_message_media(media(file_id, caption=caption, parse_mode='html'), **kwargs), calls
+        except ApiTelegramException as e:
+            if is_not_modified(e):
+                return call.message, calls
+            logger.warning('file_id для %s не принят Telegram, файл будет загружен заново: %s', instance, e)
+
+    file_field = getattr(instance, field)
+    path, _ = upload_source(instance)
+    calls += 1
+    try:
+        with open(path, 'rb') as file:
+            message = bot.edit_message_media(media(file, caption=caption, parse_mode='html'), **kwargs)
+    except ApiTelegramException as e:
+        logger.warning('Не удалось заменить файл в сообщении, оно будет отправлено заново: %s', e)
+        return None, calls
+
+    _store_file_id(instance, field, file_id_field, file_field.name, message, as_photo)
+    return message, calls
+
+
+def replace_with_file(call, bot, instance: models.Model, field: str, file_id_field: str, as_photo: bool, caption, markup):
+    '''
+        Замена сообщения файлом модели самой дешёвой операцией:
+        подпись, если файл тот же, edit_message_media для фото и документов,
+        удаление и новая отправка для текста и геопозиции
+    '''
+    source = call.message.content_type
+    target = 'photo' if as_photo else 'document'
+    file_id = getattr(instance, file_id_field)
+    operation = plan(source, target, same_file=bool(file_id) and file_id == current_file_id(call.message))
+    calls = 0
+
+    if operation == 'edit_caption':
+        calls += 1
+        try:
+            message = bot.edit_message_caption(
+                caption=caption,
+                chat_id=call.message.chat.id,
+                message_id=call.message.message_id,
+                reply_markup=markup,
+                parse_mode='html'
+                )
+            transition_stats.record(source, target, operation, calls)
+            return message
+        except ApiTelegramException as e:
+            if is_not_modified(e):
+                transition_stats.record(source, target, operation, calls)
+                return call.message
+            operation = 'edit_media'
+
+    if operation == 'edit_media':
+        message, edit_calls = _edit_media(call, bot, instance, field, file_id_field, as_photo, caption, markup)
+        calls += edit_calls
+        if message is not None:
+            transition_stats.record(source, target, operation, calls)
+            return message
+
+    _delete(call, bot, 1)
+    message, send_calls = _send_file(
+        bot,
+        call.message.chat.id,
+        instance,
+        field,
+        file_id_field,
+        as_photo,
+        caption=caption,
+        reply_markup=markup,
+        parse_mode='html'
+        )
+    transition_stats.record(source, target, 'resend', calls + 1 + send_calls)
+    return message
@@ -0,0 +1,57 @@
+import threading
+from collections import Counter
+
+# Типы сообщений, которые можно заменить через edit_message_media
+MEDIA_TYPES = ('photo', 'document')
+
+
+def plan(source: str, target: str, same_file: bool = False) -> str:
+    '''
+        Самая дешёвая операция для замены сообщения типа source на сообщение типа target:
+        edit_text, edit_caption, edit_media или resend (удаление и новая отправка)
+    '''
+    if target == 'text':
+        return 'edit_text' if source == 'text' else 'resend'
+
+    if source in MEDIA_TYPES:
+        return 'edit_caption' if same_file else 'edit_media'
+    return 'resend'
+
+
+def current_file_id(message):
+    '''
+        file_id файла в текущем сообщении, если он есть
+    '''
+    if message.content_type == 'photo':
+        return message.photo[-1].file_id
+    if message.content_type == 'document':
+        return message.document.file_id
+    return None
+
+
+def is_not_modified(exception) -> bool:
+    return 'message is not modified' in str(exception)
+
+
+class TransitionStats:
+    '''
+        Счётчики переходов между сообщениями и потраченных на них вызовов API
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.transitions = Counter()
+        self.calls = Counter()
+
+    def record(self, source: str, target: str, operation: str, calls: int):
+        key = f'{source}->{target}:{operation}'
+        with self._lock:
+            self.transitions[key] += 1
+            self.calls[key] += calls
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {key: {'count': count, 'calls': self.calls[key]} for key, count in self.transitions.items()}
+
+
+transition_stats = TransitionStats()
@@ -0,0 +1,39 @@
+import json
+
+from django.conf import settings
+
+from telebot import TeleBot, logger
+
+# Данные бота, прочитанные из файла или полученные от Telegram
+_identity = None
+
+
+def load_identity():
+    '''
+        Данные бота (id, username) из файла без обращения к Telegram
+    '''
+    global _identity
+    if _identity is None:
+        try:
+            with open(settings.BOT_IDENTITY_FILE, encoding='utf-8') as file:
+                _identity = json.load(file)
+        except (OSError, ValueError):
+            return None
+    return _identity
+
+
+def register_bot(bot: TeleBot, commands) -> dict:
+    '''
+        Регистрация команд и сохранение данных бота.
+        Выполняется один раз при развёртывании, а не при каждом запуске процесса
+    '''
+    global _identity
+    bot.set_my_commands(commands)
+    me = bot.get_me()
+    _identity = {'id': me.id, 'username': me.username, 'first_name': me.first_name}
+
+    with open(settings.BOT_IDENTITY_FILE, 'w', encoding='utf-8') as file:
+        json.dump(_identity, file, ensure_ascii=False)
+
+    logger.info('@%s registered', me.username)
+    return _identity
@@ -0,0 +1,114 @@
+import queue
+import threading
+import time
+
+from django.db import close_old_connections
+
+from telebot.types import Update
+
+from . import logger
+from .metrics import queue_wait
+
+
+def update_chat_id(update: Update) -> int:
+    '''
+        Чат, к которому относится обновление. Используется как ключ шардирования
+    '''
+    for name in ('message', 'edited_message', 'channel_post', 'edited_channel_post', 'my_chat_member', 'chat_member', 'chat_join_request'):
+        obj = getattr(update, name, None)
+        if obj is not None:
+            return obj.chat.id
+
+    callback = update.callback_query
+    if callback is not None:
+        if callback.message is not None:
+            return callback.message.chat.id
+        return callback.from_user.id
+
+    for name in ('inline_query', 'chosen_inline_result', 'shipping_query', 'pre_checkout_query'):
+        obj = getattr(update, name, None)
+        if obj is not None:
+            return obj.from_user.id
+
+    return update.update_id
+
+
+class UpdateQueue:
+    '''
+        Диспетчер входящих обновлений.
+        Обновления раскладываются по шардам по chat_id: в пределах одного чата
+        они обрабатываются строго по порядку, разные чаты - параллельно.
+        Вебхук только кладёт обновление в очередь шарда и сразу отвечает Telegram
+    '''
+
+    def __init__(self, handler, shard_size: int, workers: int):
+        self.handler = handler
+        self.workers = workers
+        self._queues = [queue.Queue(maxsize=shard_size) for _ in range(workers)]
+        self._threads = []
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    @property
+    def depth(self) -> int:
+        return sum(shard.qsize() for shard in self._queues)
+
+    @property
+    def maxsize(self) -> int:
+        return sum(shard.maxsize for shard in self._queues)
+
+    def start(self):
+        '''
+            Запуск обработчиков, по одному на шард. Выполняется один раз при первом обновлении
+        '''
+        with self._lock:
+            if self._threads:
+                return
+            for number, shard in enumerate(self._queues):
+                thread = threading.Thread(target=self._work, args=(shard,), name=f'bot-shard-{number}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, update: Update) -> bool:
+        '''
+            Постановка обновления в очередь шарда. False, если очередь шарда заполнена
+        '''
+        if not self._threads:
+            self.start()
+
+        shard = self._queues[update_chat_id(update) % self.workers]
+        try:
+            shard.put_nowait((time.monotonic(), update))
+        except queue.Full:
+            self.rejected += 1
+            return False
+        return True
+
+    def join(self):
+        '''
+            Ожидание обработки всех принятых обновлений
+        '''
+        for shard in self._queues:
+            shard.join()
+
+    def stats(self) -> dict:
+        return {
+            'depth': self.depth,
+            'maxsize': self.maxsize,
+            'workers': self.workers,
+            'rejected': self.rejected,
+            'shards': [shard.qsize() for shard in self._queues],
+        }
+
+    def _work(self, shard: queue.Queue):
+        while True:
+            queued, update = shard.get()
+            queue_wait.observe(time.monotonic() - queued)
+            close_old_connections()
+            try:
+                self.handler(update)
+            except Exception as e:
+                logger.error('Ошибка обработки обновления %s: %s', update.update_id, e, exc_info=True)
+            finally:
+                close_old_connections()
+                shard.task_done()
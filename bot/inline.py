@@ -0,0 +1,174 @@
+import re
+import threading
+from bisect import bisect_left
+
+from telebot.types import (
+    InlineKeyboardButton, InlineKeyboardMarkup, InputTextMessageContent,
+    InlineQueryResultArticle, InlineQueryResultCachedPhoto, InlineQueryResultCachedDocument, InlineQueryResultsButton,
+)
+
+from .catalog import CatalogSnapshot
+from .rendering import TAG_RE
+
+WORD_RE = re.compile(r'\w+')
+# Длина подписи под результатом в списке
+DESCRIPTION_LENGTH = 100
+
+# Кнопка над результатами: переход в личный чат с ботом (/start inline)
+inline_button = InlineQueryResultsButton(text='Открыть бота', start_parameter='inline')
+
+
+def words(text: str) -> list:
+    return WORD_RE.findall(text.lower().replace('ё', 'е'))
+
+
+def _description(text: str) -> str:
+    text = ' '.join(TAG_RE.sub(' ', text or '').split())
+    return text if len(text) <= DESCRIPTION_LENGTH else text[:DESCRIPTION_LENGTH - 1] + '…'
+
+
+def _session_result(session):
+    '''
+        Постер смены из кэша Telegram или текст, если постер ещё не загружался
+    '''
+    text = session.message_text()
+    markup = None
+    if not session.form_url is None and session.form_url.strip() != '':
+        markup = InlineKeyboardMarkup(keyboard=[[InlineKeyboardButton(text='Записаться!', url=session.form_url)]])
+
+    if session.image_file_id:
+        return InlineQueryResultCachedPhoto(
+            id=f's{session.pk}', photo_file_id=session.image_file_id, title=session.title,
+            description=_description(session.description), caption=text, parse_mode='html', reply_markup=markup,
+        )
+    return InlineQueryResultArticle(
+        id=f's{session.pk}', title=f'🏕️ {session.title}', description=_description(session.description),
+        input_message_content=InputTextMessageContent(text, parse_mode='html'), reply_markup=markup,
+    )
+
+
+def _place_result(place):
+    return InlineQueryResultArticle(
+        id=f'p{place.pk}', title=f'🗺️ {place.title}', description=_description(place.description),
+        input_message_content=InputTextMessageContent(place.message_text(), parse_mode='html'),
+    )
+
+
+def _info_result(info):
+    '''
+        Файл без file_id в inline-режиме не отправить, такая статья уходит текстом
+    '''
+    if info.file_id and info.is_photo:
+        return InlineQueryResultCachedPhoto(
+            id=f'i{info.pk}', photo_file_id=info.file_id, title=info.title,
+            description=_description(info.text), caption=info.message_text(), parse_mode='html',
+        )
+    if info.file_id:
+        return InlineQueryResultCachedDocument(
+            id=f'i{info.pk}', document_file_id=info.file_id, title=info.title,
+            description=_description(info.text), caption=info.message_text(), parse_mode='html',
+        )
+    return InlineQueryResultArticle(
+        id=f'i{info.pk}', title=f'📄 {info.title}', description=_description(info.text),
+        input_message_content=InputTextMessageContent(info.message_text(), parse_mode='html'),
+    )
+
+
+class InlineIndex:
+    '''
+        Готовые результаты inline-режима для одного среза каталога
+        и отсортированный список слов названий для поиска по префиксу
+    '''
+
+    def __init__(self, snapshot: CatalogSnapshot):
+        self.version = snapshot.version
+        # (объект, сборка результата, поле file_id) в порядке выдачи
+        self._sources = []
+        names = []
+        for session in snapshot.sessions.values():
+            self._sources.append((session, _session_result, 'image_file_id'))
+            names.append(f'{session.title} {session.place.title if session.place else ""}')
+        for place in snapshot.places.values():
+            self._sources.append((place, _place_result, None))
+            names.append(place.title)
+        for info in snapshot.infos.values():
+            self._sources.append((info, _info_result, 'file_id'))
+            names.append(info.title)
+
+        self.results = [build(obj) for obj, build, _ in self._sources]
+        self._file_ids = [getattr(obj, field) if field else None for obj, _, field in self._sources]
+        self._words = sorted({(word, position) for position, name in enumerate(names) for word in words(name)})
+
+    def _result(self, position: int):
+        '''
+            Готовый результат. После первой отправки файла в срезе появляется его file_id,
+            и текст заменяется на файл из кэша Telegram
+        '''
+        obj, build, field = self._sources[position]
+        file_id = getattr(obj, field) if field else None
+        if file_id != self._file_ids[position]:
+            self.results[position] = build(obj)
+            self._file_ids[position] = file_id
+        return self.results[position]
+
+    def _prefix(self, prefix: str) -> set:
+        start = bisect_left(self._words, (prefix,))
+        found = set()
+        for word, position in self._words[start:]:
+            if not word.startswith(prefix):
+                break
+            found.add(position)
+        return found
+
+    def search(self, query: str, offset: int, limit: int):
+        '''
+            Страница результатов, где каждое слово запроса - начало слова в названии.
+            Возвращает (результаты, next_offset)
+        '''
+        positions = None
+        for prefix in words(query):
+            found = self._prefix(prefix)
+            positions = found if positions is None else positions & found
+            if not positions:
+                return [], ''
+
+        ordered = range(len(self.results)) if positions is None else sorted(positions)
+        page = [self._result(position) for position in ordered[offset:offset + limit]]
+        next_offset = str(offset + limit) if offset + limit < len(ordered) else ''
+        return page, next_offset
+
+
+class InlineCatalog:
+    '''
+        Индекс inline-режима, пересобирается вместе с каталогом.
+        Ключ - версия среза, а она общая для всех процессов, поэтому
+        изменение из админки или другого процесса меняет индекс и здесь
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index = None
+
+    def get(self, snapshot: CatalogSnapshot) -> InlineIndex:
+        index = self._index
+        if index is not None and index.version == snapshot.version:
+            return index
+
+        with self._lock:
+            if self._index is None or self._index.version != snapshot.version:
+                self._index = InlineIndex(snapshot)
+            return self._index
+
+    def stats(self) -> dict:
+        index = self._index
+        return {'results': len(index.results) if index else 0, 'words': len(index._words) if index else 0}
+
+
+inline_catalog = InlineCatalog()
+
+
+def parse_offset(offset: str) -> int:
+    try:
+        return max(0, int(offset or 0))
+    except ValueError:
+        return 0
@@ -0,0 +1,149 @@
+import atexit
+import copy
+import json
+import logging
+import queue
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, WatchedFileHandler
+
+# Поля обновления, которые попадают в каждую запись лога
+FIELDS = ('update_id', 'chat_id', 'handler')
+_context = {name: ContextVar(f'log_{name}', default=None) for name in FIELDS}
+
+# Формат вывода в консоль, как у telebot
+CONSOLE_FORMAT = '%(asctime)s (%(filename)s:%(lineno)d %(threadName)s) %(levelname)s - %(name)s: "%(message)s"'
+
+_listener = None
+# Текст исключения для записей, которые уходят в очередь
+_exception_formatter = logging.Formatter()
+
+
+@contextmanager
+def log_context(**values):
+    '''
+        Значения update_id, chat_id и handler для записей лога внутри блока
+    '''
+    tokens = [(_context[name], _context[name].set(value)) for name, value in values.items()]
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+class SamplingFilter(logging.Filter):
+    '''
+        Пропускает только долю rate записей уровня DEBUG
+    '''
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno > logging.DEBUG or self.rate >= 1 or random.random() < self.rate
+
+
+class ContextFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        for name, var in _context.items():
+            setattr(record, name, var.get())
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    '''
+        Одна запись - одна строка JSON
+    '''
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'thread': record.threadName,
+            'source': f'{record.module}:{record.lineno}',
+        }
+        for name in FIELDS:
+            value = getattr(record, name, None)
+            if value is not None:
+                data[name] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exc'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class DeferredQueueHandler(QueueHandler):
+    '''
+        В очередь уходит запись с уже подставленными аргументами и текстом исключения:
+        args могут измениться, а исключение - быть перехвачено заново, пока запись ждёт в очереди.
+        Дорогая часть - JSON, формат консоли и запись на диск - выполняется в потоке QueueListener,
+        а не в обработчике обновления, поэтому полное форматирование стандартного QueueHandler не нужно
+    '''
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = _exception_formatter.formatException(record.exc_info)
+            # Traceback держит кадры стека обработчика, в очередь он не передаётся
+            record.exc_info = None
+        return record
+
+
+def file_handler_for(filename, rotate: str = 'size', max_bytes: int = 10 * 1024 * 1024, backups: int = 5) -> logging.Handler:
+    '''
+        'size' - ротация по размеру, только для одного процесса.
+        'external' - файл ротирует logrotate, обработчик переоткрывает его после переименования,
+        и несколько процессов дописывают строки в один файл
+    '''
+    if rotate == 'external':
+        return WatchedFileHandler(filename, encoding='utf-8')
+    if rotate == 'size':
+        return RotatingFileHandler(filename, maxBytes=max_bytes, backupCount=backups, encoding='utf-8')
+    raise ValueError(f'Неизвестный способ ротации лога: {rotate}')
+
+
+def setup_logging(filename, level: str = 'INFO', max_bytes: int = 10 * 1024 * 1024, backups: int = 5, debug_sample: float = 1.0,
+                  rotate: str = 'size'):
+    '''
+        Логи бота и Django: очередь в памяти, JSON в файл и текст в консоль.
+        Выполняется один раз при импорте бота
+    '''
+    global _listener
+    if _listener is not None:
+        return
+
+    file_handler = file_handler_for(filename, rotate, max_bytes, backups)
+    file_handler.setFormatter(JsonFormatter())
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    handler = DeferredQueueHandler(log_queue)
+    # Сначала выборка, чтобы отброшенные записи не собирали контекст
+    handler.addFilter(SamplingFilter(debug_sample))
+    handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    # У telebot свой обработчик консоли, вывод теперь идёт через очередь
+    telebot_logger = logging.getLogger('TeleBot')
+    for existing in list(telebot_logger.handlers):
+        telebot_logger.removeHandler(existing)
+    telebot_logger.setLevel(level)
+
+    _listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
@@ -0,0 +1,143 @@
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection, connections, transaction, OperationalError
+from django.db.models import F
+
+from bot.models import ChatState, Session
+from bot.metrics import percentile
+from bot.routers import handler_reads
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочный прогон БД: чтение как в обработчиках бота параллельно с записью как из админки. ' \
+           'Запускается с DATABASE_PROFILE=default и production для сравнения. ' \
+           'Прогон идёт на временной копии БД, рабочий файл не меняется'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=8, help='Потоков чтения (обработчики бота)')
+        parser.add_argument('--writers', type=int, default=1, help='Потоков записи (сохранения в админке)')
+        parser.add_argument('--seconds', type=float, default=5, help='Длительность прогона')
+        parser.add_argument('--hold', type=float, default=0.02, help='Сколько секунд транзакция записи держит блокировку')
+        parser.add_argument('--pause', type=float, default=0.05, help='Пауза между записями, с')
+        parser.add_argument('--json', action='store_true', help='Отчёт в JSON')
+
+    def _worker(self, operation, deadline: float, latencies: list, errors: list, pause: float = 0):
+        try:
+            while time.monotonic() < deadline:
+                start = time.perf_counter()
+                try:
+                    operation()
+                    latencies.append(time.perf_counter() - start)
+                except OperationalError as e:
+                    errors.append(str(e))
+                finally:
+                    # Конец запроса: соединение закрывается или остаётся по CONN_MAX_AGE
+                    close_old_connections()
+                if pause:
+                    time.sleep(pause)
+        finally:
+            connections.close_all()
+
+    def _use_copy(self, source: str, copy: str):
+        '''
+            Копия БД через backup API SQLite (корректна и для файла в режиме WAL),
+            все алиасы переключаются на неё
+        '''
+        connections.close_all()
+        with sqlite3.connect(source) as src, sqlite3.connect(copy) as dst:
+            src.backup(dst)
+        for alias in connections:
+            name = connections.settings[alias]['NAME']
+            connections.settings[alias]['NAME'] = str(name).replace(source, copy)
+
+    def handle(self, *args, **options):
+        source = str(connections.settings['default']['NAME'])
+        directory = tempfile.mkdtemp(prefix='bench_db_')
+        try:
+            self._use_copy(source, os.path.join(directory, 'bench.sqlite3'))
+            self._bench(options)
+        finally:
+            connections.close_all()
+            for alias in connections:
+                connections.settings[alias]['NAME'] = str(connections.settings[alias]['NAME']).replace(
+                    os.path.join(directory, 'bench.sqlite3'), source)
+            for name in os.listdir(directory):
+                os.remove(os.path.join(directory, name))
+            os.rmdir(directory)
+
+    def _bench(self, options):
+        pks = list(Session.objects.values_list('pk', flat=True))
+        if not pks:
+            raise CommandError('Нужна хотя бы одна смена: прогон читает и перезаписывает существующие строки')
+        with connection.cursor() as cursor:
+            # Режим журнала хранится в файле, копия могла унаследовать WAL: для профиля default
+            # базовый режим с журналом отката выставляется явно
+            cursor.execute('PRAGMA journal_mode' if settings.DATABASE_PROFILE == 'production' else 'PRAGMA journal_mode=DELETE')
+            journal_mode = cursor.fetchone()[0]
+        connections.close_all()
+
+        def read():
+            # Нажатие кнопки: состояние диалога и страница списка смен
+            with handler_reads():
+                ChatState.objects.filter(key=f'bench:{random.randint(1, 1000)}').first()
+                list(Session.objects.only('title').order_by('pk')[:settings.BOT_MENU_PAGE_SIZE + 1])
+
+        def write():
+            # Сохранение в админке: транзакция с записью, которая держит блокировку hold секунд
+            with transaction.atomic():
+                Session.objects.filter(pk=random.choice(pks)).update(title=F('title'))
+                time.sleep(options['hold'])
+
+        reads, read_errors, writes, write_errors = [], [], [], []
+        deadline = time.monotonic() + options['seconds']
+        threads = [threading.Thread(target=self._worker, args=(read, deadline, reads, read_errors)) for _ in range(options['readers'])]
+        threads += [threading.Thread(target=self._worker, args=(write, deadline, writes, write_errors, options['pause']))
+                    for _ in range(options['writers'])]
+
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        reads.sort()
+        writes.sort()
+        report = {
+            'profile': settings.DATABASE_PROFILE,
+            'journal_mode': journal_mode,
+            'read_alias': 'replica' if 'replica' in settings.DATABASES else 'default',
+            'conn_max_age': settings.DATABASES['default'].get('CONN_MAX_AGE', 0),
+            'seconds': round(elapsed, 3),
+            'reads_per_second': round(len(reads) / elapsed, 1),
+            'read_ms': {
+                'p50': round(percentile(reads, 50) * 1000, 2),
+                'p95': round(percentile(reads, 95) * 1000, 2),
+                'p99': round(percentile(reads, 99) * 1000, 2),
+            },
+            'writes_per_second': round(len(writes) / elapsed, 1),
+            'write_p95_ms': round(percentile(writes, 95) * 1000, 2),
+            'errors': {'read': len(read_errors), 'write': len(write_errors)},
+        }
+        if read_errors or write_errors:
+            report['first_error'] = (read_errors or write_errors)[0]
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, ensure_ascii=False, indent=2))
+            return
+
+        self.stdout.write(f"Профиль {report['profile']}: journal_mode={report['journal_mode']}, чтение через {report['read_alias']}, "
+                          f"CONN_MAX_AGE={report['conn_max_age']}")
+        read_ms = report['read_ms']
+        self.stdout.write(f"Чтение: {report['reads_per_second']}/с, мс: p50 {read_ms['p50']}, p95 {read_ms['p95']}, p99 {read_ms['p99']}")
+        self.stdout.write(f"Запись: {report['writes_per_second']}/с, p95 {report['write_p95_ms']} мс")
+        self.stdout.write(f"Ошибки: чтение {report['errors']['read']}, запись {report['errors']['write']}"
+                          + (f" ({report['first_error']})" if 'first_error' in report else ''))
@@ -0,0 +1,256 @@
+import asyncio
+import itertools
+import json
+import random
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from telebot import apihelper, asyncio_helper
+
+from bot import outbound, metrics
+from bot.metrics import percentile
+from bot.callbacks import encode
+from bot.fakeapi import FakeBotAPI, serve_in_thread
+from bot.models import Session, Place, OptionalInfo
+
+# Доли сценариев в синтетическом потоке
+SCENARIOS = (
+    ('sessions', 4),
+    ('places', 2),
+    ('infos', 2),
+    ('menu', 1),
+    ('help', 1),
+)
+
+
+class UpdateFactory:
+    '''
+        Синтетические обновления Telegram: команды, сообщения и нажатия кнопок
+    '''
+
+    def __init__(self, seed: int):
+        self.random = random.Random(seed)
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self.sessions = list(Session.objects.values_list('pk', flat=True))
+        self.places = list(Place.objects.values_list('pk', flat=True))
+        self.infos = list(OptionalInfo.objects.values_list('pk', flat=True))
+
+    def _user(self, chat_id: int) -> dict:
+        return {'id': chat_id, 'is_bot': False, 'first_name': f'user{chat_id}', 'username': f'user{chat_id}'}
+
+    def message(self, chat_id: int, text: str) -> dict:
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': self._user(chat_id),
+            'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]
+        return {'update_id': next(self._update_ids), 'message': message}
+
+    def tap(self, chat_id: int, data: str) -> dict:
+        return {'update_id': next(self._update_ids), 'callback_query': {
+            'id': str(next(self._update_ids)),
+            'from': self._user(chat_id),
+            'chat_instance': str(chat_id),
+            'data': data,
+            'message': {
+                'message_id': next(self._message_ids),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'from': {'id': 123456, 'is_bot': True, 'first_name': 'NIKA'},
+                'text': '...',
+            },
+        }}
+
+    def _drill(self, chat_id: int, menu: str, tag: str, pks: list):
+        yield self.tap(chat_id, encode('m', menu))
+        for _ in range(self.random.randint(1, 3)):
+            if pks:
+                yield self.tap(chat_id, encode(tag, self.random.choice(pks)))
+            yield self.tap(chat_id, encode(tag))
+
+    def chat(self, chat_id: int):
+        '''
+            Поток одного чата: /start и несколько сценариев подряд
+        '''
+        yield self.message(chat_id, '/start')
+        names, weights = zip(*SCENARIOS)
+        for scenario in self.random.choices(names, weights, k=self.random.randint(1, 3)):
+            if scenario == 'sessions':
+                yield from self._drill(chat_id, 'sessions', 's', self.sessions)
+            elif scenario == 'places':
+                yield from self._drill(chat_id, 'places', 'p', self.places)
+            elif scenario == 'infos':
+                yield from self._drill(chat_id, 'more_info', 'i', self.infos)
+            elif scenario == 'menu':
+                yield self.tap(chat_id, encode('m', 'return'))
+            else:
+                yield self.message(chat_id, '/help')
+                yield self.message(chat_id, 'Подскажите, когда начинается запись на смену?')
+                yield self.tap(chat_id, encode('m', 'cancel'))
+
+    def stream(self, chats: int, first_chat: int = 1000000):
+        '''
+            Чаты перемешаны между собой, порядок внутри чата сохраняется
+        '''
+        streams = [self.chat(chat_id) for chat_id in range(first_chat, first_chat + chats)]
+        while streams:
+            stream = self.random.choice(streams)
+            update = next(stream, None)
+            if update is None:
+                streams.remove(stream)
+            else:
+                yield update
+
+
+async def _post(application, path: str, body: bytes) -> int:
+    '''
+        Один POST в ASGI-приложение Django без HTTP-сервера
+    '''
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'POST',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'root_path': '',
+        'query_string': b'',
+        'headers': [(b'host', b'localhost'), (b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())],
+        'client': ('127.0.0.1', 0),
+        'server': ('localhost', 80),
+    }
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    response = {}
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        # Клиент не отключается, пока ответ не получен
+        await asyncio.Future()
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+
+    await application(scope, receive, send)
+    return response.get('status', 0)
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочный прогон вебхука: синтетические или записанные обновления через ASGI-приложение против заглушки Bot API'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chats', type=int, default=1000, help='Число синтетических чатов')
+        parser.add_argument('--concurrency', type=int, default=50, help='Одновременных запросов к вебхуку')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--trace', help='JSONL с записанными обновлениями (по одному Update на строку) вместо синтетики')
+        parser.add_argument('--save', help='Сохранить сгенерированный поток в JSONL для повторного прогона')
+        parser.add_argument('--api-url', help='Внешний Bot API (формат BOT_API_URL). По умолчанию запускается встроенная заглушка')
+        parser.add_argument('--latency', type=float, default=0.02, help='Задержка встроенной заглушки, с')
+        parser.add_argument('--flood-rate', type=float, default=0, help='Доля ответов 429 встроенной заглушки')
+        parser.add_argument('--limits', action='store_true', help='Соблюдать лимиты Telegram на исходящие запросы')
+        parser.add_argument('--json', action='store_true', help='Отчёт в JSON')
+
+    def load(self, options) -> list:
+        if options['trace']:
+            try:
+                with open(options['trace'], encoding='utf-8') as file:
+                    updates = [json.loads(line) for line in file if line.strip()]
+            except (OSError, ValueError) as e:
+                raise CommandError(f'Не удалось прочитать {options["trace"]}: {e}')
+            if not all(isinstance(update, dict) and 'update_id' in update for update in updates):
+                raise CommandError(f'{options["trace"]}: каждая строка должна быть объектом Update с update_id')
+            return updates
+
+        updates = list(UpdateFactory(options['seed']).stream(options['chats']))
+        if options['save']:
+            with open(options['save'], 'w', encoding='utf-8') as file:
+                file.writelines(json.dumps(update, ensure_ascii=False) + '\n' for update in updates)
+        return updates
+
+    async def run(self, application, path: str, updates: list, concurrency: int):
+        latencies = []
+        statuses = {}
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(update):
+            body = json.dumps(update).encode()
+            async with semaphore:
+                start = time.perf_counter()
+                status = await _post(application, path, body)
+                latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+
+        await asyncio.gather(*(one(update) for update in updates))
+        return latencies, statuses
+
+    def handle(self, *args, **options):
+        updates = self.load(options)
+        if not updates:
+            raise CommandError('Нет обновлений для прогона')
+
+        api = None
+        api_url = options['api_url']
+        if not api_url:
+            api = FakeBotAPI(latency=options['latency'], flood_rate=options['flood_rate'], retry_after=0)
+            api_url = serve_in_thread(api)
+        apihelper.API_URL = api_url
+        asyncio_helper.API_URL = api_url
+        if not options['limits']:
+            outbound.set_limits(global_rate=1e9, chat_rate=1e9, group_per_minute=1e9, burst=1e9)
+
+        from nika.asgi import application
+        from bot import views
+
+        path = reverse('bot:index')
+        queries_before = metrics.update_queries.totals()
+        calls_before = metrics.api_latency.totals()[0]
+
+        start = time.perf_counter()
+        latencies, statuses = asyncio.run(self.run(application, path, updates, options['concurrency']))
+        if settings.BOT_INGEST_MODE == 'queue' and settings.BOT_RUNTIME != 'async':
+            views.update_queue.join()
+        elapsed = time.perf_counter() - start
+
+        processed, queries = (after - before for after, before in zip(metrics.update_queries.totals(), queries_before))
+        calls = metrics.api_latency.totals()[0] - calls_before
+        latencies.sort()
+        report = {
+            'updates': len(updates),
+            'runtime': settings.BOT_RUNTIME,
+            'ingest': settings.BOT_INGEST_MODE,
+            'concurrency': options['concurrency'],
+            'seconds': round(elapsed, 3),
+            'updates_per_second': round(len(updates) / elapsed, 1),
+            'latency_ms': {
+                'p50': round(percentile(latencies, 50) * 1000, 2),
+                'p95': round(percentile(latencies, 95) * 1000, 2),
+                'p99': round(percentile(latencies, 99) * 1000, 2),
+                'max': round(latencies[-1] * 1000, 2),
+            },
+            'statuses': statuses,
+            'db_queries_per_update': round(queries / processed, 2) if processed else None,
+            'api_calls_per_update': round(calls / len(updates), 2),
+        }
+        if api is not None:
+            report['fake_api'] = api.stats()
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, ensure_ascii=False, indent=2))
+            return
+
+        self.stdout.write(f"{report['updates']} обновлений за {report['seconds']} с: {report['updates_per_second']} обн/с "
+                          f"(рантайм {report['runtime']}, приём {report['ingest']}, параллельно {report['concurrency']})")
+        latency = report['latency_ms']
+        self.stdout.write(f"Задержка вебхука, мс: p50 {latency['p50']}, p95 {latency['p95']}, p99 {latency['p99']}, max {latency['max']}")
+        self.stdout.write(f"Ответы: {report['statuses']}")
+        self.stdout.write(f"На обновление: запросов к БД {report['db_queries_per_update']}, вызовов Bot API {report['api_calls_per_update']}")
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from aiohttp import web
+
+from bot.fakeapi import FakeBotAPI
+
+
+class Command(BaseCommand):
+    help = 'Локальная заглушка Telegram Bot API. Для бота задайте BOT_API_URL=http://<host>:<port>/bot{0}/{1}'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8081)
+        parser.add_argument('--latency', type=float, default=0, help='Задержка ответа, с')
+        parser.add_argument('--jitter', type=float, default=0, help='Случайная добавка к задержке, с')
+        parser.add_argument('--flood-rate', type=float, default=0, help='Доля ответов 429 на send*/edit*')
+        parser.add_argument('--retry-after', type=int, default=1, help='retry_after в ответах 429, с')
+
+    def handle(self, *args, **options):
+        api = FakeBotAPI(
+            latency=options['latency'],
+            jitter=options['jitter'],
+            flood_rate=options['flood_rate'],
+            retry_after=options['retry_after'],
+        )
+        self.stdout.write(f"Заглушка Bot API: http://{options['host']}:{options['port']}/bot{{0}}/{{1}}, статистика на /stats")
+        web.run_app(api.make_app(), host=options['host'], port=options['port'], print=None, access_log=None)
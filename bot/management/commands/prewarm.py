@@ -0,0 +1,90 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from telebot.apihelper import ApiTelegramException
+
+from bot import bot, outbound, media
+from bot.catalog import catalog
+from bot.handlers.common import send_cached_file
+from bot.models import Session, OptionalInfo
+
+
+class Command(BaseCommand):
+    help = 'Загрузка постеров и файлов в Telegram в чат BOT_WARMUP_CHAT_ID и сохранение их file_id'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chat', default=settings.BOT_WARMUP_CHAT_ID, help='Чат для загрузки (по умолчанию BOT_WARMUP_CHAT_ID)')
+        parser.add_argument('--workers', type=int, default=4, help='Число параллельных загрузок')
+        parser.add_argument('--force', action='store_true', help='Загрузить заново и файлы с сохранённым file_id')
+        parser.add_argument('--keep', action='store_true', help='Не удалять сообщения из чата после загрузки')
+
+    def assets(self, force: bool):
+        '''
+            Объекты с файлом: (объект, поле файла, поле file_id, отправлять как фото)
+        '''
+        sessions = Session.objects.exclude(image='').exclude(image__isnull=True)
+        infos = OptionalInfo.objects.exclude(file='').exclude(file__isnull=True)
+        if not force:
+            sessions = sessions.filter(image_file_id__isnull=True)
+            infos = infos.filter(file_id__isnull=True)
+
+        for session in sessions:
+            yield session, 'image', 'image_file_id', True
+        for info in infos:
+            yield info, 'file', 'file_id', info.is_photo
+
+    def upload(self, chat_id, instance, field: str, file_id_field: str, as_photo: bool, force: bool, keep: bool):
+        close_old_connections()
+        try:
+            # Сначала готовим вариант для Telegram, иначе обработка после загрузки сбросит file_id
+            if media.needs_processing(instance):
+                media.process(type(instance), instance.pk)
+                instance.refresh_from_db()
+            if force:
+                setattr(instance, file_id_field, None)
+
+            message = send_cached_file(bot, chat_id, instance, field, file_id_field, as_photo, disable_notification=True)
+            if not keep:
+                try:
+                    bot.delete_message(chat_id, message.message_id)
+                except ApiTelegramException as e:
+                    self.stderr.write(f'Не удалось удалить сообщение {message.message_id}: {e}')
+        finally:
+            close_old_connections()
+
+    def handle(self, *args, **options):
+        chat_id = options['chat']
+        if not chat_id:
+            raise CommandError('Не задан чат: укажите BOT_WARMUP_CHAT_ID или --chat')
+
+        assets = list(self.assets(options['force']))
+        if not assets:
+            self.stdout.write('Все файлы уже загружены')
+            return
+
+        self.stdout.write(f'Загрузка {len(assets)} файлов в чат {chat_id}')
+        failed = 0
+        # Параллельные загрузки проходят через общий планировщик исходящих запросов и его лимиты
+        with ThreadPoolExecutor(max_workers=options['workers'], thread_name_prefix='bot-prewarm') as executor:
+            futures = {
+                executor.submit(self.upload, chat_id, instance, field, file_id_field, as_photo, options['force'], options['keep']): instance
+                for instance, field, file_id_field, as_photo in assets
+            }
+            for future in as_completed(futures):
+                instance = futures[future]
+                try:
+                    future.result()
+                    self.stdout.write(f'{instance}: готово')
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f'{instance}: ошибка {e}')
+
+        # file_id сохраняются через update, сигналы каталога не срабатывают.
+        # Команда идёт отдельным процессом: новые file_id работающие процессы бота увидят по общей версии каталога
+        catalog.invalidate()
+        self.stdout.write(f'Загружено {len(assets) - failed} из {len(assets)}, ожидание лимитов {outbound.stats()["throttled_seconds"]} с')
+        if failed:
+            raise CommandError(f'Не загружено файлов: {failed}')
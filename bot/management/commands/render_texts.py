@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from bot.models import Session, Place, OptionalInfo
+from bot.rendering import text_limit_error
+
+
+class Command(BaseCommand):
+    help = 'Сборка готовых текстов смен, мест и статей для Telegram и проверка их длины. ' \
+           'Нужна для строк, сохранённых до появления поля rendered_text'
+
+    def handle(self, *args, **options):
+        for model, queryset in (
+            (Session, Session.objects.select_related('place')),
+            (Place, Place.objects.all()),
+            (OptionalInfo, OptionalInfo.objects.all()),
+        ):
+            changed = []
+            for instance in queryset:
+                text = instance.render()
+                error = text_limit_error(text, instance.has_file())
+                if error is not None:
+                    self.stderr.write(f'{instance}: {error}')
+                if text != instance.rendered_text:
+                    instance.rendered_text = text
+                    changed.append(instance)
+            model.objects.bulk_update(changed, ['rendered_text'])
+            self.stdout.write(f'{model._meta.verbose_name_plural}: обновлено {len(changed)}')
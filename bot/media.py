@@ -0,0 +1,158 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, models
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from telebot import logger
+
+from .catalog import catalog
+from .models import static_fs, Session, OptionalInfo
+
+# Лимиты Telegram: фото до 10 МБ, превью документа - JPEG до 200 КБ
+PHOTO_MAX_BYTES = 10 * 1024 * 1024
+THUMB_MAX_BYTES = 200 * 1024
+
+# Обработка идёт в фоне, чтобы не задерживать сохранение в админке
+executor = ThreadPoolExecutor(max_workers=settings.BOT_MEDIA_WORKERS, thread_name_prefix='bot-media')
+
+
+def variant_for(instance: models.Model):
+    '''
+        Что готовить для объекта: (поле файла, поле варианта, вид варианта, поле file_id) или None.
+        Постер и сжатое изображение - фото для Telegram, остальные файлы - превью документа
+    '''
+    if isinstance(instance, Session):
+        return 'image', 'image_prepared', 'photo', 'image_file_id'
+    if isinstance(instance, OptionalInfo):
+        if instance.is_photo:
+            return 'file', 'file_prepared', 'photo', 'file_id'
+        return 'file', 'thumbnail', 'thumb', 'file_id'
+    return None
+
+
+def variant_name(name: str, kind: str) -> str:
+    '''
+        Имя варианта рядом с оригиналом: images/sessions/leto.jpg -> images/sessions/leto.photo.jpg
+    '''
+    root, _ = os.path.splitext(name)
+    return f'{root}.{kind}.jpg'
+
+
+def is_current(instance: models.Model) -> bool:
+    '''
+        Вариант соответствует текущему файлу объекта
+    '''
+    field, variant_field, kind, _ = variant_for(instance)
+    source = getattr(instance, field)
+    variant = getattr(instance, variant_field)
+    return bool(source) and bool(variant) and variant.name == variant_name(source.name, kind)
+
+
+def needs_processing(instance: models.Model) -> bool:
+    target = variant_for(instance)
+    return target is not None and bool(getattr(instance, target[0])) and not is_current(instance)
+
+
+def render(file, kind: str) -> bytes:
+    '''
+        JPEG без метаданных: фото до BOT_MEDIA_PHOTO_SIDE по большей стороне
+        или превью до BOT_MEDIA_THUMB_SIDE
+    '''
+    if kind == 'photo':
+        side, max_bytes = settings.BOT_MEDIA_PHOTO_SIDE, PHOTO_MAX_BYTES
+    else:
+        side, max_bytes = settings.BOT_MEDIA_THUMB_SIDE, THUMB_MAX_BYTES
+
+    with Image.open(file) as original:
+        # Поворот по EXIF применяется к пикселям, сами метаданные не сохраняются
+        image = ImageOps.exif_transpose(original)
+        image.thumbnail((side, side), Image.LANCZOS)
+
+    if image.mode not in ('RGB', 'L'):
+        # Прозрачность заменяется белым фоном
+        rgba = image.convert('RGBA')
+        image = Image.new('RGB', rgba.size, 'white')
+        image.paste(rgba, mask=rgba.getchannel('A'))
+
+    quality = settings.BOT_MEDIA_QUALITY
+    while True:
+        buffer = BytesIO()
+        image.save(buffer, 'JPEG', quality=quality, optimize=True, progressive=True)
+        if buffer.tell() <= max_bytes or quality <= 40:
+            return buffer.getvalue()
+        quality -= 10
+
+
+def process(model, pk):
+    '''
+        Подготовка варианта файла объекта и сброс его file_id
+    '''
+    instance = model.objects.filter(pk=pk).first()
+    if instance is None or not needs_processing(instance):
+        return
+
+    field, variant_field, kind, file_id_field = variant_for(instance)
+    source = getattr(instance, field)
+    try:
+        with source.open('rb') as file:
+            content = render(file, kind)
+    except (UnidentifiedImageError, OSError) as e:
+        logger.info('%s: файл %s не обработан: %s', instance, source.name, e)
+        return
+
+    name = variant_name(source.name, kind)
+    # Вариант всегда лежит под своим именем, старый перезаписывается
+    if static_fs.exists(name):
+        static_fs.delete(name)
+    name = static_fs.save(name, ContentFile(content))
+
+    # Сохраняем только если файл не успели заменить, пока шла обработка.
+    # Старый file_id указывает на оригинал, следующая отправка загрузит вариант
+    updated = model.objects.filter(pk=pk, **{field: source.name}).update(**{variant_field: name, file_id_field: None})
+    old = getattr(instance, variant_field).name
+    if not updated:
+        static_fs.delete(name)
+        return
+    if old and old != name:
+        static_fs.delete(old)
+
+    logger.info('%s: %s (%s Б) -> %s (%s Б)', instance, source.name, source.size, name, len(content))
+    # update обходит сигналы. Версия каталога общая, поэтому вариант увидят все процессы бота,
+    # а не только этот, где обработка шла в фоновом потоке
+    catalog.invalidate()
+
+
+def _process_safely(model, pk):
+    close_old_connections()
+    try:
+        process(model, pk)
+    except Exception as e:
+        logger.error('Ошибка обработки файла %s %s: %s', model.__name__, pk, e, exc_info=True)
+    finally:
+        close_old_connections()
+
+
+def schedule(model, pk):
+    executor.submit(_process_safely, model, pk)
+
+
+def upload_source(instance: models.Model):
+    '''
+        Что загружать в Telegram: (путь к файлу, превью документа или None).
+        Пока вариант не готов, загружается оригинал
+    '''
+    field, variant_field, kind, _ = variant_for(instance)
+    path = getattr(instance, field).path
+    if not is_current(instance):
+        return path, None
+
+    variant = getattr(instance, variant_field)
+    if kind == 'photo':
+        return variant.path, None
+    with variant.open('rb') as file:
+        return path, (os.path.basename(variant.name), file.read())
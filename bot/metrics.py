@@ -0,0 +1,222 @@
+import inspect
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from .logs import log_context
+
+# Границы корзин по умолчанию, секунды
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50)
+
+# Счётчик запросов к БД текущего обновления
+_queries = ContextVar('bot_update_queries', default=None)
+
+
+def percentile(values: list, percent: float) -> float:
+    '''
+        Перцентиль отсортированного списка
+    '''
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} counter'
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield f'{self.name}{_labels(self.labelnames, labels)} {value}'
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                # Счётчики корзин (последняя - +Inf), сумма
+                series = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def totals(self):
+        '''
+            Число наблюдений и их сумма по всем меткам
+        '''
+        with self._lock:
+            return sum(sum(counts) for counts, _ in self._values.values()), sum(total for _, total in self._values.values())
+
+    def render(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} histogram'
+        with self._lock:
+            items = [(labels, list(counts), total) for labels, (counts, total) in self._values.items()]
+
+        names = self.labelnames + ('le',)
+        for labels, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield f'{self.name}_bucket{_labels(names, labels + (bound,))} {cumulative}'
+            yield f'{self.name}_sum{_labels(self.labelnames, labels)} {total}'
+            yield f'{self.name}_count{_labels(self.labelnames, labels)} {cumulative}'
+
+
+class Registry:
+    '''
+        Метрики в текстовом формате Prometheus.
+        Кроме счётчиков и гистограмм, при выгрузке опрашиваются функции stats()
+        компонентов бота (очередь, исходящие запросы, хранилище состояний и т. д.)
+    '''
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def collect(self, prefix: str, stats, label: str = 'key'):
+        '''
+            Числовые значения из stats() выгружаются как gauge с именем <prefix>_<ключ>.
+            Вложенные словари {значение метки: {ключ: число}} - как <prefix>_<ключ>{label="..."}
+        '''
+        self._collectors.append((prefix, stats, label))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+
+        for prefix, stats, label in self._collectors:
+            series = {}
+            for key, value in stats().items():
+                if isinstance(value, dict):
+                    for name, number in value.items():
+                        series.setdefault(f'{prefix}_{name}', []).append((_labels((label,), (key,)), number))
+                else:
+                    series.setdefault(f'{prefix}_{key}', []).append(('', value))
+
+            for name, samples in series.items():
+                samples = [(labels, value) for labels, value in samples if _is_number(value)]
+                if samples:
+                    lines.append(f'# TYPE {name} gauge')
+                    lines.extend(f'{name}{labels} {value}' for labels, value in samples)
+        return '\n'.join(lines) + '\n'
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+registry = Registry()
+
+handler_latency = registry.register(Histogram('bot_handler_seconds', 'Время работы обработчика', ('handler',)))
+handler_errors = registry.register(Counter('bot_handler_errors_total', 'Исключения в обработчиках', ('handler',)))
+api_latency = registry.register(Histogram('bot_api_request_seconds', 'Время запроса к Bot API', ('method',)))
+api_errors = registry.register(Counter('bot_api_errors_total', 'Ошибки запросов к Bot API', ('method', 'code')))
+update_latency = registry.register(Histogram('bot_update_seconds', 'Время обработки обновления', ('runtime',)))
+update_queries = registry.register(Histogram('bot_update_db_queries', 'Запросы к БД на одно обновление', ('runtime',), QUERY_BUCKETS))
+queue_wait = registry.register(Histogram('bot_queue_wait_seconds', 'Время ожидания обновления в очереди шарда'))
+help_requests = registry.register(Counter('bot_help_requests_total', 'Вопросы в /help: suggested - предложены ответы, forwarded - отправлены админам, escalated - отправлены после ответов', ('outcome',)))
+
+
+def timed(handler):
+    '''
+        Учёт времени и исключений обработчика под его именем.
+        Имя обработчика попадает и в записи лога
+    '''
+    name = handler.__name__
+
+    if inspect.iscoroutinefunction(handler):
+        @wraps(handler)
+        async def async_wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                with log_context(handler=name):
+                    return await handler(*args, **kwargs)
+            except Exception:
+                handler_errors.inc(name)
+                raise
+            finally:
+                handler_latency.observe(time.perf_counter() - start, name)
+        return async_wrapper
+
+    @wraps(handler)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            with log_context(handler=name):
+                return handler(*args, **kwargs)
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            handler_latency.observe(time.perf_counter() - start, name)
+    return wrapper
+
+
+def count_query(execute, sql, params, many, context):
+    '''
+        execute_wrapper соединения: считает запросы обновления, которое сейчас обрабатывается
+    '''
+    counter = _queries.get()
+    if counter is not None:
+        counter[0] += 1
+    return execute(sql, params, many, context)
+
+
+@contextmanager
+def track_update(runtime: str):
+    '''
+        Время обработки и число запросов к БД одного обновления.
+        Счётчик живёт в contextvar и виден в потоках sync_to_async
+    '''
+    counter = [0]
+    token = _queries.set(counter)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        update_latency.observe(time.perf_counter() - start, runtime)
+        update_queries.observe(counter[0], runtime)
+        _queries.reset(token)
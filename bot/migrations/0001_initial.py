@@ -0,0 +1,77 @@
+# Generated by Django 5.2.3 on 2026-10-18 19:12
+
+import bot.models
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeneralInfo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_text', models.TextField(default='Привет! Что ты хочешь узнать?', max_length=2048, verbose_name='Стартовое сообщение')),
+                ('admins', models.CharField(blank=True, help_text='Указывать Id через |', max_length=2048, null=True, verbose_name='Список админов')),
+            ],
+            options={
+                'verbose_name': 'Общая информация',
+                'verbose_name_plural': 'Общая информация',
+            },
+        ),
+        migrations.CreateModel(
+            name='OptionalInfo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(help_text='Максимальная длина 60 символа', max_length=60, verbose_name='Текст кнопки')),
+                ('slug', models.SlugField(unique=True, verbose_name='Слаг')),
+                ('text', models.TextField(help_text='Максимальная длина 1024 символа, если с файлом и 4096, если без', verbose_name='Текст сообщения')),
+                ('file', models.FileField(blank=True, null=True, storage=bot.models.get_static_fs, upload_to=bot.models.optional_image_path, verbose_name='Файл изображения')),
+                ('is_photo', models.BooleanField(help_text='Отметить, если нужно отправить файл, как сжатое изображение', verbose_name='Сжать изображение')),
+            ],
+            options={
+                'verbose_name': 'Дополнительная информация',
+                'verbose_name_plural': 'Дополнительные информации',
+            },
+        ),
+        migrations.CreateModel(
+            name='Place',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(help_text='Максимальная длина 60 символа', max_length=60, verbose_name='Название')),
+                ('slug', models.SlugField(unique=True, verbose_name='Слаг')),
+                ('description', models.TextField(blank=True, null=True, verbose_name='Описание')),
+                ('latitude', models.DecimalField(blank=True, decimal_places=6, help_text='Максимальное количество цифр после точки - 6', max_digits=9, null=True, verbose_name='Широта')),
+                ('longitude', models.DecimalField(blank=True, decimal_places=6, help_text='Максимальное количество цифр после точки - 6', max_digits=9, null=True, verbose_name='Долгота')),
+            ],
+            options={
+                'verbose_name': 'Место',
+                'verbose_name_plural': 'Местa',
+            },
+        ),
+        migrations.CreateModel(
+            name='Session',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(help_text='Максимальная длина 60 символа', max_length=60, verbose_name='Название')),
+                ('slug', models.SlugField(unique=True, verbose_name='Слаг')),
+                ('form_url', models.CharField(blank=True, help_text='При наличии', max_length=128, null=True, verbose_name='Ссылка на форму')),
+                ('image', models.FileField(blank=True, null=True, storage=bot.models.get_static_fs, upload_to=bot.models.session_image_path, verbose_name='Постер')),
+                ('description', models.TextField(blank=True, help_text='Максимальная длина 1024 символа', max_length=1024, null=True, verbose_name='Описание')),
+                ('start_date', models.DateField(blank=True, null=True, verbose_name='Начало смены')),
+                ('end_date', models.DateField(blank=True, null=True, verbose_name='Конец смены')),
+                ('notes', models.TextField(blank=True, help_text='Видит только админ', null=True, verbose_name='Заметки')),
+                ('place', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='bot.place')),
+            ],
+            options={
+                'verbose_name': 'Смена',
+                'verbose_name_plural': 'Смены',
+            },
+        ),
+    ]
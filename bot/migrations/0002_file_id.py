@@ -0,0 +1,23 @@
+# Generated by Django 5.2.3 on 2026-10-18 19:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='optionalinfo',
+            name='file_id',
+            field=models.CharField(blank=True, editable=False, max_length=256, null=True, verbose_name='file_id в Telegram'),
+        ),
+        migrations.AddField(
+            model_name='session',
+            name='image_file_id',
+            field=models.CharField(blank=True, editable=False, max_length=256, null=True, verbose_name='file_id постера в Telegram'),
+        ),
+    ]
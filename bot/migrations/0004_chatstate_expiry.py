@@ -0,0 +1,25 @@
+# Generated by Django 5.2.3 on 2026-10-18 19:12
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0003_chatstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatstate',
+            name='expires',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='Истекает'),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='chatstate',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, db_index=True, verbose_name='Обновлено'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.3 on 2026-10-18 19:12
+
+import bot.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0004_chatstate_expiry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='optionalinfo',
+            name='file_prepared',
+            field=models.FileField(blank=True, editable=False, max_length=255, null=True, storage=bot.models.get_static_fs, upload_to='', verbose_name='Изображение для Telegram'),
+        ),
+        migrations.AddField(
+            model_name='optionalinfo',
+            name='thumbnail',
+            field=models.FileField(blank=True, editable=False, max_length=255, null=True, storage=bot.models.get_static_fs, upload_to='', verbose_name='Превью документа'),
+        ),
+        migrations.AddField(
+            model_name='session',
+            name='image_prepared',
+            field=models.FileField(blank=True, editable=False, max_length=255, null=True, storage=bot.models.get_static_fs, upload_to='', verbose_name='Постер для Telegram'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.3 on 2026-10-18 19:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0005_prepared_media'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HelpTicket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.BigIntegerField(db_index=True, verbose_name='Id пользователя')),
+                ('chat_id', models.BigIntegerField(verbose_name='Id чата')),
+                ('username', models.CharField(blank=True, max_length=64, null=True, verbose_name='Имя пользователя')),
+                ('text', models.TextField(max_length=4096, verbose_name='Текст запроса')),
+                ('status', models.CharField(choices=[('pending', 'Ожидает отправки'), ('sent', 'Отправлен'), ('failed', 'Не доставлен')], db_index=True, default='pending', max_length=16, verbose_name='Статус')),
+                ('delivered', models.JSONField(blank=True, default=list, help_text='Id админов, получивших запрос', verbose_name='Доставлен админам')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Неудачных попыток')),
+                ('next_attempt', models.DateTimeField(db_index=True, verbose_name='Следующая попытка')),
+                ('claim', models.CharField(blank=True, default='', editable=False, max_length=32, verbose_name='Метка обработчика')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Создан')),
+                ('sent', models.DateTimeField(blank=True, null=True, verbose_name='Отправлен')),
+            ],
+            options={
+                'verbose_name': 'Запрос помощи',
+                'verbose_name_plural': 'Запросы помощи',
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.3 on 2026-10-18 19:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0006_helpticket'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='optionalinfo',
+            name='rendered_text',
+            field=models.TextField(blank=True, default='', editable=False, verbose_name='Текст для Telegram'),
+        ),
+        migrations.AddField(
+            model_name='place',
+            name='rendered_text',
+            field=models.TextField(blank=True, default='', editable=False, verbose_name='Текст для Telegram'),
+        ),
+        migrations.AddField(
+            model_name='session',
+            name='rendered_text',
+            field=models.TextField(blank=True, default='', editable=False, verbose_name='Текст для Telegram'),
+        ),
+    ]
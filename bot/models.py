@@ -1,14 +1,21 @@
 from django.db import models
+from django.core.exceptions import ValidationError
 from django.core.files.storage import FileSystemStorage
 
 import os
 
 from nika.settings import BASE_DIR
+from .rendering import format_session_text, format_place_text, format_info_text, text_limit_error
 
 # Хранилище для статики
 static_fs = FileSystemStorage(location=f"{BASE_DIR}/media")
 
 
+def get_static_fs():
+    # Хранилище передаётся в поля функцией, иначе в миграции попадёт абсолютный путь этой машины
+    return static_fs
+
+
 class GeneralInfo(models.Model):
     '''
         Общая информация для сообщений, админов и т. д.
@@ -22,6 +29,53 @@ class GeneralInfo(models.Model):
     class Meta:
         verbose_name = "Общая информация"
         verbose_name_plural = "Общая информация"
+
+
+class RenderedText(models.Model):
+    '''
+        Готовый текст сообщения для Telegram. Собирается при сохранении,
+        чтобы обработчики бота отдавали его без форматирования и лишних запросов
+    '''
+    # Поля, от которых зависит текст, поле с текстом для ошибки и поле файла
+    render_fields = ()
+    text_field = None
+    file_field = None
+
+    rendered_text = models.TextField(verbose_name='Текст для Telegram', default='', blank=True, editable=False)
+
+    def render(self) -> str:
+        '''
+            Текст сообщения из полей объекта. Формат задаёт каждая модель,
+            у базового класса своих полей для текста нет
+        '''
+        raise NotImplementedError(f'{type(self).__name__} должна определить render()')
+
+    def has_file(self) -> bool:
+        return bool(self.file_field and getattr(self, self.file_field))
+
+    def message_text(self) -> str:
+        '''
+            Сохранённый текст. Для строк, сохранённых до появления поля, собирается на лету
+        '''
+        return self.rendered_text or self.render()
+
+    def clean(self):
+        super().clean()
+        error = text_limit_error(self.render(), self.has_file())
+        if error is not None:
+            raise ValidationError({self.text_field: error})
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None:
+            self.rendered_text = self.render()
+        elif set(update_fields) & set(self.render_fields):
+            self.rendered_text = self.render()
+            kwargs['update_fields'] = {*update_fields, 'rendered_text'}
+        super().save(*args, **kwargs)
+
+    class Meta:
+        abstract = True
     
 
 # Пути для доп. инфы
@@ -29,15 +83,25 @@ def optional_image_path(instance, filename):
     return os.path.join(f'images/optional/{filename}')
 
 
-class OptionalInfo(models.Model):
+class OptionalInfo(RenderedText):
     '''
         Дополнительная информация по лагерю
     '''
     title = models.CharField(verbose_name='Текст кнопки', help_text='Максимальная длина 60 символа', max_length=60)
     slug = models.SlugField(verbose_name='Слаг', unique=True)
     text = models.TextField(verbose_name='Текст сообщения', help_text='Максимальная длина 1024 символа, если с файлом и 4096, если без')
-    file = models.FileField(verbose_name='Файл изображения', storage=static_fs, upload_to=optional_image_path, null=True, blank=True)
+    file = models.FileField(verbose_name='Файл изображения', storage=get_static_fs, upload_to=optional_image_path, null=True, blank=True)
     is_photo = models.BooleanField(verbose_name='Сжать изображение', help_text='Отметить, если нужно отправить файл, как сжатое изображение') 
+    file_id = models.CharField(verbose_name='file_id в Telegram', max_length=256, null=True, blank=True, editable=False)
+    file_prepared = models.FileField(verbose_name='Изображение для Telegram', storage=get_static_fs, max_length=255, null=True, blank=True, editable=False)
+    thumbnail = models.FileField(verbose_name='Превью документа', storage=get_static_fs, max_length=255, null=True, blank=True, editable=False)
+
+    render_fields = ('text',)
+    text_field = 'text'
+    file_field = 'file'
+
+    def render(self) -> str:
+        return format_info_text(self)
 
     def __str__(self):
         return f'Дополнительная информация {self.title}'
@@ -49,10 +113,10 @@ class OptionalInfo(models.Model):
 
 # class OptionalFile(models.Model):
 #     info = models.ForeignKey(to=OptionalInfo)
-#     file = models.FileField(verbose_name='Файл для сообщения', storage=static_fs, upload_to=optional_image_path)
+#     file = models.FileField(verbose_name='Файл для сообщения', storage=get_static_fs, upload_to=optional_image_path)
 #     is_main = models.BooleanField(verbose_name='Изображение', help_text='Поставить')
 
-class Place(models.Model):
+class Place(RenderedText):
     '''
         Места где будут проходить смены
     '''
@@ -62,6 +126,12 @@ class Place(models.Model):
     latitude = models.DecimalField(verbose_name='Широта', help_text='Максимальное количество цифр после точки - 6', null=True, max_digits=9, decimal_places=6, blank=True)
     longitude = models.DecimalField(verbose_name='Долгота', help_text='Максимальное количество цифр после точки - 6', null=True, max_digits=9, decimal_places=6, blank=True)
 
+    render_fields = ('title', 'description')
+    text_field = 'description'
+
+    def render(self) -> str:
+        return format_place_text(self)
+
     def __str__(self):
         return f'Место {self.title}'
     
@@ -74,7 +144,7 @@ def session_image_path(instance, filename):
     return os.path.join(f"images/sessions/{instance.slug}.{filename.split('.')[-1]}")
 
 
-class Session(models.Model):
+class Session(RenderedText):
     '''
         Модель для смен
     '''
@@ -82,12 +152,21 @@ class Session(models.Model):
     slug = models.SlugField(verbose_name='Слаг', unique=True)
     form_url = models.CharField(verbose_name='Ссылка на форму', help_text='При наличии', max_length=128, null=True, blank=True)
     place = models.ForeignKey(to=Place, on_delete=models.SET_NULL, null=True, blank=True)
-    image = models.FileField(verbose_name='Постер', storage=static_fs, upload_to=session_image_path, null=True, blank=True)
+    image = models.FileField(verbose_name='Постер', storage=get_static_fs, upload_to=session_image_path, null=True, blank=True)
+    image_file_id = models.CharField(verbose_name='file_id постера в Telegram', max_length=256, null=True, blank=True, editable=False)
+    image_prepared = models.FileField(verbose_name='Постер для Telegram', storage=get_static_fs, max_length=255, null=True, blank=True, editable=False)
     description = models.TextField(verbose_name='Описание', help_text='Максимальная длина 1024 символа', max_length=1024, null=True, blank=True)
     start_date = models.DateField(verbose_name='Начало смены', null=True, blank=True)
     end_date = models.DateField(verbose_name='Конец смены', null=True, blank=True)
     notes = models.TextField(verbose_name='Заметки', help_text='Видит только админ', null=True, blank=True)
 
+    render_fields = ('title', 'place', 'description', 'start_date', 'end_date')
+    text_field = 'description'
+    file_field = 'image'
+
+    def render(self) -> str:
+        return format_session_text(self)
+
     def __str__(self):
         return f'Смена {self.title}'
     
@@ -96,3 +175,69 @@ class Session(models.Model):
         verbose_name_plural = "Смены"
     
 
+
+
+class ChatState(models.Model):
+    '''
+        Состояние диалога пользователя с ботом (хранилище состояний telebot)
+    '''
+    key = models.CharField(verbose_name='Ключ', max_length=255, unique=True)
+    state = models.CharField(verbose_name='Состояние', max_length=255)
+    data = models.JSONField(verbose_name='Данные', default=dict, blank=True)
+    updated = models.DateTimeField(verbose_name='Обновлено', auto_now=True, db_index=True)
+    expires = models.DateTimeField(verbose_name='Истекает', db_index=True)
+
+    def __str__(self):
+        return f'Состояние {self.key}'
+    
+    class Meta:
+        verbose_name = "Состояние диалога"
+        verbose_name_plural = "Состояния диалогов"
+
+
+class HelpTicket(models.Model):
+    '''
+        Запрос помощи от пользователя. Рассылается админам в фоне
+    '''
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'Ожидает отправки'),
+        (SENT, 'Отправлен'),
+        (FAILED, 'Не доставлен'),
+    )
+
+    user_id = models.BigIntegerField(verbose_name='Id пользователя', db_index=True)
+    chat_id = models.BigIntegerField(verbose_name='Id чата')
+    username = models.CharField(verbose_name='Имя пользователя', max_length=64, null=True, blank=True)
+    text = models.TextField(verbose_name='Текст запроса', max_length=4096)
+    status = models.CharField(verbose_name='Статус', max_length=16, choices=STATUSES, default=PENDING, db_index=True)
+    delivered = models.JSONField(verbose_name='Доставлен админам', help_text='Id админов, получивших запрос', default=list, blank=True)
+    attempts = models.PositiveIntegerField(verbose_name='Неудачных попыток', default=0)
+    next_attempt = models.DateTimeField(verbose_name='Следующая попытка', db_index=True)
+    claim = models.CharField(verbose_name='Метка обработчика', max_length=32, default='', blank=True, editable=False)
+    created = models.DateTimeField(verbose_name='Создан', auto_now_add=True)
+    sent = models.DateTimeField(verbose_name='Отправлен', null=True, blank=True)
+
+    def __str__(self):
+        return f'Запрос помощи {self.pk} от {self.username or self.user_id}'
+
+    class Meta:
+        verbose_name = "Запрос помощи"
+        verbose_name_plural = "Запросы помощи"
+
+
+class CatalogVersion(models.Model):
+    '''
+        Общая для всех процессов версия каталога (одна строка).
+        Растёт при каждом изменении, процессы бота сверяются с ней и пересобирают свой кэш
+    '''
+    version = models.PositiveBigIntegerField(verbose_name='Версия', default=0)
+
+    def __str__(self):
+        return f'Версия каталога {self.version}'
+
+    class Meta:
+        verbose_name = "Версия каталога"
+        verbose_name_plural = "Версия каталога"
@@ -0,0 +1,304 @@
+import asyncio
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from requests.exceptions import ConnectionError, Timeout
+
+from telebot import apihelper, logger
+
+from .metrics import api_latency, api_errors
+from .transport import is_idempotent
+
+# Методы, на которые распространяется общий лимит Telegram на отправку сообщений
+LIMITED_PREFIXES = ('send', 'edit', 'copy', 'forward')
+# Лимит на чат - только для новых сообщений: правки отвечают на нажатия самого пользователя
+CHAT_LIMITED_PREFIXES = ('send', 'copy', 'forward')
+
+
+class TokenBucket:
+    '''
+        Ведро токенов с резервированием: reserve возвращает время ожидания,
+        после которого запрос можно отправлять
+    '''
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, now: float) -> float:
+        self._refill(now)
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    def wait(self, now: float) -> float:
+        '''
+            Время до свободного токена без резервирования (например, пауза после 429)
+        '''
+        self._refill(now)
+        return max(0.0, -self.tokens / self.rate)
+
+    def refund(self):
+        '''
+            Возврат токена отменённого запроса
+        '''
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+    def pause(self, now: float, seconds: float):
+        '''
+            Запрет отправки на seconds секунд (например, по retry_after)
+        '''
+        self._refill(now)
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+
+class OutboundScheduler:
+    '''
+        Планировщик исходящих запросов к Bot API:
+        глобальный лимит и лимиты на чат, соблюдение retry_after
+        и ограниченное число повторов с джиттером.
+        Синхронный рантайм ждёт лимит в потоке, который обрабатывает и другие чаты,
+        поэтому ожидание дольше max_wait не выполняется: запрос отклоняется как ответ 429
+    '''
+
+    def __init__(self, global_rate: float, chat_rate: float, group_per_minute: float, burst: float, max_retries: int, max_chats: int = 10000,
+                 transport=None, max_wait: float = None):
+        self.chat_rate = chat_rate
+        self.group_rate = group_per_minute / 60
+        self.burst = burst
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self.transport = transport
+        self.max_wait = max_wait
+
+        self._lock = threading.Lock()
+        self._global = TokenBucket(global_rate, burst)
+        self._chats = OrderedDict()
+
+        self.throttled = 0
+        self.throttled_seconds = 0.0
+        self.retries = 0
+        self.flood_errors = 0
+        self.rejected = 0
+
+    def set_limits(self, global_rate: float, chat_rate: float, group_per_minute: float, burst: float):
+        '''
+            Замена лимитов на ходу, например для нагрузочного прогона против заглушки
+        '''
+        with self._lock:
+            self.chat_rate = chat_rate
+            self.group_rate = group_per_minute / 60
+            self.burst = burst
+            self._global = TokenBucket(global_rate, burst)
+            self._chats.clear()
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Отрицательные id - группы и каналы, для них лимит в минуту
+            is_group = str(chat_id).startswith('-')
+            bucket = TokenBucket(self.group_rate if is_group else self.chat_rate, self.burst)
+            self._chats[chat_id] = bucket
+            if len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    def reserve(self, method_name: str, params, max_wait: float = None):
+        '''
+            Время, которое нужно подождать перед отправкой запроса.
+            None, если ждать пришлось бы дольше max_wait: тогда токены возвращаются
+        '''
+        if not method_name.startswith(LIMITED_PREFIXES):
+            return 0.0
+
+        chat_id = params.get('chat_id') if params else None
+        with self._lock:
+            now = time.monotonic()
+            buckets = [self._global]
+            if chat_id is not None and method_name.startswith(CHAT_LIMITED_PREFIXES):
+                buckets.append(self._chat_bucket(chat_id))
+            delay = max(bucket.reserve(now) for bucket in buckets)
+            if chat_id is not None and len(buckets) == 1 and chat_id in self._chats:
+                # Правка не тратит лимит чата, но соблюдает паузу чата после 429
+                delay = max(delay, self._chats[chat_id].wait(now))
+
+            if max_wait is not None and delay > max_wait:
+                for bucket in buckets:
+                    bucket.refund()
+                self.rejected += 1
+                return None
+            if delay > 0:
+                self.throttled += 1
+                self.throttled_seconds += delay
+        return delay
+
+    def flood_wait(self, params, retry_after: float):
+        '''
+            Учёт ответа 429: пауза для чата или для всех запросов
+        '''
+        chat_id = params.get('chat_id') if params else None
+        with self._lock:
+            self.flood_errors += 1
+            now = time.monotonic()
+            if chat_id is None:
+                self._global.pause(now, retry_after)
+            else:
+                self._chat_bucket(chat_id).pause(now, retry_after)
+
+    def retryable(self, method_name: str, status: int) -> bool:
+        '''
+            Повторять ли запрос после ответа с кодом status.
+            429 - Telegram запрос не выполнил, повтор безопасен для любого метода.
+            5xx мог прийти уже после отправки сообщения, поэтому повторяются только методы без побочных эффектов
+        '''
+        if status == 429:
+            return True
+        return status >= 500 and is_idempotent(method_name)
+
+    def backoff(self, attempt: int) -> float:
+        self.retries += 1
+        return min(2 ** attempt, 30) * (0.5 + random.random())
+
+    def stats(self) -> dict:
+        return {
+            'throttled': self.throttled,
+            'throttled_seconds': round(self.throttled_seconds, 3),
+            'retries': self.retries,
+            'flood_errors': self.flood_errors,
+            'rejected': self.rejected,
+            'tracked_chats': len(self._chats),
+        }
+
+    def request_sender(self, method, url, params=None, files=None, **kwargs):
+        '''
+            Замена отправки запроса для apihelper.CUSTOM_REQUEST_SENDER
+        '''
+        method_name = url.rsplit('/', 1)[-1]
+        if self.transport is not None:
+            kwargs['timeout'] = self.transport.timeout(method_name, files)
+        attempt = 0
+        result = None
+        while True:
+            delay = self.reserve(method_name, params, self.max_wait)
+            if delay is None:
+                logger.warning('%s: лимит отправки, запрос отклонён без ожидания', method_name)
+                if result is not None:
+                    # Повтор после 429 не дождался лимита: вызывающий получит ответ Telegram
+                    return result
+                raise apihelper.ApiTelegramException(method_name, None, {
+                    'ok': False, 'error_code': 429, 'description': 'Too Many Requests: local rate limit',
+                })
+            if delay:
+                time.sleep(delay)
+
+            _rewind(files)
+            start = time.perf_counter()
+            try:
+                result = apihelper._get_req_session().request(method, url, params=params, files=files, **kwargs)
+            except (ConnectionError, Timeout) as e:
+                api_errors.inc(method_name, type(e).__name__)
+                # Запрос мог дойти до Telegram, поэтому повторяются только методы без побочных эффектов.
+                # Неудачные подключения уже повторил транспорт
+                if attempt >= self.max_retries or not is_idempotent(method_name):
+                    raise
+                attempt += 1
+                logger.warning('%s: ошибка соединения (%s), повтор %s/%s', method_name, e, attempt, self.max_retries)
+                time.sleep(self.backoff(attempt))
+                continue
+            finally:
+                api_latency.observe(time.perf_counter() - start, method_name)
+
+            if result.status_code >= 400:
+                api_errors.inc(method_name, result.status_code)
+            if attempt >= self.max_retries or not self.retryable(method_name, result.status_code):
+                return result
+
+            attempt += 1
+            if result.status_code == 429:
+                retry_after = _retry_after(_json_or_none(result))
+                self.flood_wait(params, retry_after)
+                logger.warning('%s: 429, retry_after=%.2f, повтор %s/%s', method_name, retry_after, attempt, self.max_retries)
+            else:
+                logger.warning('%s: HTTP %s, повтор %s/%s', method_name, result.status_code, attempt, self.max_retries)
+                time.sleep(self.backoff(attempt))
+
+    def wrap_async(self, process_request):
+        '''
+            Обёртка над asyncio_helper._process_request с теми же лимитами и правилами повторов
+        '''
+        from telebot.asyncio_helper import ApiTelegramException, ApiHTTPException, RequestTimeout
+
+        async def _process_request(token, url, method='get', params=None, files=None, **kwargs):
+            attempt = 0
+            while True:
+                delay = self.reserve(url, params)
+                if delay:
+                    await asyncio.sleep(delay)
+
+                _rewind(files)
+                start = time.perf_counter()
+                try:
+                    return await process_request(token, url, method, dict(params) if params else params, files, **kwargs)
+                except (ApiTelegramException, ApiHTTPException) as e:
+                    status = e.error_code if isinstance(e, ApiTelegramException) else e.result.status
+                    api_errors.inc(url, status)
+                    if attempt >= self.max_retries or not self.retryable(url, status):
+                        raise
+                    attempt += 1
+                    if status == 429:
+                        retry_after = _retry_after(e.result_json)
+                        self.flood_wait(params, retry_after)
+                        logger.warning('%s: 429, retry_after=%.2f, повтор %s/%s', url, retry_after, attempt, self.max_retries)
+                    else:
+                        logger.warning('%s: HTTP %s, повтор %s/%s', url, status, attempt, self.max_retries)
+                        await asyncio.sleep(self.backoff(attempt))
+                except RequestTimeout as e:
+                    api_errors.inc(url, type(e).__name__)
+                    # Как и в синхронном рантайме: запрос мог дойти до Telegram
+                    if attempt >= self.max_retries or not is_idempotent(url):
+                        raise
+                    attempt += 1
+                    logger.warning('%s: ошибка соединения, повтор %s/%s', url, attempt, self.max_retries)
+                    await asyncio.sleep(self.backoff(attempt))
+                except Exception as e:
+                    api_errors.inc(url, type(e).__name__)
+                    raise
+                finally:
+                    api_latency.observe(time.perf_counter() - start, url)
+
+        return _process_request
+
+
+def _json_or_none(result):
+    try:
+        return result.json()
+    except ValueError:
+        return None
+
+
+def _retry_after(result_json) -> float:
+    parameters = (result_json or {}).get('parameters') or {}
+    return float(parameters.get('retry_after', 1)) + random.random()
+
+
+def _rewind(files):
+    '''
+        Перемотка загружаемых файлов перед повтором запроса
+    '''
+    if not files:
+        return
+    for value in files.values():
+        file = value[1] if isinstance(value, tuple) else value
+        if hasattr(file, 'seek'):
+            file.seek(0)
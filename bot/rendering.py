@@ -0,0 +1,54 @@
+import re
+from html import unescape
+
+# Длина текстового сообщения и подписи к файлу в Telegram
+MESSAGE_MAX_LENGTH = 4096
+CAPTION_MAX_LENGTH = 1024
+
+TAG_RE = re.compile(r'<[^>]+>')
+
+
+def visible_length(text: str) -> int:
+    '''
+        Длина текста так, как её считает Telegram: после разбора html-разметки
+    '''
+    return len(unescape(TAG_RE.sub('', text or '')))
+
+
+def format_session_text(session):
+    text = f'🏕️ Смена <strong>«{session.title}»</strong>'
+    if not session.place is None:
+        text += f'\n\n🗺️ Место проведения: <strong>{session.place.title}</strong>'
+
+    if not (session.start_date is None or session.end_date is None):
+        text += f"\n📆 Даты: <strong>{str(session.start_date).replace('-', '.')}–{str(session.end_date).replace('-', '.')}</strong>"
+
+    if not session.description is None:
+        text += f'\n\n{session.description}'
+
+    return text
+
+
+def format_place_text(place):
+    text = f'<strong>«{place.title}»</strong>'
+
+    if not place.description is None:
+        text += f'\n\n{place.description}'
+
+    return text
+
+
+def format_info_text(info):
+    return info.text
+
+
+def text_limit_error(text: str, with_file: bool):
+    '''
+        Сообщение об ошибке, если текст не поместится в сообщение или подпись к файлу, иначе None
+    '''
+    limit = CAPTION_MAX_LENGTH if with_file else MESSAGE_MAX_LENGTH
+    length = visible_length(text)
+    if length <= limit:
+        return None
+    kind = 'подписи к файлу' if with_file else 'сообщения'
+    return f'Текст {kind} в Telegram - {length} символов, максимум {limit}. Сократите текст на {length - limit} символов'
@@ -0,0 +1,43 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+# Алиас соединения только для чтения
+REPLICA = 'replica'
+
+# Обрабатывается ли сейчас обновление бота
+_handler_reads = ContextVar('bot_handler_reads', default=False)
+
+
+@contextmanager
+def handler_reads():
+    '''
+        Чтение из БД внутри блока идёт через соединение только для чтения, если оно настроено
+    '''
+    token = _handler_reads.set(True)
+    try:
+        yield
+    finally:
+        _handler_reads.reset(token)
+
+
+class BotReadRouter:
+    '''
+        Чтение в обработчиках бота - через REPLICA, запись и всё остальное (админка, команды) - через default.
+        Оба алиаса указывают на один файл SQLite, поэтому записанное сразу видно при чтении
+    '''
+
+    def db_for_read(self, model, **hints):
+        if _handler_reads.get() and REPLICA in settings.DATABASES:
+            return REPLICA
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
@@ -0,0 +1,75 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from . import media, metrics
+from .catalog import catalog
+from .models import GeneralInfo, Session, Place, OptionalInfo
+
+
+@receiver([post_save, post_delete], sender=GeneralInfo)
+@receiver([post_save, post_delete], sender=Session)
+@receiver([post_save, post_delete], sender=Place)
+@receiver([post_save, post_delete], sender=OptionalInfo)
+def invalidate_catalog(sender, **kwargs):
+    '''
+        Сброс каталога после фиксации изменений в БД
+    '''
+    transaction.on_commit(catalog.invalidate)
+
+
+def rerender(sessions: list):
+    changed = []
+    for session in sessions:
+        text = session.render()
+        if text != session.rendered_text:
+            session.rendered_text = text
+            changed.append(session)
+    Session.objects.bulk_update(changed, ['rendered_text'])
+
+
+@receiver(post_save, sender=Place)
+def render_place_sessions(sender, instance, update_fields=None, **kwargs):
+    '''
+        В тексте смены есть название места: готовые тексты смен этого места собираются заново
+    '''
+    if update_fields is not None and not set(update_fields) & set(Place.render_fields):
+        return
+    sessions = list(Session.objects.filter(place=instance))
+    for session in sessions:
+        session.place = instance
+    rerender(sessions)
+
+
+@receiver(post_delete, sender=Place)
+def render_orphan_sessions(sender, instance, **kwargs):
+    '''
+        После удаления места его смены остаются без места (SET_NULL обходит save)
+    '''
+    rerender(list(Session.objects.filter(place__isnull=True)))
+
+
+@receiver(post_save, sender=Session)
+@receiver(post_save, sender=OptionalInfo)
+def prepare_media(sender, instance, **kwargs):
+    '''
+        Подготовка постера или файла для Telegram в фоне после сохранения
+    '''
+    if media.needs_processing(instance):
+        transaction.on_commit(partial(media.schedule, sender, instance.pk))
+
+
+@receiver(connection_created)
+def count_queries(sender, connection, **kwargs):
+    '''
+        Подсчёт запросов к БД на обновление для метрик.
+        Объект соединения живёт в потоке дольше самого подключения и переподключается
+        после close_old_connections, поэтому обёртка ставится один раз.
+        Контекстный execute_wrapper в track_update не подходит: в async-рантайме запросы идут
+        через соединения потоков sync_to_async и алиас replica, а не через соединение потока обработки
+    '''
+    if metrics.count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(metrics.count_query)
@@ -0,0 +1,282 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Optional, Union
+
+from asgiref.sync import sync_to_async
+
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from telebot import logger
+
+from telebot.storage import StateStorageBase, StateDataContext
+from telebot.asyncio_storage import StateStorageBase as AsyncStateStorageBase
+from telebot.asyncio_storage import StateDataContext as AsyncStateDataContext
+
+# Отметка об отсутствии состояния в кэше
+_MISSING = object()
+
+
+class DatabaseStateStorage(StateStorageBase):
+    '''
+        Хранилище состояний telebot в БД Django.
+        Состояние видно всем процессам и переживает перезапуск.
+        Чтения идут через небольшой LRU-кэш процесса с коротким временем жизни,
+        чтобы частые get_state не ходили в БД. Кэш свой у каждого процесса: при нескольких
+        воркерах изменение из другого процесса становится видно не позже чем через cache_ttl секунд.
+        cache_ttl=0 отключает кэш, если такая задержка недопустима.
+
+        У каждого состояния есть срок жизни (ttls, иначе default_ttl): брошенные
+        диалоги истекают, а фоновый чистильщик удаляет истёкшие записи
+        и давно не использованные сверх max_entries. Использованием считается и запись,
+        и чтение из БД: чтение обновляет метку updated не чаще раза в touch_interval секунд
+    '''
+
+    def __init__(self, cache_size: int = 1024, cache_ttl: float = 2, default_ttl: float = 86400, ttls: Optional[dict] = None,
+                 max_entries: int = 100000, sweep_interval: float = 300, touch_interval: float = 60, separator: Optional[str] = ":", prefix: Optional[str] = "telebot") -> None:
+        self.separator = separator
+        self.prefix = prefix
+        if not self.prefix:
+            raise ValueError("Prefix cannot be empty")
+
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.default_ttl = default_ttl
+        self.ttls = ttls or {}
+        self.max_entries = max_entries
+        self.sweep_interval = sweep_interval
+        self.touch_interval = touch_interval
+        self._sweeper = None
+
+        self.live = 0
+        self.expired = 0
+        self.evicted = 0
+        self.cache_evicted = 0
+
+    @property
+    def model(self):
+        # Модели ещё не загружены, когда хранилище создаётся в bot/__init__.py
+        from .models import ChatState
+        return ChatState
+
+    def _key(self, chat_id, user_id, business_connection_id=None, message_thread_id=None, bot_id=None) -> str:
+        return self._get_key(chat_id, user_id, self.prefix, self.separator, business_connection_id, message_thread_id, bot_id)
+
+    def ttl(self, state: str) -> float:
+        return self.ttls.get(state, self.default_ttl)
+
+    def _cached(self, key):
+        with self._lock:
+            item = self._cache.get(key)
+            if item is None:
+                return _MISSING
+            expires, record = item
+            if expires < time.monotonic():
+                del self._cache[key]
+                return _MISSING
+            self._cache.move_to_end(key)
+            return record
+
+    def _remember(self, key, record):
+        lifetime = self.cache_ttl
+        if record is not None:
+            lifetime = min(lifetime, (record['expires'] - timezone.now()).total_seconds())
+
+        with self._lock:
+            self._cache[key] = (time.monotonic() + lifetime, record)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+                self.cache_evicted += 1
+
+    def _load(self, key) -> Optional[dict]:
+        '''
+            Запись состояния: {'state': ..., 'data': ...} или None
+        '''
+        record = self._cached(key)
+        if record is not _MISSING:
+            return record
+
+        now = timezone.now()
+        row = self.model.objects.filter(key=key, expires__gt=now).values('state', 'data', 'expires', 'updated').first()
+        if row is not None and row['updated'] <= now - timedelta(seconds=self.touch_interval):
+            # Отметка использования для вытеснения: диалог, который только читают, не должен уйти первым
+            self.model.objects.filter(key=key).update(updated=now)
+            row['updated'] = now
+        self._remember(key, row)
+        return row
+
+    def set_state(self, chat_id: int, user_id: int, state: str, business_connection_id: Optional[str] = None,
+                  message_thread_id: Optional[int] = None, bot_id: Optional[int] = None) -> bool:
+        if hasattr(state, "name"):
+            state = state.name
+
+        self.start_sweeper()
+        key = self._key(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+        now = timezone.now()
+        row = self.model(key=key, state=state, expires=now + timedelta(seconds=self.ttl(state)))
+        # Одна транзакция: в SQLite первая же запись берёт блокировку, и параллельный
+        # воркер ждёт её (timeout соединения), а не видит запись наполовину
+        with transaction.atomic():
+            # Данные истёкшего диалога не должны перейти в новый
+            self.model.objects.filter(key=key, expires__lte=now).delete()
+            self.model.objects.bulk_create([row], update_conflicts=True, unique_fields=['key'], update_fields=['state', 'expires', 'updated'])
+        # Данные живого диалога сохраняются при смене состояния, их прочитает следующее обращение
+        self._forget(key)
+        return True
+
+    def get_state(self, chat_id: int, user_id: int, business_connection_id: Optional[str] = None,
+                  message_thread_id: Optional[int] = None, bot_id: Optional[int] = None) -> Union[str, None]:
+        record = self._load(self._key(chat_id, user_id, business_connection_id, message_thread_id, bot_id))
+        return None if record is None else record['state']
+
+    def delete_state(self, chat_id: int, user_id: int, business_connection_id: Optional[str] = None,
+                     message_thread_id: Optional[int] = None, bot_id: Optional[int] = None) -> bool:
+        key = self._key(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+        deleted, _ = self.model.objects.filter(key=key).delete()
+        self._remember(key, None)
+        return deleted > 0
+
+    def set_data(self, chat_id: int, user_id: int, key: str, value: Union[str, int, float, dict], business_connection_id: Optional[str] = None,
+                 message_thread_id: Optional[int] = None, bot_id: Optional[int] = None) -> bool:
+        _key = self._key(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+        record = self._load(_key)
+        if record is None:
+            raise RuntimeError(f"DatabaseStateStorage: key {_key} does not exist.")
+
+        data = dict(record['data'], **{key: value})
+        self.model.objects.filter(key=_key).update(data=data)
+        self._remember(_key, dict(record, data=data))
+        return True
+
+    def get_data(self, chat_id: int, user_id: int, business_connection_id: Optional[str] = None,
+                 message_thread_id: Optional[int] = None, bot_id: Optional[int] = None) -> dict:
+        record = self._load(self._key(chat_id, user_id, business_connection_id, message_thread_id, bot_id))
+        return {} if record is None else record['data']
+
+    def reset_data(self, chat_id: int, user_id: int, business_connection_id: Optional[str] = None,
+                   message_thread_id: Optional[int] = None, bot_id: Optional[int] = None) -> bool:
+        return self.save(chat_id, user_id, {}, business_connection_id, message_thread_id, bot_id)
+
+    def get_interactive_data(self, chat_id: int, user_id: int, business_connection_id: Optional[str] = None,
+                             message_thread_id: Optional[int] = None, bot_id: Optional[int] = None) -> Optional[dict]:
+        return StateDataContext(
+            self,
+            chat_id=chat_id,
+            user_id=user_id,
+            business_connection_id=business_connection_id,
+            message_thread_id=message_thread_id,
+            bot_id=bot_id,
+        )
+
+    def save(self, chat_id: int, user_id: int, data: dict, business_connection_id: Optional[str] = None,
+             message_thread_id: Optional[int] = None, bot_id: Optional[int] = None) -> bool:
+        key = self._key(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+        updated = self.model.objects.filter(key=key).update(data=data)
+        # Кэш сбрасывается, следующее чтение возьмёт запись из БД
+        self._forget(key)
+        return updated > 0
+
+    def _forget(self, key):
+        with self._lock:
+            self._cache.pop(key, None)
+
+    def start_sweeper(self):
+        '''
+            Запуск фонового чистильщика. Выполняется один раз при первой установке состояния
+        '''
+        if self._sweeper is not None or not self.sweep_interval:
+            return
+        with self._lock:
+            if self._sweeper is None:
+                self._sweeper = threading.Thread(target=self._sweep_forever, name='bot-state-sweeper', daemon=True)
+                self._sweeper.start()
+
+    def _sweep_forever(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            close_old_connections()
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error('Ошибка очистки состояний: %s', e)
+            finally:
+                close_old_connections()
+
+    def sweep(self):
+        '''
+            Удаление истёкших состояний и давно не использованных сверх лимита
+        '''
+        now = timezone.now()
+        expired, _ = self.model.objects.filter(expires__lte=now).delete()
+        self.expired += expired
+
+        live = self.model.objects.count()
+        if live > self.max_entries:
+            oldest = self.model.objects.order_by('updated').values_list('pk', flat=True)[:live - self.max_entries]
+            evicted, _ = self.model.objects.filter(pk__in=list(oldest)).delete()
+            self.evicted += evicted
+            live -= evicted
+        self.live = live
+
+        with self._lock:
+            monotonic = time.monotonic()
+            for key in [key for key, (until, _) in self._cache.items() if until < monotonic]:
+                del self._cache[key]
+
+    def stats(self) -> dict:
+        return {
+            'live': self.live,
+            'expired': self.expired,
+            'evicted': self.evicted,
+            'cached': len(self._cache),
+            'cache_evicted': self.cache_evicted,
+        }
+
+    def __str__(self) -> str:
+        return f"<DatabaseStateStorage: {len(self._cache)} cached>"
+
+
+class AsyncDatabaseStateStorage(AsyncStateStorageBase):
+    '''
+        То же хранилище для AsyncTeleBot: обращения к БД выполняются в пуле потоков
+    '''
+
+    def __init__(self, storage: DatabaseStateStorage) -> None:
+        self.storage = storage
+
+    async def set_state(self, *args, **kwargs) -> bool:
+        return await sync_to_async(self.storage.set_state)(*args, **kwargs)
+
+    async def get_state(self, *args, **kwargs) -> Union[str, None]:
+        return await sync_to_async(self.storage.get_state)(*args, **kwargs)
+
+    async def delete_state(self, *args, **kwargs) -> bool:
+        return await sync_to_async(self.storage.delete_state)(*args, **kwargs)
+
+    async def set_data(self, *args, **kwargs) -> bool:
+        return await sync_to_async(self.storage.set_data)(*args, **kwargs)
+
+    async def get_data(self, *args, **kwargs) -> dict:
+        return await sync_to_async(self.storage.get_data)(*args, **kwargs)
+
+    async def reset_data(self, *args, **kwargs) -> bool:
+        return await sync_to_async(self.storage.reset_data)(*args, **kwargs)
+
+    async def save(self, *args, **kwargs) -> bool:
+        return await sync_to_async(self.storage.save)(*args, **kwargs)
+
+    def get_interactive_data(self, chat_id, user_id, business_connection_id=None, message_thread_id=None, bot_id=None):
+        return AsyncStateDataContext(
+            self,
+            chat_id=chat_id,
+            user_id=user_id,
+            business_connection_id=business_connection_id,
+            message_thread_id=message_thread_id,
+            bot_id=bot_id,
+        )
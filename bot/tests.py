@@ -1,3 +1,884 @@
-from django.test import TestCase
+import json
+from datetime import timedelta
+import logging
+import queue
+import sys
+import tempfile
+import threading
+import time
+from io import BytesIO
+from types import SimpleNamespace
+from logging.handlers import RotatingFileHandler, WatchedFileHandler
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.urls import reverse
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from PIL import Image
+from urllib3.exceptions import MaxRetryError, NewConnectionError, ReadTimeoutError
+
+from telebot import apihelper
+from telebot.apihelper import ApiTelegramException
+from telebot.types import Update
+
+from .catalog import Catalog
+from . import bot, outbound, views
+from .callbacks import CallbackRouter, encode, decode, MAX_LENGTH
+from .handlers.transitions import plan, current_file_id, is_not_modified
+from . import media
+from .models import ChatState, GeneralInfo, HelpTicket, OptionalInfo, Place, Session, static_fs
+from .fakeapi import FakeBotAPI, serve_in_thread
+from .dedup import UpdateDeduplicator
+from .faq import FaqIndex
+from .handlers.common import HELP_TEXT, HELP_SENT_TEXT, FAQ_TEXT, SESSIONS_TEXT
+from .ingest import UpdateQueue
+from .inline import InlineCatalog
+from .logs import JsonFormatter, SamplingFilter, ContextFilter, DeferredQueueHandler, file_handler_for, log_context
+from .tickets import TicketDispatcher
+from .storage import DatabaseStateStorage
+from .outbound import OutboundScheduler, TokenBucket
+from .transport import Transport, is_idempotent
+
+
+def make_record(msg='сообщение %s', args=('x',), level=logging.INFO, exc_info=None):
+    return logging.LogRecord('bot', level, __file__, 10, msg, args, exc_info)
+
+
+class JsonFormatterTests(SimpleTestCase):
+    def test_one_line_with_context(self):
+        record = make_record()
+        with log_context(update_id=7, chat_id=5, handler='start'):
+            ContextFilter().filter(record)
+        line = JsonFormatter().format(record)
+
+        self.assertNotIn('\n', line)
+        data = json.loads(line)
+        self.assertEqual(data['message'], 'сообщение x')
+        self.assertEqual(data['level'], 'INFO')
+        self.assertEqual((data['update_id'], data['chat_id'], data['handler']), (7, 5, 'start'))
+
+    def test_context_outside_update_is_omitted(self):
+        record = make_record()
+        ContextFilter().filter(record)
+        self.assertNotIn('update_id', json.loads(JsonFormatter().format(record)))
+
+    def test_exception(self):
+        try:
+            raise ValueError('сломалось')
+        except ValueError:
+            record = make_record(level=logging.ERROR, exc_info=sys.exc_info())
+        self.assertIn('ValueError: сломалось', json.loads(JsonFormatter().format(record))['exc'])
+
+
+class SamplingFilterTests(SimpleTestCase):
+    def test_debug_is_sampled(self):
+        sampling = SamplingFilter(0.25)
+        with mock.patch('bot.logs.random.random', side_effect=[0.1, 0.5]):
+            self.assertTrue(sampling.filter(make_record(level=logging.DEBUG)))
+            self.assertFalse(sampling.filter(make_record(level=logging.DEBUG)))
+
+    def test_other_levels_always_pass(self):
+        sampling = SamplingFilter(0)
+        self.assertTrue(sampling.filter(make_record(level=logging.INFO)))
+        self.assertTrue(sampling.filter(make_record(level=logging.ERROR)))
+        self.assertFalse(sampling.filter(make_record(level=logging.DEBUG)))
+
+    def test_full_rate_keeps_everything(self):
+        with mock.patch('bot.logs.random.random', return_value=0.99):
+            self.assertTrue(SamplingFilter(1.0).filter(make_record(level=logging.DEBUG)))
+
+
+class DeferredQueueHandlerTests(SimpleTestCase):
+    def test_message_is_rendered_before_args_change(self):
+        log_queue = queue.SimpleQueue()
+        data = {'state': 'до'}
+        DeferredQueueHandler(log_queue).emit(make_record('данные %s', (data,)))
+        data['state'] = 'после'
+
+        record = log_queue.get_nowait()
+        self.assertEqual(record.getMessage(), "данные {'state': 'до'}")
+        self.assertIsNone(record.args)
+
+    def test_exception_is_rendered_in_caller_thread(self):
+        log_queue = queue.SimpleQueue()
+        try:
+            raise KeyError('k')
+        except KeyError:
+            DeferredQueueHandler(log_queue).emit(make_record(level=logging.ERROR, exc_info=sys.exc_info()))
+
+        record = log_queue.get_nowait()
+        self.assertIsNone(record.exc_info)
+        self.assertIn('KeyError', record.exc_text)
+        self.assertIn('KeyError', json.loads(JsonFormatter().format(record))['exc'])
+
+
+
+class LogFileHandlerTests(SimpleTestCase):
+    def test_rotation_modes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for rotate, handler_class in (('size', RotatingFileHandler), ('external', WatchedFileHandler)):
+                handler = file_handler_for(f'{directory}/bot.log', rotate)
+                self.assertIs(type(handler), handler_class)
+                handler.close()
+            with self.assertRaises(ValueError):
+                file_handler_for(f'{directory}/bot.log', 'daily')
+
+class CallbackDataTests(SimpleTestCase):
+    def test_round_trip(self):
+        self.assertEqual(decode(encode('s', 12)), ('s', 12))
+        self.assertEqual(decode(encode('m', 'sessions')), ('m', 'sessions'))
+        self.assertEqual(decode(encode('p')), ('p', ''))
+        self.assertEqual(decode(encode('s', '>40')), ('s', '>40'))
+
+    def test_legacy_format(self):
+        self.assertEqual(decode('main.sessions'), ('m', 'sessions'))
+        self.assertEqual(decode('s.summer-camp'), ('s', 'summer-camp'))
+        self.assertEqual(decode('p.return'), ('p', ''))
+        self.assertEqual(decode('main.return'), ('m', 'return'))
+
+    def test_unknown_data(self):
+        self.assertEqual(decode('x.y'), (None, 'x.y'))
+        self.assertEqual(decode('1garbage'), (None, '1garbage'))
+        self.assertEqual(decode(''), (None, ''))
+
+    def test_length_limit_in_bytes(self):
+        # Кириллица занимает два байта в UTF-8
+        arg = 'я' * ((MAX_LENGTH - len(encode('i'))) // 2)
+        self.assertLessEqual(len(encode('i', arg).encode()), MAX_LENGTH)
+        with self.assertRaises(ValueError):
+            encode('i', arg + 'я')
+
+
+class CallbackRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.router = CallbackRouter()
+        self.calls = []
+
+        @self.router.route('s')
+        def session(call, arg):
+            self.calls.append(('s', arg))
+
+        @self.router.fallback
+        def fallback(call, arg):
+            self.calls.append(('fallback', arg))
+
+    def test_dispatch_by_tag(self):
+        self.router.dispatch(SimpleNamespace(data=encode('s', 3)))
+        self.router.dispatch(SimpleNamespace(data='s.summer-camp'))
+        self.assertEqual(self.calls, [('s', 3), ('s', 'summer-camp')])
+
+    def test_unknown_goes_to_fallback(self):
+        self.router.dispatch(SimpleNamespace(data=encode('z', 1)))
+        self.router.dispatch(SimpleNamespace(data=None))
+        self.assertEqual(self.calls, [('fallback', 1), ('fallback', '')])
+
+
+class TransitionPlanTests(SimpleTestCase):
+    def test_text_target(self):
+        self.assertEqual(plan('text', 'text'), 'edit_text')
+        self.assertEqual(plan('photo', 'text'), 'resend')
+        self.assertEqual(plan('location', 'text'), 'resend')
+
+    def test_media_target(self):
+        self.assertEqual(plan('photo', 'photo'), 'edit_media')
+        self.assertEqual(plan('document', 'photo'), 'edit_media')
+        self.assertEqual(plan('photo', 'document', same_file=True), 'edit_caption')
+
+    def test_text_cannot_become_media(self):
+        self.assertEqual(plan('text', 'photo'), 'resend')
+        self.assertEqual(plan('text', 'document', same_file=True), 'resend')
+
+    def test_current_file_id(self):
+        photo = SimpleNamespace(content_type='photo', photo=[SimpleNamespace(file_id='small'), SimpleNamespace(file_id='big')])
+        document = SimpleNamespace(content_type='document', document=SimpleNamespace(file_id='doc'))
+        self.assertEqual(current_file_id(photo), 'big')
+        self.assertEqual(current_file_id(document), 'doc')
+        self.assertIsNone(current_file_id(SimpleNamespace(content_type='text')))
+
+    def test_not_modified(self):
+        self.assertTrue(is_not_modified(Exception('Bad Request: message is not modified: specified new message content')))
+        self.assertFalse(is_not_modified(Exception('Bad Request: message to edit not found')))
+
+
+class TokenBucketTests(SimpleTestCase):
+    def bucket(self, rate, capacity):
+        bucket = TokenBucket(rate, capacity)
+        bucket.updated = 0.0
+        return bucket
+
+    def test_burst_then_wait(self):
+        bucket = self.bucket(rate=2, capacity=3)
+        self.assertEqual([bucket.reserve(0.0) for _ in range(3)], [0.0, 0.0, 0.0])
+        # Каждый следующий запрос ждёт ещё 1 / rate секунды
+        self.assertAlmostEqual(bucket.reserve(0.0), 0.5)
+        self.assertAlmostEqual(bucket.reserve(0.0), 1.0)
+
+    def test_refill_is_capped(self):
+        bucket = self.bucket(rate=2, capacity=3)
+        bucket.reserve(0.0)
+        bucket.reserve(100.0)
+        self.assertAlmostEqual(bucket.tokens, 2)
+
+    def test_pause(self):
+        bucket = self.bucket(rate=1, capacity=5)
+        bucket.pause(0.0, 3)
+        self.assertAlmostEqual(bucket.reserve(0.0), 3.0)
+        self.assertEqual(bucket.reserve(10.0), 0.0)
+
+
+class OutboundSchedulerTests(SimpleTestCase):
+    def scheduler(self, max_wait=0.5):
+        # Глобальный лимит высокий, задержки от него - микросекунды
+        return OutboundScheduler(global_rate=10000, chat_rate=1, group_per_minute=20, burst=1, max_retries=0, max_wait=max_wait)
+
+    def test_edits_do_not_spend_chat_limit(self):
+        outbound = self.scheduler()
+        self.assertAlmostEqual(outbound.reserve('sendMessage', {'chat_id': 5}), 0.0, places=2)
+        for _ in range(5):
+            self.assertAlmostEqual(outbound.reserve('editMessageText', {'chat_id': 5}), 0.0, places=2)
+
+    def test_long_wait_is_rejected_and_refunded(self):
+        outbound = self.scheduler()
+        self.assertAlmostEqual(outbound.reserve('sendMessage', {'chat_id': 5}, 0.5), 0.0, places=2)
+        self.assertIsNone(outbound.reserve('sendMessage', {'chat_id': 5}, 0.5))
+        self.assertIsNone(outbound.reserve('sendMessage', {'chat_id': 5}, 0.5))
+        # Отклонённые запросы не отодвигают следующий слот чата
+        self.assertAlmostEqual(outbound.reserve('sendMessage', {'chat_id': 5}), 1.0, places=1)
+        self.assertEqual(outbound.stats()['rejected'], 2)
+
+    def test_other_chats_are_not_delayed(self):
+        outbound = self.scheduler()
+        outbound.reserve('sendMessage', {'chat_id': 5})
+        outbound.reserve('sendMessage', {'chat_id': 5})
+        self.assertAlmostEqual(outbound.reserve('sendMessage', {'chat_id': 6}, 0.5), 0.0, places=2)
+
+    def test_edit_respects_flood_pause(self):
+        outbound = self.scheduler()
+        outbound.reserve('sendMessage', {'chat_id': 5})
+        outbound.flood_wait({'chat_id': 5}, 3)
+        self.assertIsNone(outbound.reserve('editMessageText', {'chat_id': 5}, 0.5))
+
+    def test_request_sender_does_not_sleep_over_limit(self):
+        outbound = self.scheduler()
+        session = mock.Mock()
+        session.request.return_value = SimpleNamespace(status_code=200)
+        with mock.patch('bot.outbound.apihelper._get_req_session', return_value=session), \
+                mock.patch('bot.outbound.time.sleep') as sleep:
+            outbound.request_sender('post', 'https://api/bot1/sendMessage', params={'chat_id': 5})
+            with self.assertRaises(ApiTelegramException) as error:
+                outbound.request_sender('post', 'https://api/bot1/sendMessage', params={'chat_id': 5})
+        self.assertEqual(error.exception.error_code, 429)
+        self.assertTrue(all(call.args[0] <= outbound.max_wait for call in sleep.call_args_list))
+        self.assertEqual(session.request.call_count, 1)
+
+    def test_retryable(self):
+        outbound = self.scheduler()
+        self.assertTrue(outbound.retryable('sendMessage', 429))
+        self.assertFalse(outbound.retryable('sendMessage', 502))
+        self.assertTrue(outbound.retryable('editMessageText', 502))
+        self.assertFalse(outbound.retryable('editMessageText', 400))
+
+
+class CatalogVersionTests(TestCase):
+    def test_change_in_other_process_is_seen(self):
+        # Два экземпляра каталога - как кэши двух процессов с общей БД
+        worker, admin = Catalog(), Catalog()
+        place = Place.objects.create(title='Лес', slug='les')
+        with override_settings(BOT_CATALOG_CHECK_INTERVAL=0):
+            self.assertEqual(worker.get().place(place.pk).title, 'Лес')
+            Place.objects.filter(pk=place.pk).update(title='Поле')
+            admin.invalidate()
+            self.assertEqual(worker.get().place(place.pk).title, 'Поле')
+
+    def test_version_is_checked_once_per_interval(self):
+        worker, admin = Catalog(), Catalog()
+        with override_settings(BOT_CATALOG_CHECK_INTERVAL=60):
+            snapshot = worker.get()
+            admin.invalidate()
+            with self.assertNumQueries(0):
+                self.assertIs(worker.get(), snapshot)
+            # Свои изменения процесс видит сразу
+            worker.invalidate()
+            self.assertIsNot(worker.get(), snapshot)
+
+
+class MediaCatalogTests(TestCase):
+    def test_prepared_poster_reaches_other_processes(self):
+        buffer = BytesIO()
+        Image.new('RGB', (40, 30), 'red').save(buffer, 'PNG')
+        worker = Catalog()
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch.dict(static_fs.__dict__, {'base_location': directory, 'location': directory}), \
+                override_settings(BOT_CATALOG_CHECK_INTERVAL=0):
+            session = Session(title='Лето', slug='leto')
+            session.image.save('poster.png', ContentFile(buffer.getvalue()), save=False)
+            session.save()
+            self.assertFalse(worker.get().session(session.pk).image_prepared)
+
+            # Обработка идёт в фоновом потоке, кэш каталога другого процесса узнаёт о ней через общую версию
+            media.process(Session, session.pk)
+            self.assertEqual(worker.get().session(session.pk).image_prepared.name, 'images/sessions/leto.photo.jpg')
+
+
+class PrewarmCatalogTests(TransactionTestCase):
+    def test_new_file_ids_reach_running_processes(self):
+        info = OptionalInfo.objects.create(title='Памятка', slug='memo', text='Текст', is_photo=False, file='docs/memo.pdf', thumbnail='docs/memo.thumb.jpg')
+        worker = Catalog()
+
+        def upload(bot, chat_id, instance, field, file_id_field, as_photo, **kwargs):
+            type(instance).objects.filter(pk=instance.pk).update(**{file_id_field: 'FILE1'})
+            return SimpleNamespace(message_id=1)
+
+        with override_settings(BOT_CATALOG_CHECK_INTERVAL=0), \
+                mock.patch('bot.management.commands.prewarm.send_cached_file', side_effect=upload), \
+                mock.patch('bot.management.commands.prewarm.bot.delete_message'):
+            self.assertIsNone(worker.get().info(info.pk).file_id)
+            call_command('prewarm', chat='7', workers=1, stdout=mock.Mock())
+            self.assertEqual(worker.get().info(info.pk).file_id, 'FILE1')
+
+
+class FaqIndexTests(TestCase):
+    def test_index_follows_catalog_version(self):
+        worker, admin = Catalog(), Catalog()
+        index = FaqIndex()
+        info = OptionalInfo.objects.create(title='Оплата путёвки', slug='pay', text='Оплатить путёвку можно картой', is_photo=False)
+        with override_settings(BOT_CATALOG_CHECK_INTERVAL=0):
+            self.assertEqual(index.search(worker.get(), 'как оплатить картой')[0][1], ('i', info.pk))
+            self.assertEqual(index.search(worker.get(), 'погода завтра', threshold=0.3), [])
+
+            # Статья изменена в другом процессе: индекс пересобирается по новой версии каталога
+            OptionalInfo.objects.filter(pk=info.pk).update(title='Погода', text='Прогноз погоды на смену')
+            admin.invalidate()
+            self.assertEqual(index.search(worker.get(), 'погода завтра', threshold=0.3)[0][1], ('i', info.pk))
+            self.assertEqual(index.stats()['version'], worker.version)
+
+    def test_search_without_changes_does_not_rebuild(self):
+        OptionalInfo.objects.create(title='Смена', slug='smena', text='Расписание смены', is_photo=False)
+        index = FaqIndex()
+        snapshot = Catalog().get()
+        with mock.patch.object(index, '_add', wraps=index._add) as add:
+            index.search(snapshot, 'смена')
+            index.search(snapshot, 'смена')
+        self.assertEqual(add.call_count, 1)
+
+
+class InlineCatalogTests(TestCase):
+    def test_index_follows_catalog_version(self):
+        worker, admin = Catalog(), Catalog()
+        inline = InlineCatalog()
+        place = Place.objects.create(title='Лагерь Звёздный', slug='star')
+        with override_settings(BOT_CATALOG_CHECK_INTERVAL=0):
+            results, _ = inline.get(worker.get()).search('звезд', 0, 10)
+            self.assertEqual([result.id for result in results], [f'p{place.pk}'])
+
+            Place.objects.filter(pk=place.pk).update(title='Лагерь Сосновый')
+            admin.invalidate()
+            index = inline.get(worker.get())
+            self.assertEqual(index.search('звезд', 0, 10), ([], ''))
+            self.assertEqual([result.id for result in index.search('соснов', 0, 10)[0]], [f'p{place.pk}'])
+            self.assertIs(inline.get(worker.get()), index)
+
+
+class HandlerTests(TestCase):
+    '''
+        Обработчики бота против заглушки Bot API: проверяются запросы, которые она получила
+    '''
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.api = FakeBotAPI()
+        cls.addClassCleanup(setattr, apihelper, 'API_URL', apihelper.API_URL)
+        apihelper.API_URL = serve_in_thread(cls.api)
+
+    def setUp(self):
+        self.api.reset()
+        # Лимиты отправки не должны мешать серии обновлений одного чата
+        outbound.set_limits(1000, 1000, 1000, 1000)
+        self.addCleanup(outbound.set_limits, settings.BOT_RATE_GLOBAL, settings.BOT_RATE_CHAT, settings.BOT_RATE_GROUP_PER_MINUTE, settings.BOT_RATE_BURST)
+        # Свежие кэши каталога: версии в БД откатываются вместе с транзакцией теста
+        for name, value in (('catalog', Catalog()), ('faq_index', FaqIndex())):
+            patcher = mock.patch.object(views, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        GeneralInfo.objects.create(start_text='Привет из лагеря', admins='10')
+        self.place = Place.objects.create(title='Лагерь Звёздный', slug='star', latitude=55.7, longitude=37.6)
+        self.session = Session.objects.create(title='Лето', slug='leto', place=self.place, description='Июньская смена')
+        self.info = OptionalInfo.objects.create(title='Оплата путёвки', slug='pay', text='Оплатить путёвку можно картой', is_photo=False)
+
+    def message(self, text: str, update_id: int = 1):
+        data = {
+            'message_id': update_id, 'date': 1, 'text': text,
+            'chat': {'id': 5, 'type': 'private'}, 'from': {'id': 5, 'is_bot': False, 'first_name': 'Аня', 'username': 'anya'},
+        }
+        if text.startswith('/'):
+            data['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]
+        return Update.de_json({'update_id': update_id, 'message': data})
+
+    def tap(self, tag: str, arg='', update_id: int = 100):
+        return Update.de_json({'update_id': update_id, 'callback_query': {
+            'id': str(update_id), 'chat_instance': '5', 'data': encode(tag, arg),
+            'from': {'id': 5, 'is_bot': False, 'first_name': 'Аня', 'username': 'anya'},
+            'message': {'message_id': 50, 'date': 1, 'chat': {'id': 5, 'type': 'private'}, 'text': 'меню'},
+        }})
+
+    def process(self, update) -> list:
+        self.api.reset()
+        bot.process_new_updates([update])
+        return list(self.api.requests)
+
+    def test_start(self):
+        (method, params), = self.process(self.message('/start'))
+        self.assertEqual((method, params['chat_id'], params['text']), ('sendMessage', '5', 'Привет из лагеря'))
+        self.assertIn(encode('m', 'sessions'), params['reply_markup'])
+
+    def test_main_list(self):
+        (method, params), = self.process(self.tap('m', 'sessions'))
+        self.assertEqual((method, params['message_id'], params['text']), ('editMessageText', '50', SESSIONS_TEXT))
+        self.assertIn(encode('s', self.session.pk), params['reply_markup'])
+
+    def test_session(self):
+        (method, params), = self.process(self.tap('s', self.session.pk))
+        self.assertEqual(method, 'editMessageText')
+        self.assertIn('Лето', params['text'])
+        self.assertIn('Лагерь Звёздный', params['text'])
+        self.assertIn(encode('s'), params['reply_markup'])
+
+    def test_place_with_location(self):
+        requests = self.process(self.tap('p', self.place.pk))
+        self.assertEqual([method for method, _ in requests], ['editMessageText', 'sendLocation'])
+        self.assertEqual((float(requests[1][1]['latitude']), float(requests[1][1]['longitude'])), (55.7, 37.6))
+
+    def test_info(self):
+        (method, params), = self.process(self.tap('i', self.info.pk))
+        self.assertEqual(method, 'editMessageText')
+        self.assertIn('картой', params['text'])
+
+    def test_help_suggests_articles_then_escalates(self):
+        (method, params), = self.process(self.message('/help'))
+        self.assertEqual((method, params['text']), ('sendMessage', HELP_TEXT))
+
+        (method, params), = self.process(self.message('как оплатить путёвку картой?', 2))
+        self.assertEqual((method, params['text']), ('sendMessage', FAQ_TEXT))
+        self.assertIn(encode('i', self.info.pk), params['reply_markup'])
+        self.assertIn(encode('m', 'escalate'), params['reply_markup'])
+
+        # Рассылка админам идёт в фоне, здесь проверяется только сохранённый запрос
+        with mock.patch.object(views.ticket_dispatcher, 'start'):
+            (method, params), = self.process(self.tap('m', 'escalate'))
+        self.assertEqual((method, params['text']), ('sendMessage', HELP_SENT_TEXT))
+        ticket = HelpTicket.objects.get()
+        self.assertEqual((ticket.user_id, ticket.username, ticket.text), (5, 'anya', 'как оплатить путёвку картой?'))
+
+
+class TransportTests(SimpleTestCase):
+    def test_pool_size(self):
+        transport = Transport(pool_size=7)
+        session = transport.session()
+        self.assertIs(session.get_adapter('https://api.telegram.org'), transport.adapter)
+        self.assertIs(session.get_adapter('http://127.0.0.1:8081'), transport.adapter)
+        pool = transport.adapter.poolmanager.connection_from_url('https://api.telegram.org')
+        self.assertEqual(pool.pool.maxsize, 7)
+
+    def test_only_connect_errors_are_retried(self):
+        retry = Transport(connect_retries=2).adapter.max_retries
+        url = '/bot1/sendMessage'
+        # Подключение не установлено - повтор безопасен даже для sendMessage
+        refused = NewConnectionError(None, 'Connection refused')
+        retry = retry.increment('POST', url, error=refused)
+        retry = retry.increment('POST', url, error=refused)
+        with self.assertRaises(MaxRetryError):
+            retry.increment('POST', url, error=refused)
+        # Ошибка чтения: запрос мог дойти до Telegram, повтора нет ни для какого метода
+        retry = Transport(connect_retries=2).adapter.max_retries
+        timeout = ReadTimeoutError(None, url, 'timed out')
+        with self.assertRaises(ReadTimeoutError):
+            retry.increment('POST', url, error=timeout)
+        with self.assertRaises(MaxRetryError):
+            retry.increment('GET', '/bot1/getMe', error=timeout)
+
+    def test_upload_timeout(self):
+        transport = Transport(connect_timeout=3, read_timeout=15, upload_timeout=120)
+        self.assertEqual(transport.timeout('sendMessage'), (3, 15))
+        self.assertEqual(transport.timeout('sendPhoto'), (3, 120))
+        self.assertEqual(transport.timeout('editMessageMedia'), (3, 120))
+        self.assertEqual(transport.timeout('sendMessage', files={'photo': b'x'}), (3, 120))
+
+    def test_request_sender_passes_timeout(self):
+        outbound = OutboundScheduler(1000, 1000, 1000, 1000, max_retries=0, transport=Transport(read_timeout=15, upload_timeout=120))
+        session = mock.Mock()
+        session.request.return_value = SimpleNamespace(status_code=200)
+        with mock.patch('bot.outbound.apihelper._get_req_session', return_value=session):
+            outbound.request_sender('post', 'https://api/bot1/sendDocument', params={'chat_id': 5}, files={'document': b'x'})
+        self.assertEqual(session.request.call_args.kwargs['timeout'], (3.05, 120))
+
+    def test_idempotent_methods(self):
+        self.assertTrue(is_idempotent('editMessageText'))
+        self.assertTrue(is_idempotent('answerCallbackQuery'))
+        self.assertFalse(is_idempotent('sendMessage'))
+        self.assertFalse(is_idempotent('copyMessage'))
+
+
+class StateStorageTests(TestCase):
+    def storage(self, **kwargs):
+        kwargs.setdefault('cache_ttl', 0)
+        return DatabaseStateStorage(sweep_interval=0, **kwargs)
+
+    def expire(self, **filters):
+        ChatState.objects.filter(**filters).update(expires=timezone.now() - timedelta(seconds=1))
+
+    def test_ttl_per_state(self):
+        storage = self.storage(default_ttl=100, ttls={'help': 10})
+        storage.set_state(5, 5, 'help')
+        storage.set_state(6, 6, 'menu')
+        expires = dict(ChatState.objects.values_list('state', 'expires'))
+        now = timezone.now()
+        self.assertAlmostEqual((expires['help'] - now).total_seconds(), 10, delta=2)
+        self.assertAlmostEqual((expires['menu'] - now).total_seconds(), 100, delta=2)
+
+    def test_expired_state_is_gone(self):
+        storage = self.storage()
+        storage.set_state(5, 5, 'help')
+        storage.set_data(5, 5, 'question', 'где лагерь?')
+        self.expire()
+        self.assertIsNone(storage.get_state(5, 5))
+        self.assertEqual(storage.get_data(5, 5), {})
+
+        # Новый диалог не наследует данные истёкшего
+        storage.set_state(5, 5, 'help')
+        self.assertEqual(storage.get_data(5, 5), {})
+
+    def test_upsert_keeps_live_data(self):
+        storage = self.storage()
+        storage.set_state(5, 5, 'help')
+        storage.set_data(5, 5, 'question', 'где лагерь?')
+        storage.set_state(5, 5, 'faq')
+        self.assertEqual(ChatState.objects.count(), 1)
+        self.assertEqual(storage.get_state(5, 5), 'faq')
+        self.assertEqual(storage.get_data(5, 5), {'question': 'где лагерь?'})
+
+    def test_reset_data_and_delete(self):
+        storage = self.storage()
+        self.assertFalse(storage.reset_data(5, 5))
+        storage.set_state(5, 5, 'help')
+        storage.set_data(5, 5, 'question', 'где лагерь?')
+        self.assertTrue(storage.reset_data(5, 5))
+        self.assertEqual(storage.get_data(5, 5), {})
+        self.assertEqual(storage.get_state(5, 5), 'help')
+        self.assertTrue(storage.delete_state(5, 5))
+        self.assertIsNone(storage.get_state(5, 5))
+        with self.assertRaises(RuntimeError):
+            storage.set_data(5, 5, 'question', 'x')
+
+    def test_sweep_removes_expired(self):
+        storage = self.storage()
+        storage.set_state(5, 5, 'help')
+        storage.set_state(6, 6, 'help')
+        self.expire(key__contains=':5:')
+        storage.sweep()
+        self.assertEqual(list(ChatState.objects.values_list('key', flat=True)), [storage._key(6, 6)])
+        self.assertEqual((storage.stats()['expired'], storage.stats()['live']), (1, 1))
+
+
+class StateCacheTests(TestCase):
+    def storage(self, **kwargs):
+        return DatabaseStateStorage(sweep_interval=0, **kwargs)
+
+    def test_lru_eviction(self):
+        storage = self.storage(cache_size=2, cache_ttl=60)
+        for chat in (1, 2, 3):
+            storage.set_state(chat, chat, 'help')
+            storage.get_state(chat, chat)
+        self.assertEqual(list(storage._cache), [storage._key(2, 2), storage._key(3, 3)])
+
+        # Чтение из кэша переносит ключ в конец, вытесняется давно не читанный
+        storage.get_state(2, 2)
+        storage.get_state(1, 1)
+        self.assertEqual(list(storage._cache), [storage._key(2, 2), storage._key(1, 1)])
+        self.assertEqual(storage.stats()['cache_evicted'], 2)
+
+    def test_cache_ttl(self):
+        storage = self.storage(cache_ttl=2)
+        storage.set_state(5, 5, 'help')
+        with mock.patch('bot.storage.time.monotonic', return_value=1000.0):
+            self.assertEqual(storage.get_state(5, 5), 'help')
+        # Изменение из другого процесса не видно, пока запись в кэше жива
+        ChatState.objects.update(state='faq')
+        with mock.patch('bot.storage.time.monotonic', return_value=1001.0):
+            with self.assertNumQueries(0):
+                self.assertEqual(storage.get_state(5, 5), 'help')
+        with mock.patch('bot.storage.time.monotonic', return_value=1002.5):
+            self.assertEqual(storage.get_state(5, 5), 'faq')
+
+    def test_read_touches_updated(self):
+        storage = self.storage(cache_ttl=0, touch_interval=60)
+        storage.set_state(5, 5, 'help')
+        old = timezone.now() - timedelta(seconds=120)
+        ChatState.objects.update(updated=old)
+        storage.get_state(5, 5)
+        self.assertGreater(ChatState.objects.get().updated, old)
+
+        # Недавно отмеченная запись при чтении не переписывается
+        with self.assertNumQueries(1):
+            storage.get_state(5, 5)
+
+    def test_sweep_evicts_least_recently_used(self):
+        storage = self.storage(cache_ttl=0, touch_interval=60, max_entries=2)
+        now = timezone.now()
+        for chat, age in ((1, 300), (2, 200), (3, 100)):
+            storage.set_state(chat, chat, 'help')
+            ChatState.objects.filter(key=storage._key(chat, chat)).update(updated=now - timedelta(seconds=age))
+
+        # Диалог 1 записан раньше всех, но его читают - уходит диалог 2
+        storage.get_state(1, 1)
+        storage.sweep()
+        self.assertEqual(sorted(ChatState.objects.values_list('key', flat=True)), [storage._key(1, 1), storage._key(3, 3)])
+        self.assertEqual((storage.stats()['evicted'], storage.stats()['live']), (1, 2))
+
+
+class StubBot:
+    '''
+        Бот без сети: запоминает сообщения, админам из failing отправка не проходит
+    '''
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.sent = []
+
+    def send_message(self, chat_id, text, parse_mode=None):
+        if chat_id in self.failing:
+            raise ApiTelegramException('sendMessage', None, {'error_code': 403, 'description': 'Forbidden: bot was blocked by the user'})
+        self.sent.append((chat_id, text))
+
+
+class TicketDispatcherTests(TestCase):
+    def setUp(self):
+        GeneralInfo.objects.create(admins='10|11')
+        patcher = mock.patch('bot.tickets.catalog', Catalog())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.bot = StubBot(failing={11})
+        self.dispatcher = TicketDispatcher(self.bot, workers=2, coalesce=5, max_attempts=3, retry_delay=30, poll=60)
+        # Поток рассылки не запускается, dispatch() вызывается тестом
+        self.dispatcher.start = mock.Mock()
+
+    def due(self, **filters):
+        HelpTicket.objects.filter(**filters).update(next_attempt=timezone.now() - timedelta(seconds=1))
+
+    def test_requests_are_coalesced(self):
+        first = self.dispatcher.submit(5, 5, 'anya', 'где лагерь?')
+        self.dispatcher.submit(5, 5, 'anya', 'когда смена?')
+        self.dispatcher.submit(6, 6, None, 'сколько стоит?')
+
+        # Время объединения не вышло
+        self.assertAlmostEqual(self.dispatcher.dispatch(), 5, delta=1)
+        self.assertEqual(self.bot.sent, [])
+
+        # Созревший запрос уходит вместе с более свежим запросом того же пользователя
+        self.due(pk=first.pk)
+        self.dispatcher.dispatch()
+        (admin, text), = self.bot.sent
+        self.assertEqual(admin, 10)
+        self.assertIn('@anya', text)
+        self.assertIn('где лагерь?', text)
+        self.assertIn('когда смена?', text)
+        self.assertFalse(HelpTicket.objects.filter(user_id=6).exclude(delivered=[]).exists())
+
+    def test_active_claim_is_skipped_and_expired_lease_is_taken(self):
+        ticket = self.dispatcher.submit(5, 5, 'anya', 'где лагерь?')
+        HelpTicket.objects.update(claim='other', next_attempt=timezone.now() + timedelta(seconds=300))
+        self.dispatcher.dispatch()
+        self.assertEqual(self.bot.sent, [])
+
+        # Обработчик упал, аренда истекла: запрос подхватывает другой
+        self.due(pk=ticket.pk)
+        self.dispatcher.dispatch()
+        self.assertEqual([admin for admin, _ in self.bot.sent], [10])
+
+    def test_partial_delivery_retries_only_missing_admins(self):
+        ticket = self.dispatcher.submit(5, 5, 'anya', 'где лагерь?')
+        self.due()
+        self.dispatcher.dispatch()
+        ticket.refresh_from_db()
+        self.assertEqual((ticket.status, ticket.delivered, ticket.attempts, ticket.claim), (HelpTicket.PENDING, [10], 1, ''))
+
+        self.bot.failing.clear()
+        self.due()
+        self.dispatcher.dispatch()
+        ticket.refresh_from_db()
+        self.assertEqual([admin for admin, _ in self.bot.sent], [10, 11])
+        self.assertEqual((ticket.status, ticket.delivered), (HelpTicket.SENT, [10, 11]))
+        self.assertIsNotNone(ticket.sent)
+
+    def test_backoff_then_failed(self):
+        ticket = self.dispatcher.submit(5, 5, 'anya', 'где лагерь?')
+        for attempt, delay in ((1, 30), (2, 60)):
+            self.due()
+            self.dispatcher.dispatch()
+            ticket.refresh_from_db()
+            self.assertEqual((ticket.attempts, ticket.status), (attempt, HelpTicket.PENDING))
+            self.assertAlmostEqual((ticket.next_attempt - timezone.now()).total_seconds(), delay, delta=2)
+
+        self.due()
+        self.dispatcher.dispatch()
+        ticket.refresh_from_db()
+        self.assertEqual((ticket.attempts, ticket.status), (3, HelpTicket.FAILED))
+        self.assertEqual(self.dispatcher.stats()['failed'], 1)
+
+        # Отклонённый запрос больше не рассылается
+        self.bot.failing.clear()
+        self.dispatcher.dispatch()
+        self.assertEqual([admin for admin, _ in self.bot.sent], [10])
+
+    def test_no_admins_keeps_attempts(self):
+        GeneralInfo.objects.update(admins='')
+        ticket = self.dispatcher.submit(5, 5, 'anya', 'где лагерь?')
+        with override_settings(ADMINS=''):
+            self.due()
+            self.dispatcher.dispatch()
+        ticket.refresh_from_db()
+        self.assertEqual((ticket.status, ticket.attempts, ticket.claim), (HelpTicket.PENDING, 0, ''))
+        self.assertGreater(ticket.next_attempt, timezone.now())
+
+
+@override_settings(BOT_MENU_PAGE_SIZE=2)
+class CatalogPageTests(TestCase):
+    def setUp(self):
+        self.pks = [Place.objects.create(title=f'Место {i}', slug=f'place-{i}').pk for i in range(5)]
+        self.snapshot = Catalog().get()
+
+    def buttons(self, markup: str) -> list:
+        return [button['callback_data'] for row in json.loads(markup)['inline_keyboard'] for button in row]
+
+    def test_first_middle_last(self):
+        a, b, c, d, e = self.pks
+        self.assertEqual(self.buttons(self.snapshot.page('p')), [encode('p', a), encode('p', b), encode('p', f'>{b}'), encode('m', 'return')])
+        self.assertEqual(self.buttons(self.snapshot.page('p', f'>{b}')),
+                         [encode('p', c), encode('p', d), encode('p', f'<{c}'), encode('p', f'>{d}'), encode('m', 'return')])
+        self.assertEqual(self.buttons(self.snapshot.page('p', f'>{d}')), [encode('p', e), encode('p', f'<{e}'), encode('m', 'return')])
+
+    def test_back(self):
+        a, b, c, d, e = self.pks
+        self.assertEqual(self.buttons(self.snapshot.page('p', f'<{e}')),
+                         [encode('p', c), encode('p', d), encode('p', f'<{c}'), encode('p', f'>{d}'), encode('m', 'return')])
+        # Назад к началу списка: кнопки «назад» на первой странице нет
+        self.assertEqual(self.buttons(self.snapshot.page('p', f'<{c}')), [encode('p', a), encode('p', b), encode('p', f'>{b}'), encode('m', 'return')])
+
+    def test_deleted_cursor_row(self):
+        a, b, c, d, e = self.pks
+        Place.objects.filter(pk=c).delete()
+        # Курсор - граница по pk, удалённая строка не мешает листать
+        self.assertEqual(self.buttons(self.snapshot.page('p', f'>{c}')), [encode('p', d), encode('p', e), encode('p', f'<{d}'), encode('m', 'return')])
+        self.assertEqual(self.buttons(self.snapshot.page('p', f'<{c}')), [encode('p', a), encode('p', b), encode('p', f'>{b}'), encode('m', 'return')])
+
+    def test_forged_cursor_is_not_cached(self):
+        self.snapshot.page('p', '>999999')
+        self.snapshot.page('p', f'>{self.pks[1]}')
+        self.assertEqual(set(self.snapshot._pages), {('p', f'>{self.pks[1]}')})
+
+    async def test_async_page_matches_sync(self):
+        snapshot = await Catalog().aget()
+        for cursor in ('', f'>{self.pks[1]}', f'<{self.pks[4]}'):
+            self.assertEqual(await snapshot.apage('p', cursor), await sync_to_async(self.snapshot.page)('p', cursor))
+
+
+class UpdateDeduplicatorTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    async def test_ring_eviction(self):
+        deduplicator = UpdateDeduplicator(size=2)
+        for update_id in (1, 2, 3):
+            self.assertFalse(await deduplicator.is_duplicate(update_id))
+        self.assertTrue(await deduplicator.is_duplicate(3))
+        # 1 вытеснен из кольца и снова считается новым, 2 при этом вытесняется
+        self.assertFalse(await deduplicator.is_duplicate(1))
+        self.assertFalse(await deduplicator.is_duplicate(2))
+        self.assertEqual(deduplicator.stats(), {'tracked': 2, 'dropped': 1})
+
+    async def test_forget(self):
+        deduplicator = UpdateDeduplicator(size=10, shared=True)
+        self.assertFalse(await deduplicator.is_duplicate(7))
+        await deduplicator.forget(7)
+        # Отклонённое обновление Telegram пришлёт снова, оно не должно отсеяться
+        self.assertFalse(await deduplicator.is_duplicate(7))
+        self.assertTrue(await deduplicator.is_duplicate(7))
+
+    async def test_shared_cache_between_processes(self):
+        first, second = UpdateDeduplicator(size=10, shared=True), UpdateDeduplicator(size=10, shared=True)
+        self.assertFalse(await first.is_duplicate(7))
+        # Кольцо второго процесса пустое, повтор ловит общий кэш
+        self.assertTrue(await second.is_duplicate(7))
+        self.assertEqual(second.stats()['dropped'], 1)
+
+        # Без общего кэша процессы друг о друге не знают
+        self.assertFalse(await UpdateDeduplicator(size=10).is_duplicate(8))
+        self.assertFalse(await UpdateDeduplicator(size=10).is_duplicate(8))
+
+
+def chat_update(update_id: int, chat_id: int):
+    return Update.de_json({'update_id': update_id, 'message': {
+        'message_id': update_id, 'date': 1, 'text': str(update_id),
+        'chat': {'id': chat_id, 'type': 'private'}, 'from': {'id': chat_id, 'is_bot': False, 'first_name': 'a'},
+    }})
+
+
+class UpdateQueueTests(SimpleTestCase):
+    def test_chat_order_and_sharding(self):
+        handled = []
+
+        def handler(update):
+            time.sleep(0.001 * (update.update_id % 3))
+            handled.append((update.message.chat.id, update.update_id, threading.current_thread().name))
+
+        updates = UpdateQueue(handler, shard_size=100, workers=3)
+        for update_id in range(30):
+            self.assertTrue(updates.submit(chat_update(update_id, update_id % 6 + 1)))
+        updates.join()
+
+        self.assertEqual(len(handled), 30)
+        for chat_id in range(1, 7):
+            # Один чат - один шард (chat_id % workers), обновления по порядку поступления
+            order = [update_id for chat, update_id, _ in handled if chat == chat_id]
+            self.assertEqual(order, sorted(order))
+            self.assertEqual({name for chat, _, name in handled if chat == chat_id}, {f'bot-shard-{chat_id % 3}'})
+
+    def test_full_shard_rejects(self):
+        taken, release = threading.Event(), threading.Event()
+
+        def handler(update):
+            taken.set()
+            release.wait(5)
+
+        updates = UpdateQueue(handler, shard_size=1, workers=2)
+        self.assertTrue(updates.submit(chat_update(1, 2)))
+        taken.wait(5)
+        self.assertTrue(updates.submit(chat_update(2, 2)))
+        # Шард чата 2 заполнен, шард чата 3 свободен
+        self.assertFalse(updates.submit(chat_update(3, 4)))
+        self.assertTrue(updates.submit(chat_update(4, 3)))
+        self.assertEqual((updates.rejected, updates.stats()['shards']), (1, [1, 1]))
+        release.set()
+        updates.join()
+
+    @override_settings(BOT_RUNTIME='sync', BOT_INGEST_MODE='queue')
+    def test_webhook_answers_503_when_full(self):
+        full = mock.Mock(depth=1, maxsize=1)
+        full.submit.return_value = False
+        body = json.dumps({'update_id': 9001, 'message': {
+            'message_id': 1, 'date': 1, 'text': 'привет', 'chat': {'id': 5, 'type': 'private'},
+        }})
+        with mock.patch.object(views, 'update_queue', full):
+            for _ in range(2):
+                # Отклонённое обновление не помечено как принятое: повтор снова доходит до очереди
+                response = self.client.post(reverse('bot:index'), body, content_type='application/json')
+                self.assertEqual(response.status_code, 503)
+        self.assertEqual(full.submit.call_count, 2)
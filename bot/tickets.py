@@ -0,0 +1,206 @@
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Min, Q
+from django.utils import timezone
+
+from . import bot, logger
+from .catalog import catalog
+from .handlers.common import format_help_digest
+from .models import HelpTicket
+
+# Сколько секунд запросы принадлежат одному обработчику. Если процесс упал, их подхватит другой
+LEASE = 300
+
+
+def parse_admins(value) -> list:
+    '''
+        Id админов из строки через |, без повторов
+    '''
+    admins = []
+    for part in (value or '').split('|'):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            admin = int(part)
+        except ValueError:
+            logger.warning('Некорректный id админа: %s', part)
+            continue
+        if admin not in admins:
+            admins.append(admin)
+    return admins
+
+
+def admin_ids() -> list:
+    '''
+        Админы из общей информации, если там пусто - из переменной ADMINS
+    '''
+    return parse_admins(catalog.get().general.admins) or parse_admins(settings.ADMINS)
+
+
+class TicketDispatcher:
+    '''
+        Фоновая рассылка запросов помощи.
+        Запрос сохраняется в БД, пользователь сразу получает ответ, а рассылка идёт в отдельном потоке:
+        запросы одного пользователя за coalesce секунд объединяются в одно сообщение,
+        админам оно уходит параллельно (лимиты на отправку соблюдает outbound),
+        при ошибке отправка повторяется только тем админам, которые его не получили
+    '''
+
+    def __init__(self, bot, workers: int = 4, coalesce: float = 5, max_attempts: int = 8, retry_delay: float = 30, poll: float = 60):
+        self.bot = bot
+        self.coalesce = coalesce
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.poll = poll
+
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bot-help')
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+        self.digests = 0
+        self.delivered = 0
+        self.retries = 0
+        self.failed = 0
+
+    def start(self):
+        '''
+            Запуск потока рассылки. Выполняется один раз при первом запросе или проверке готовности
+        '''
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='bot-help-dispatcher', daemon=True)
+                self._thread.start()
+
+    def _ticket(self, user_id: int, chat_id: int, username, text: str) -> HelpTicket:
+        return HelpTicket(
+            user_id=user_id,
+            chat_id=chat_id,
+            username=username,
+            text=text,
+            next_attempt=timezone.now() + timedelta(seconds=self.coalesce),
+        )
+
+    def submit(self, user_id: int, chat_id: int, username, text: str) -> HelpTicket:
+        ticket = self._ticket(user_id, chat_id, username, text)
+        ticket.save()
+        self.start()
+        self._wake.set()
+        return ticket
+
+    async def asubmit(self, user_id: int, chat_id: int, username, text: str) -> HelpTicket:
+        ticket = self._ticket(user_id, chat_id, username, text)
+        await ticket.asave()
+        self.start()
+        self._wake.set()
+        return ticket
+
+    def _run(self):
+        delay = 0
+        while True:
+            self._wake.wait(delay)
+            self._wake.clear()
+            close_old_connections()
+            try:
+                delay = self.dispatch()
+            except Exception as e:
+                logger.error('Ошибка рассылки запросов помощи: %s', e, exc_info=True)
+                delay = self.poll
+            finally:
+                close_old_connections()
+
+    def dispatch(self) -> float:
+        '''
+            Рассылка запросов, время которых подошло. Возвращает паузу до следующей проверки
+        '''
+        now = timezone.now()
+        users = set(HelpTicket.objects.filter(status=HelpTicket.PENDING, next_attempt__lte=now).values_list('user_id', flat=True))
+        for user_id in users:
+            token = uuid.uuid4().hex
+            # Вместе с созревшим запросом уходят и более свежие запросы того же пользователя
+            HelpTicket.objects.filter(status=HelpTicket.PENDING, user_id=user_id).filter(Q(claim='') | Q(next_attempt__lte=now)) \
+                .update(claim=token, next_attempt=now + timedelta(seconds=LEASE))
+            tickets = list(HelpTicket.objects.filter(claim=token).order_by('created'))
+            if tickets:
+                self.deliver(tickets)
+
+        earliest = HelpTicket.objects.filter(status=HelpTicket.PENDING).aggregate(next_attempt=Min('next_attempt'))['next_attempt']
+        if earliest is None:
+            return self.poll
+        return min(self.poll, max(0.0, (earliest - timezone.now()).total_seconds()))
+
+    def _send(self, admin: int, tickets: list) -> bool:
+        ticket = tickets[0]
+        user = f'@{ticket.username}' if ticket.username else f'id {ticket.user_id}'
+        try:
+            for text in format_help_digest(user, [request.text for request in tickets]):
+                self.bot.send_message(chat_id=admin, text=text, parse_mode='html')
+        except Exception as e:
+            logger.error('Не удалось отправить запрос помощи админу %s: %s', admin, e)
+            return False
+        return True
+
+    def deliver(self, tickets: list):
+        '''
+            Одно сообщение каждому админу с запросами, которые он ещё не получил
+        '''
+        admins = admin_ids()
+        if not admins:
+            # Попытка не засчитывается: запросы ждут, пока появятся админы
+            logger.warning('Список админов пуст, запросы помощи ждут отправки')
+            HelpTicket.objects.filter(pk__in=[ticket.pk for ticket in tickets]) \
+                .update(claim='', next_attempt=timezone.now() + timedelta(seconds=self.retry_delay))
+            return
+
+        jobs = {}
+        for admin in admins:
+            pending = [ticket for ticket in tickets if admin not in ticket.delivered]
+            if pending:
+                jobs[admin] = self._executor.submit(self._send, admin, pending)
+        received = {admin for admin, job in jobs.items() if job.result()}
+        self.digests += len(received)
+
+        now = timezone.now()
+        for ticket in tickets:
+            ticket.delivered = sorted(set(ticket.delivered) | received)
+            ticket.claim = ''
+            if set(admins) <= set(ticket.delivered):
+                ticket.status = HelpTicket.SENT
+                ticket.sent = now
+                self.delivered += 1
+            else:
+                ticket.attempts += 1
+                if ticket.attempts >= self.max_attempts:
+                    ticket.status = HelpTicket.FAILED
+                    self.failed += 1
+                    logger.error('%s не доставлен за %s попыток', ticket, ticket.attempts)
+                else:
+                    ticket.next_attempt = now + timedelta(seconds=self.retry_delay * 2 ** (ticket.attempts - 1))
+                    self.retries += 1
+            ticket.save(update_fields=['delivered', 'claim', 'status', 'sent', 'attempts', 'next_attempt'])
+
+    def stats(self) -> dict:
+        return {
+            'digests': self.digests,
+            'delivered': self.delivered,
+            'retries': self.retries,
+            'failed': self.failed,
+        }
+
+
+ticket_dispatcher = TicketDispatcher(
+    bot,
+    workers=settings.BOT_HELP_WORKERS,
+    coalesce=settings.BOT_HELP_COALESCE,
+    max_attempts=settings.BOT_HELP_MAX_ATTEMPTS,
+    retry_delay=settings.BOT_HELP_RETRY_DELAY,
+    poll=settings.BOT_HELP_POLL,
+)
@@ -0,0 +1,70 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Методы с загрузкой файлов: им нужен долгий таймаут чтения
+UPLOAD_METHODS = {
+    'sendphoto', 'senddocument', 'sendvideo', 'sendaudio', 'sendvoice', 'sendanimation',
+    'sendvideonote', 'sendsticker', 'sendmediagroup', 'editmessagemedia', 'setwebhook',
+}
+# Методы, повтор которых не создаёт дублей: чтение, настройки, правки и удаление.
+# Повтор send*, forward* и copy* после обрыва мог бы отправить сообщение дважды
+IDEMPOTENT_PREFIXES = ('get', 'set', 'delete', 'edit', 'answer')
+
+
+def is_idempotent(method_name: str) -> bool:
+    return method_name.lower().startswith(IDEMPOTENT_PREFIXES)
+
+
+class Transport:
+    '''
+        HTTP-транспорт синхронного бота: один пул keep-alive соединений на процесс,
+        раздельные таймауты для загрузок и остальных методов и повтор неудачных подключений.
+        Подключение, которое не удалось установить, повторять безопасно для любого метода:
+        запрос до Telegram не дошёл
+    '''
+
+    def __init__(self, pool_size: int = 32, connect_timeout: float = 3.05, read_timeout: float = 15,
+                 upload_timeout: float = 120, connect_retries: int = 2):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.upload_timeout = upload_timeout
+        self.adapter = HTTPAdapter(
+            # Пул на хост: обычно это один api.telegram.org
+            pool_connections=4,
+            pool_maxsize=pool_size,
+            max_retries=Retry(total=connect_retries, connect=connect_retries, read=0, status=0, other=0,
+                              backoff_factor=0.2, raise_on_status=False),
+        )
+
+    def session(self) -> requests.Session:
+        session = requests.Session()
+        session.mount('https://', self.adapter)
+        session.mount('http://', self.adapter)
+        return session
+
+    def timeout(self, method_name: str, files=None) -> tuple:
+        '''
+            (таймаут подключения, таймаут чтения) для метода Bot API
+        '''
+        if files or method_name.lower() in UPLOAD_METHODS:
+            return self.connect_timeout, self.upload_timeout
+        return self.connect_timeout, self.read_timeout
+
+    def stats(self) -> dict:
+        '''
+            Переиспользование соединений: запросы против новых подключений по всем пулам
+        '''
+        pools = self.adapter.poolmanager.pools
+        connections = requests_count = 0
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                connections += pool.num_connections
+                requests_count += pool.num_requests
+        return {
+            'pools': len(pools),
+            'connections': connections,
+            'requests': requests_count,
+            'reused': max(0, requests_count - connections),
+        }
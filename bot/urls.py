@@ -10,4 +10,6 @@ app_name = 'bot'
 urlpatterns = [
     path(settings.BOT_TOKEN, views.index, name="index"),
     path('', views.set_webhook, name="set_webhook"),
+    path('ready/', views.ready, name="ready"),
+    path('metrics/', views.metrics, name="metrics"),
 ]
@@ -1,54 +1,122 @@
-from traceback import format_exc
+import hmac
+
 from asgiref.sync import sync_to_async
 
-from django.shortcuts import render
 from django.conf import settings
-from django.http import HttpRequest, JsonResponse
+from django.http import HttpRequest, HttpResponse, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_GET, require_POST
 
 from telebot.apihelper import ApiTelegramException
-from telebot.types import Update, InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery, Message, InputMediaPhoto
-
-from bot import bot, logger, UsersStates
-from nika.settings import ADMINS
-from .handlers.common import format_session_text, format_place_text, replace_message
-from .models import GeneralInfo, Session, Place, OptionalInfo
-
-# Получение общей информации
-general = GeneralInfo.objects.first()
-
-# Основная клавиатура
-first_markup = InlineKeyboardMarkup(row_width=1)
-first_markup.add(
-    InlineKeyboardButton(text='Смены', callback_data='main.sessions'),
-    InlineKeyboardButton(text='Места проведения', callback_data='main.places'),
-    InlineKeyboardButton(text='Дополнительная информация', callback_data='main.more_info')
+from telebot.types import Update, CallbackQuery, Message, InlineQuery
+
+from bot import bot, commands, logger, outbound, state_storage, transport, UsersStates
+from .handlers.common import (
+    replace_message, replace_with_file,
+    HELP_TEXT, HELP_SENT_TEXT, FAQ_TEXT, FAQ_EXPIRED_TEXT, SESSIONS_RETURN_TEXT, SESSION_NOT_FOUND_TEXT,
+    PLACES_TEXT, PLACE_NOT_FOUND_TEXT, INFOS_TEXT, INFO_NOT_FOUND_TEXT, MAIN_LISTS,
 )
+from .callbacks import CallbackRouter
+from .catalog import catalog, first_markup, cancel_markup, faq_markup, is_cursor
+from .faq import faq_index
+from .inline import inline_catalog, inline_button, parse_offset
+from .tickets import ticket_dispatcher
+from .dedup import UpdateDeduplicator
+from .identity import load_identity, register_bot
+from .ingest import UpdateQueue, update_chat_id
+from .logs import log_context
+from .handlers.transitions import transition_stats
+from .routers import handler_reads
+from .metrics import registry, timed, track_update, help_requests
+
+if settings.BOT_RUNTIME == 'async':
+    from . import asyncio_views
 
 
-def refresh_general():
+@require_GET
+def set_webhook(request: HttpRequest) -> JsonResponse:
     '''
-        Обновление общей информации
+        Установка вебхуков со стороны бота.
+        Это же шаг развёртывания: регистрация команд и сохранение данных бота
     '''
-    global general
-    general = GeneralInfo.objects.first()
+    register_bot(bot, commands)
+    bot.set_webhook(url=f"{settings.HOOK}/bot/{settings.BOT_TOKEN}", allowed_updates=['message', 'callback_query', 'inline_query'])
+    bot.send_message(settings.OWNER_ID, "webhook set")
+    return JsonResponse({"message": "OK"}, status=200)
 
 
 @require_GET
-def set_webhook(request: HttpRequest) -> JsonResponse:
+def ready(request: HttpRequest) -> JsonResponse:
     '''
-        Установка вебхуков со стороны бота
+        Проверка готовности: прогрев каталога и запуск рассылки запросов помощи перед приёмом обновлений
     '''
-    bot.set_webhook(url=f"{settings.HOOK}/bot/{settings.BOT_TOKEN}", allowed_updates=['message', 'callback_query'])
-    bot.send_message(settings.OWNER_ID, "webhook set")
-    return JsonResponse({"message": "OK"}, status=200)
+    current = catalog.get()
+    identity = load_identity()
+    # Рассылка запросов помощи, оставшихся с прошлого запуска
+    ticket_dispatcher.start()
+    return JsonResponse({
+        "message": "OK",
+        "catalog_version": current.version,
+        "bot": identity['username'] if identity else None,
+    }, status=200)
+
+
+def process_update(update: Update):
+    '''
+        Обработка одного обновления с логированием ошибок
+    '''
+    try:
+        with log_context(update_id=update.update_id, chat_id=update_chat_id(update)), track_update('sync'), handler_reads():
+            bot.process_new_updates([update])
+    except ApiTelegramException as e:
+        logger.error("Telegram exception. %s", e, exc_info=True)
+    except ConnectionError as e:
+        logger.error("Connection error. %s", e, exc_info=True)
+    except Exception as e:
+        bot.send_message(settings.OWNER_ID, f'Error from index: {e}')
+        logger.error("Unhandled exception. %s", e, exc_info=True)
+
+
+# Отсев повторных доставок одного и того же обновления
+deduplicator = UpdateDeduplicator(settings.BOT_DEDUP_SIZE, settings.BOT_DEDUP_SHARED, settings.BOT_DEDUP_TTL)
+
+# Очередь обновлений для режима BOT_INGEST_MODE = 'queue'
+update_queue = UpdateQueue(process_update, settings.BOT_SHARD_QUEUE_SIZE, settings.BOT_WORKERS)
+
+# Состояние компонентов бота в метриках
+registry.collect('bot_queue', update_queue.stats)
+registry.collect('bot_dedup', deduplicator.stats)
+registry.collect('bot_outbound', outbound.stats)
+registry.collect('bot_http', transport.stats)
+registry.collect('bot_state', state_storage.stats)
+registry.collect('bot_catalog', lambda: {'version': catalog.version})
+registry.collect('bot_transitions', transition_stats.stats, label='transition')
+registry.collect('bot_faq', faq_index.stats)
+registry.collect('bot_inline', inline_catalog.stats)
+registry.collect('bot_help', ticket_dispatcher.stats)
+
+
+def metrics_allowed(request: HttpRequest) -> bool:
+    if settings.BOT_METRICS_TOKEN:
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() == 'bearer' and hmac.compare_digest(token.encode(), settings.BOT_METRICS_TOKEN.encode()):
+            return True
+    return request.META.get('REMOTE_ADDR') in settings.BOT_METRICS_ALLOWED_IPS
+
+
+@require_GET
+def metrics(request: HttpRequest) -> HttpResponse:
+    '''
+        Метрики в текстовом формате Prometheus. Доступны по токену или с разрешённых адресов
+    '''
+    if not metrics_allowed(request):
+        return HttpResponse('Forbidden', status=403, content_type='text/plain; charset=utf-8')
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 
 @csrf_exempt
 @require_POST
-@sync_to_async
-def index(request: HttpRequest) -> JsonResponse:
+async def index(request: HttpRequest) -> JsonResponse:
     '''
         Установка вебхуков со стороны сайта
     '''
@@ -56,340 +124,262 @@ def index(request: HttpRequest) -> JsonResponse:
         return JsonResponse({"message": "Bad Request"}, status=403)
 
     json_string = request.body.decode("utf-8")
-    update = Update.de_json(json_string)
     try:
-        bot.process_new_updates([update])
-    except ApiTelegramException as e:
-        logger.error(f"Telegram exception. {e} {format_exc()}")
-    except ConnectionError as e:
-        logger.error(f"Connection error. {e} {format_exc()}")
-    except Exception as e:
-        bot.send_message(settings.OWNER_ID, f'Error from index: {e}')
-        logger.error(f"Unhandled exception. {e} {format_exc()}")
+        update = Update.de_json(json_string)
+    except (ValueError, KeyError, TypeError):
+        # Некорректный JSON или JSON без полей обновления (например, без update_id)
+        update = None
+    if update is None:
+        return JsonResponse({"message": "Bad Request"}, status=400)
+
+    if await deduplicator.is_duplicate(update.update_id):
+        logger.info('Повторная доставка обновления %s пропущена', update.update_id)
+        return JsonResponse({"message": "OK"}, status=200)
+
+    if settings.BOT_RUNTIME == 'async':
+        await asyncio_views.process_update(update)
+        return JsonResponse({"message": "OK"}, status=200)
+
+    if settings.BOT_INGEST_MODE != 'queue':
+        await sync_to_async(process_update)(update)
+        return JsonResponse({"message": "OK"}, status=200)
+
+    if not update_queue.submit(update):
+        # Telegram повторит доставку позже
+        logger.warning('Очередь шарда заполнена (всего в очереди %s/%s), обновление %s отклонено', update_queue.depth, update_queue.maxsize, update.update_id)
+        await deduplicator.forget(update.update_id)
+        return JsonResponse({"message": "Service Unavailable"}, status=503)
     return JsonResponse({"message": "OK"}, status=200)
 
 
 @bot.message_handler(commands=["start"])
+@timed
 def start_command(message: Message):
     '''
         Команда старт
     '''
-    logger.info(f"ОТЛАДКА: Команда /start в чате {message.chat.id} от пользователя {message.from_user.id}")
+    logger.debug("Команда /start в чате %s от пользователя %s", message.chat.id, message.from_user.id)
     bot.send_message(
         chat_id=message.chat.id, 
-        text=general.start_text, 
+        text=catalog.get().general.start_text, 
         parse_mode='html', 
         reply_markup=first_markup
         )
     
 
 @bot.message_handler(commands=["help"])
+@timed
 def help_command(message: Message):
     '''
         Команда help
     '''
     bot.send_message(
         chat_id=message.chat.id, 
-        text="Отправьте интересующий вопрос или проблему. Этот текст будет перенаправлен для дальнейшей консультации", 
+        text=HELP_TEXT, 
         parse_mode='html', 
-        reply_markup=InlineKeyboardMarkup(keyboard=[[InlineKeyboardButton(text='Отмена', callback_data="main.cancel")]])
+        reply_markup=cancel_markup
         )
     bot.set_state(user_id=message.from_user.id, state=UsersStates.help_request, chat_id=message.chat.id)
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('main.'))
-def main_callbacks(call: CallbackQuery):
+@bot.inline_handler(func=lambda query: True)
+@timed
+def inline_query_handler(query: InlineQuery):
     '''
-        Обработка нажатий основных Inline-кнопок
+        Поиск смен, мест и статей по началу слов названия из любого чата
     '''
-    call_value = call.data.split('.')[-1]
-    logger.info(f'ОТЛАДКА: Нажата Inline-кнопка. Значение {call_value}')
+    index = inline_catalog.get(catalog.get())
+    results, next_offset = index.search(query.query, parse_offset(query.offset), settings.BOT_INLINE_PAGE_SIZE)
+    bot.answer_inline_query(
+        query.id,
+        results,
+        cache_time=settings.BOT_INLINE_CACHE_TIME,
+        next_offset=next_offset,
+        button=inline_button
+        )
 
-    markup = InlineKeyboardMarkup(row_width=1)
-    # Возврат в начало
-    if call_value == 'cancel':
-        replace_message(call, bot, first_markup, general.start_text)
-        bot.delete_state(user_id=call.from_user.id, chat_id=call.message.chat.id)
 
-    # Возврат в начало
-    if call_value == 'return':
-        replace_message(call, bot, first_markup, general.start_text)
+# Все нажатия Inline-кнопок разбираются одним обработчиком через роутер
+router = CallbackRouter()
 
 
-    # Отправка списка смен
-    if call_value == 'sessions':
-        all_sessions = Session.objects.all()
-        if len(all_sessions) == 0:
-            markup.add(InlineKeyboardButton(text='Вернуться ↩️', callback_data='main.return'))
+@bot.callback_query_handler(func=lambda call: True)
+def callback_dispatcher(call: CallbackQuery):
+    return router.dispatch(call)
 
-            bot.edit_message_text(
-                chat_id=call.message.chat.id, 
-                message_id=call.message.message_id, 
-                text='Смен пока нет)', 
-                reply_markup=markup
-                )
-        
-        else:
-            for session in all_sessions:
-                markup.add(
-                    InlineKeyboardButton(text=session.title, callback_data=f's.{session.slug}')
-                )
-                
-            markup.add(InlineKeyboardButton(text='Вернуться ↩️', callback_data='main.return'))
 
-            bot.edit_message_text(
-                chat_id=call.message.chat.id, 
-                message_id=call.message.message_id, 
-                text='Вот список всех смен:', 
-                reply_markup=markup
-                )
-    
-    # Отправка мест проведения
-    elif call_value == 'places':
-        all_places = Place.objects.all()
-        if len(all_places) == 0:
-            markup.add(InlineKeyboardButton(text='Вернуться ↩️', callback_data='main.return'))
+@router.fallback
+def stale_callback(call: CallbackQuery, call_value):
+    '''
+        Кнопка устаревшего или неизвестного формата: возврат в начало
+    '''
+    replace_message(call, bot, first_markup, catalog.get().general.start_text)
 
-            bot.edit_message_text(
-                chat_id=call.message.chat.id, 
-                message_id=call.message.message_id, 
-                text='Мест пока нет)', 
-                reply_markup=markup
-                )
-        
-        else:
-            for place in all_places:
-                markup.add(InlineKeyboardButton(text=place.title, callback_data=f'p.{place.slug}'))
-                
-            markup.add(InlineKeyboardButton(text='Вернуться ↩️', callback_data='main.return'))
 
-            bot.edit_message_text(
-                chat_id=call.message.chat.id, 
-                message_id=call.message.message_id, 
-                text='Это места, где обычно проходят смены. О каком месте Вы хотите узнать?', 
-                reply_markup=markup
-                )   
+@router.route('m')
+def main_callbacks(call: CallbackQuery, call_value: str):
+    '''
+        Обработка нажатий основных Inline-кнопок
+    '''
+    logger.debug('Нажата Inline-кнопка. Значение %s', call_value)
 
-    # Отправка доп информации 
-    elif call_value == 'more_info':
-        all_infos = OptionalInfo.objects.all()
-        if len(all_infos) == 0:
-            markup.add(InlineKeyboardButton(text='Вернуться ↩️', callback_data='main.return'))
+    current = catalog.get()
+    # Возврат в начало
+    if call_value == 'cancel':
+        replace_message(call, bot, first_markup, current.general.start_text)
+        bot.delete_state(user_id=call.from_user.id, chat_id=call.message.chat.id)
 
-            bot.edit_message_text(
-                chat_id=call.message.chat.id, 
-                message_id=call.message.message_id, 
-                text='Пока что нам нечего Вам рассказать)', 
-                reply_markup=markup)
-        
-        else:
-            for info in all_infos:
-                markup.add(InlineKeyboardButton(text=info.title, callback_data=f'i.{info.slug}'))
-                
-            markup.add(InlineKeyboardButton(text='Вернуться ↩️', callback_data='main.return'))
+    # Вопрос, на который в предложенных статьях не нашлось ответа
+    elif call_value == 'escalate':
+        with bot.retrieve_data(user_id=call.from_user.id, chat_id=call.message.chat.id) as data:
+            text = data.pop('help_request', None)
+        if text is None:
+            return replace_message(call, bot, first_markup, FAQ_EXPIRED_TEXT)
+        help_requests.inc('escalated')
+        send_help_request(call.message, call.from_user, text)
 
-            bot.edit_message_text(
-                chat_id=call.message.chat.id, 
-                message_id=call.message.message_id, 
-                text='Вот статьи, которые помогут Вам ответить на некоторые вопросов:', 
-                reply_markup=markup
-                )
+    # Возврат в начало
+    elif call_value == 'return':
+        replace_message(call, bot, first_markup, current.general.start_text)
+
+    # Отправка списка смен, мест проведения или доп информации
+    elif call_value in MAIN_LISTS:
+        objects, tag, text, empty_text = MAIN_LISTS[call_value]
+        bot.edit_message_text(
+            chat_id=call.message.chat.id, 
+            message_id=call.message.message_id, 
+            text=text if getattr(current, objects) else empty_text, 
+            reply_markup=current.page(tag)
+            )
             
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('s.'))
-def session_callback(call: CallbackQuery):
+@router.route('s')
+def session_callback(call: CallbackQuery, session_key):
     '''
         Подробнее о смене
     '''
-    markup = InlineKeyboardMarkup(row_width=1)
-
-    session_slug = call.data.split('.')[-1]
-
-    if session_slug == 'return':
-        all_sessions = Session.objects.all()
-
-        for session in all_sessions:
-            markup.add(
-                InlineKeyboardButton(text=session.title, callback_data=f's.{session.slug}')
-            )
-            
-        markup.add(InlineKeyboardButton(text='Вернуться ↩️', callback_data='main.return'))
+    current = catalog.get()
 
-        replace_message(call, bot, markup, 'Вот список смен')
+    # Список смен или другая его страница
+    if session_key == '' or is_cursor(session_key):
+        replace_message(call, bot, current.page('s', session_key), SESSIONS_RETURN_TEXT)
     else:
-        session = Session.objects.get(slug=session_slug)
-
-        if not session.form_url is None:
-            if session.form_url.strip() != '' and not session.form_url is None:
-                markup.add(InlineKeyboardButton(text='Записаться!', url=session.form_url))
-
-        markup.add(InlineKeyboardButton(text='К списку смен 📃', callback_data='s.return'))
-        markup.add(InlineKeyboardButton(text='В начало ↩️', callback_data='main.return'))
-
-        if session.pk:
-            if not session.image is None and not session.image == '':
-                with open(f'{settings.BASE_DIR}//{session.image.url}', 'rb') as file:
-                    try:
-                        bot.delete_message(
-                            chat_id=call.message.chat.id, 
-                            message_id=call.message.id
-                        )
-                    except Exception as e:
-                        logger.error(f'При удалении сообщения возникла ошибка: {e}')
-                    bot.send_photo(
-                        chat_id=call.message.chat.id, 
-                        photo=file,
-                        caption=format_session_text(session=session),
-                        reply_markup=markup,
-                        parse_mode='html'
-                        )
-            else:
-                return bot.edit_message_text(
-                    chat_id=call.message.chat.id, 
-                    message_id=call.message.message_id, 
-                    text=format_session_text(session=session),
-                    reply_markup=markup,
-                    parse_mode='html'
-                    )
+        session = current.session(session_key)
 
-        else:
+        if session is None:
             return bot.edit_message_text(
                 chat_id=call.message.chat.id, 
                 message_id=call.message.message_id, 
-                text='Приносим извинения, смена не найдена(', 
-                reply_markup=markup
+                text=SESSION_NOT_FOUND_TEXT, 
+                reply_markup=current.return_markup
                 )
-        
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('p.'))
-def place_callback(call: CallbackQuery):
+        markup = current.session_markups[session.pk]
+        if not session.image is None and not session.image == '':
+            return replace_with_file(
+                call,
+                bot,
+                session,
+                'image',
+                'image_file_id',
+                as_photo=True,
+                caption=session.message_text(),
+                markup=markup
+                )
+        else:
+            return replace_message(call, bot, markup, session.message_text())
+
+
+@router.route('p')
+def place_callback(call: CallbackQuery, place_key):
     '''
         Подробнее о месте проведения
     '''
-    markup = InlineKeyboardMarkup(row_width=1)
-
-    place_slug = call.data.split('.')[-1]
-
-    if place_slug == 'return':
-        all_places = Place.objects.all()
+    current = catalog.get()
 
-        for place in all_places:
-            markup.add(
-                InlineKeyboardButton(text=place.title, callback_data=f'p.{place.slug}')
-            )
-            
-        markup.add(InlineKeyboardButton(text='Вернуться ↩️', callback_data='main.return'))
+    if place_key == '' or is_cursor(place_key):
         if call.message.content_type == 'location':
-            replace_message(call, bot, markup, 'Это места, где обычно проходят смены. О каком месте Вы хотите узнать?', 2)
+            replace_message(call, bot, current.page('p', place_key), PLACES_TEXT, 2)
         else:
-            replace_message(call, bot, markup, 'Это места, где обычно проходят смены. О каком месте Вы хотите узнать?', 1)
+            replace_message(call, bot, current.page('p', place_key), PLACES_TEXT, 1)
     else:
-        markup.add(InlineKeyboardButton(text='К списку мест 📃', callback_data='p.return'))
-        markup.add(InlineKeyboardButton(text='В начало ↩️', callback_data='main.return'))
-
-        place = Place.objects.get(slug=place_slug)
+        markup = current.place_markup
+        place = current.place(place_key)
         
-        if place.pk:
-
-            if not place.latitude is None and not place.longitude is None:
-                replace_message(call, bot, None, format_place_text(place=place))
-                return bot.send_location(
-                    chat_id=call.message.chat.id,
-                    latitude=place.latitude,
-                    longitude=place.longitude,
-                    reply_markup=markup
-                )
-            else:
-                return replace_message(call, bot, markup, format_place_text(place=place))
-
+        if place is None:
+            return replace_message(call, bot, markup, PLACE_NOT_FOUND_TEXT)
+
+        if not place.latitude is None and not place.longitude is None:
+            replace_message(call, bot, None, place.message_text())
+            return bot.send_location(
+                chat_id=call.message.chat.id,
+                latitude=place.latitude,
+                longitude=place.longitude,
+                reply_markup=markup
+            )
         else:
-            return replace_message(call, bot, markup, 'Приносим извинения, данное место не найдено')
+            return replace_message(call, bot, markup, place.message_text())
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('i.'))
-def optional_info_callback(call: CallbackQuery):
+@router.route('i')
+def optional_info_callback(call: CallbackQuery, info_key):
     '''
         Дополнительная информация
     '''
-    markup = InlineKeyboardMarkup(row_width=1)
-
-    info_slug = call.data.split('.')[-1]
-    print(info_slug)
-    if info_slug == 'return':
-        all_infos = OptionalInfo.objects.all()
-
-        for info in all_infos:
-            markup.add(
-                InlineKeyboardButton(text=info.title, callback_data=f'i.{info.slug}')
-            )
-            
-        markup.add(InlineKeyboardButton(text='Вернуться ↩️', callback_data='main.return'))
-        replace_message(call, bot, markup, 'Вот статьи, которые помогут Вам ответить на некоторые вопросов:')
+    current = catalog.get()
+    if info_key == '' or is_cursor(info_key):
+        replace_message(call, bot, current.page('i', info_key), INFOS_TEXT)
     
     else:
-        markup.add(InlineKeyboardButton(text='Вернуться ↩️', callback_data='i.return'))
-        info = OptionalInfo.objects.get(slug=info_slug)
-        print(info.is_photo, info.file)
-        if info.is_photo and not info.file is None and not info.file == '':
-            with open(f'{settings.BASE_DIR}//{info.file.url}', 'rb') as file:
-                    try:
-                        bot.delete_message(
-                            chat_id=call.message.chat.id, 
-                            message_id=call.message.id
-                        )
-                    except Exception as e:
-                        logger.error(f'При удалении сообщения возникла ошибка: {e}')
-                    bot.send_photo(
-                        chat_id=call.message.chat.id, 
-                        photo=file,
-                        caption=info.text,
-                        reply_markup=markup,
-                        parse_mode='html'
-                        )
-        
+        markup = current.info_markup
+        info = current.info(info_key)
+        if info is None:
+            return replace_message(call, bot, markup, INFO_NOT_FOUND_TEXT)
+
+        if not info.file is None and not info.file == '':
+            return replace_with_file(
+                call,
+                bot,
+                info,
+                'file',
+                'file_id',
+                as_photo=info.is_photo,
+                caption=info.message_text(),
+                markup=markup
+                )
         else:
-            if not info.file is None and not info.file == '':
-                print(info.is_photo, info.file)
-                # replace_message(call, bot, None, info.text)
-                try:
-                    bot.delete_message(
-                        chat_id=call.message.chat.id, 
-                        message_id=call.message.message_id
-                        )
-                        
-                except Exception as e:
-                    print(e)
-                
-                with open(f'{settings.BASE_DIR}//{info.file.url}', 'rb') as file:
-                    print(file)
-                    bot.send_document(
-                        chat_id=call.message.chat.id,
-                        document=file,
-                        caption=info.text,
-                        reply_markup=markup,
-                        parse_mode='html'
-                    )
-            else:
-                replace_message(call, bot, markup, info.text)
+            return replace_message(call, bot, markup, info.message_text())
+
+
+def send_help_request(message: Message, user, text: str):
+    '''
+        Сохранение запроса для рассылки админам и подтверждение пользователю
+    '''
+    ticket_dispatcher.submit(user.id, message.chat.id, user.username, text)
+    bot.send_message(
+        chat_id=message.chat.id,
+        text=HELP_SENT_TEXT,
+        parse_mode='html',
+        disable_web_page_preview=True
+        )
+
 
-        
-        
 @bot.message_handler()
+@timed
 def messages_handler(message: Message):
     state = bot.get_state(user_id=message.from_user.id, chat_id=message.chat.id)
     if state == UsersStates.help_request.name:
-        text = f'<strong>Пользователь @{message.from_user.username}</strong> попросил о помощи:\n\n' \
-                f'"{message.text}"'
-        for admin in ADMINS:
-            try:
-                bot.send_message(chat_id=admin, text=text, parse_mode='html')
-            except Exception as e:
-                print(e)
-        bot.send_message(
-            chat_id=message.chat.id, 
-            text='Ваше сообщение доставлено в службу поддержки. Вы так же можете написать лично:\n\n' \
-            '<a href="t.me/oksanozka1207">Оксана Николаевна</a>\n' \
-            '<a href="t.me/zilfia17">Зульфия Ахнафовна</a>',
-            parse_mode='html',
-            disable_web_page_preview=True
-            )
\ No newline at end of file
+        # Сначала предлагаются подходящие статьи, вопрос сохраняется до решения пользователя
+        matches = faq_index.search(catalog.get(), message.text or '', settings.BOT_FAQ_RESULTS, settings.BOT_FAQ_THRESHOLD)
+        if matches:
+            logger.info('Вопрос в /help: найдено ответов %s, лучшая оценка %s', len(matches), matches[0][0])
+            help_requests.inc('suggested')
+            bot.add_data(user_id=message.from_user.id, chat_id=message.chat.id, help_request=message.text)
+            return bot.send_message(
+                chat_id=message.chat.id,
+                text=FAQ_TEXT,
+                reply_markup=faq_markup(matches)
+                )
+
+        help_requests.inc('forwarded')
+        send_help_request(message, message.from_user, message.text)
@@ -40,7 +40,113 @@ BOT_COMMANDS = [
     BotCommand("start", "Меню"),
     BotCommand("help", "Помощь"),
 ]
+# Админы через |, если в общей информации список не заполнен
 ADMINS = os.getenv('ADMINS')
+# Файл с данными бота, сохраняется при установке вебхука
+BOT_IDENTITY_FILE = os.getenv('BOT_IDENTITY_FILE', BASE_DIR / 'bot_identity.json')
+# Чат для предварительной загрузки файлов командой prewarm
+BOT_WARMUP_CHAT_ID = os.getenv('BOT_WARMUP_CHAT_ID', OWNER_ID)
+# Адрес Bot API в формате telebot, например заглушка fakeapi: http://127.0.0.1:8081/bot{0}/{1}
+BOT_API_URL = os.getenv('BOT_API_URL')
+# Доступ к /bot/metrics/: токен (заголовок Authorization: Bearer <токен>) или адреса через |.
+# За обратным прокси REMOTE_ADDR - адрес прокси, тогда нужен токен
+BOT_METRICS_TOKEN = os.getenv('BOT_METRICS_TOKEN', '')
+BOT_METRICS_ALLOWED_IPS = [ip.strip() for ip in os.getenv('BOT_METRICS_ALLOWED_IPS', '127.0.0.1|::1').split('|') if ip.strip()]
+
+# Логи: файл JSON с ротацией, уровень и доля записей DEBUG, которые попадают в лог
+BOT_LOG_FILE = os.getenv('BOT_LOG_FILE', BASE_DIR / 'ai_log.log')
+BOT_LOG_LEVEL = os.getenv('BOT_LOG_LEVEL', 'INFO')
+BOT_LOG_MAX_BYTES = int(os.getenv('BOT_LOG_MAX_BYTES', 10 * 1024 * 1024))
+BOT_LOG_BACKUPS = int(os.getenv('BOT_LOG_BACKUPS', 5))
+BOT_LOG_DEBUG_SAMPLE = float(os.getenv('BOT_LOG_DEBUG_SAMPLE', 0.01))
+# Число процессов сервера (WEB_CONCURRENCY, как у gunicorn и uvicorn) и способ ротации лога:
+# 'size' - ротация по размеру внутри процесса, 'external' - файл ротирует logrotate, а процессы
+# только переоткрывают его. Ротация по размеру из нескольких процессов теряет и портит строки
+BOT_SERVER_PROCESSES = int(os.getenv('WEB_CONCURRENCY', 1))
+BOT_LOG_ROTATE = os.getenv('BOT_LOG_ROTATE', 'size' if BOT_SERVER_PROCESSES <= 1 else 'external')
+
+# Отсев повторных доставок: размер кольца update_id в процессе,
+# общий кэш Django (CACHES) для нескольких процессов и время хранения в нём
+BOT_DEDUP_SIZE = int(os.getenv('BOT_DEDUP_SIZE', 10000))
+BOT_DEDUP_SHARED = os.getenv('BOT_DEDUP_SHARED', 'False') == 'True'
+BOT_DEDUP_TTL = int(os.getenv('BOT_DEDUP_TTL', 3600))
+
+# Лимиты исходящих запросов к Bot API
+BOT_RATE_GLOBAL = float(os.getenv('BOT_RATE_GLOBAL', 30))
+BOT_RATE_CHAT = float(os.getenv('BOT_RATE_CHAT', 1))
+BOT_RATE_GROUP_PER_MINUTE = float(os.getenv('BOT_RATE_GROUP_PER_MINUTE', 20))
+BOT_RATE_BURST = float(os.getenv('BOT_RATE_BURST', 3))
+BOT_API_MAX_RETRIES = int(os.getenv('BOT_API_MAX_RETRIES', 3))
+# Сколько секунд синхронный рантайм может ждать лимит в потоке обработки, дольше - запрос отклоняется как 429
+BOT_RATE_MAX_WAIT = float(os.getenv('BOT_RATE_MAX_WAIT', 0.5))
+
+# HTTP-транспорт синхронного бота: размер пула keep-alive соединений, таймауты подключения,
+# чтения и чтения для загрузок файлов в секундах, повторы неудавшегося подключения
+BOT_API_POOL_SIZE = int(os.getenv('BOT_API_POOL_SIZE', 32))
+BOT_API_CONNECT_TIMEOUT = float(os.getenv('BOT_API_CONNECT_TIMEOUT', 3.05))
+BOT_API_READ_TIMEOUT = float(os.getenv('BOT_API_READ_TIMEOUT', 15))
+BOT_API_UPLOAD_TIMEOUT = float(os.getenv('BOT_API_UPLOAD_TIMEOUT', 120))
+BOT_API_CONNECT_RETRIES = int(os.getenv('BOT_API_CONNECT_RETRIES', 2))
+
+# Кэш процесса для состояний диалогов из БД. При нескольких воркерах состояние
+# из другого процесса видно с задержкой до BOT_STATE_CACHE_TTL секунд, 0 отключает кэш
+BOT_STATE_CACHE_SIZE = int(os.getenv('BOT_STATE_CACHE_SIZE', 1024))
+BOT_STATE_CACHE_TTL = float(os.getenv('BOT_STATE_CACHE_TTL', 2))
+# Время жизни состояний в секундах: по умолчанию и для отдельных состояний
+BOT_STATE_TTL = float(os.getenv('BOT_STATE_TTL', 86400))
+BOT_STATE_TTLS = {
+    'UsersStates:help_request': float(os.getenv('BOT_HELP_STATE_TTL', 3600)),
+}
+# Лимит числа состояний, период фоновой очистки и как часто чтение отмечает использование состояния
+BOT_STATE_MAX_ENTRIES = int(os.getenv('BOT_STATE_MAX_ENTRIES', 100000))
+BOT_STATE_SWEEP_INTERVAL = float(os.getenv('BOT_STATE_SWEEP_INTERVAL', 300))
+BOT_STATE_TOUCH_INTERVAL = float(os.getenv('BOT_STATE_TOUCH_INTERVAL', 60))
+
+# Рантайм бота: 'sync' - TeleBot в потоках, 'async' - AsyncTeleBot на цикле ASGI
+BOT_RUNTIME = os.getenv('BOT_RUNTIME', 'sync')
+# Размер пула соединений aiohttp и таймаут запроса для 'async'
+BOT_ASYNC_POOL_SIZE = int(os.getenv('BOT_ASYNC_POOL_SIZE', 100))
+BOT_ASYNC_TIMEOUT = int(os.getenv('BOT_ASYNC_TIMEOUT', 30))
+
+# Режим приёма вебхуков: 'inline' - обработка в запросе, 'queue' - через очередь и пул обработчиков
+BOT_INGEST_MODE = os.getenv('BOT_INGEST_MODE', 'inline')
+# Число шардов (обработчиков): один чат всегда попадает в один шард
+BOT_WORKERS = int(os.getenv('BOT_WORKERS', 4))
+# Лимит очереди одного шарда
+BOT_SHARD_QUEUE_SIZE = int(os.getenv('BOT_SHARD_QUEUE_SIZE', 250))
+
+# Обработка загруженных постеров и файлов: сторона фото для Telegram, качество JPEG,
+# сторона превью документа и число фоновых обработчиков
+BOT_MEDIA_PHOTO_SIDE = int(os.getenv('BOT_MEDIA_PHOTO_SIDE', 2560))
+BOT_MEDIA_QUALITY = int(os.getenv('BOT_MEDIA_QUALITY', 85))
+BOT_MEDIA_THUMB_SIDE = int(os.getenv('BOT_MEDIA_THUMB_SIDE', 320))
+BOT_MEDIA_WORKERS = int(os.getenv('BOT_MEDIA_WORKERS', 1))
+
+# Ответы на вопросы в /help по статьям, сменам и местам: минимальная оценка совпадения (0..1),
+# ниже которой вопрос сразу уходит админам, и число предлагаемых ответов
+BOT_FAQ_THRESHOLD = float(os.getenv('BOT_FAQ_THRESHOLD', 0.5))
+BOT_FAQ_RESULTS = int(os.getenv('BOT_FAQ_RESULTS', 3))
+
+# Inline-режим (@бот в любом чате, включается в BotFather): сколько секунд Telegram кэширует ответ
+# и число результатов на странице (не больше 50)
+BOT_INLINE_CACHE_TIME = int(os.getenv('BOT_INLINE_CACHE_TIME', 300))
+BOT_INLINE_PAGE_SIZE = int(os.getenv('BOT_INLINE_PAGE_SIZE', 20))
+
+# Рассылка запросов помощи админам: запросы одного пользователя за BOT_HELP_COALESCE секунд
+# объединяются в одно сообщение, число параллельных отправок, число попыток,
+# первая задержка повтора (далее удваивается) и период проверки очереди
+BOT_HELP_COALESCE = float(os.getenv('BOT_HELP_COALESCE', 5))
+BOT_HELP_WORKERS = int(os.getenv('BOT_HELP_WORKERS', 4))
+BOT_HELP_MAX_ATTEMPTS = int(os.getenv('BOT_HELP_MAX_ATTEMPTS', 8))
+BOT_HELP_RETRY_DELAY = float(os.getenv('BOT_HELP_RETRY_DELAY', 30))
+BOT_HELP_POLL = float(os.getenv('BOT_HELP_POLL', 60))
+
+# Кнопок на одной странице списков смен, мест и статей
+BOT_MENU_PAGE_SIZE = int(os.getenv('BOT_MENU_PAGE_SIZE', 8))
+
+# Как часто, в секундах, процесс сверяет свой кэш каталога с общей версией в БД.
+# Изменения из админки или другого процесса видны с задержкой до этого времени, 0 - проверка на каждое обновление
+BOT_CATALOG_CHECK_INTERVAL = float(os.getenv('BOT_CATALOG_CHECK_INTERVAL', 1))
 
 
 # Application definition
@@ -88,13 +194,55 @@ WSGI_APPLICATION = 'nika.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+DATABASE_PATH = os.getenv('DATABASE_PATH', BASE_DIR / 'db.sqlite3')
+# Профиль БД: 'default' - SQLite с настройками по умолчанию,
+# 'production' - WAL, постоянные соединения и чтение в обработчиках бота через соединение только для чтения
+DATABASE_PROFILE = os.getenv('DATABASE_PROFILE', 'default')
+# Сколько секунд ждать блокировку записи, прежде чем получить "database is locked"
+DATABASE_BUSY_TIMEOUT = float(os.getenv('DATABASE_BUSY_TIMEOUT', 5))
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': DATABASE_PATH,
+        'OPTIONS': {
+            'timeout': DATABASE_BUSY_TIMEOUT,
+        },
     }
 }
 
+if DATABASE_PROFILE == 'production':
+    # Сколько секунд держать соединение открытым,
+    # размер отображения файла БД в память и режим синхронизации с диском
+    DATABASE_CONN_MAX_AGE = int(os.getenv('DATABASE_CONN_MAX_AGE', 600))
+    DATABASE_MMAP_SIZE = int(os.getenv('DATABASE_MMAP_SIZE', 256 * 1024 * 1024))
+    DATABASE_SYNCHRONOUS = os.getenv('DATABASE_SYNCHRONOUS', 'NORMAL')
+
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': DATABASE_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # В WAL чтение не ждёт записи, а запись - чтения
+            'init_command': f'PRAGMA journal_mode=WAL; PRAGMA synchronous={DATABASE_SYNCHRONOUS}; PRAGMA mmap_size={DATABASE_MMAP_SIZE}',
+            'timeout': DATABASE_BUSY_TIMEOUT,
+            # Блокировка записи берётся в начале транзакции, без взаимных блокировок при повышении
+            'transaction_mode': 'IMMEDIATE',
+        },
+    })
+    # Тот же файл, открытый только для чтения: его используют обработчики бота
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': f'file:{DATABASE_PATH}?mode=ro',
+        'CONN_MAX_AGE': DATABASE_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'init_command': f'PRAGMA query_only=ON; PRAGMA mmap_size={DATABASE_MMAP_SIZE}',
+            'timeout': DATABASE_BUSY_TIMEOUT,
+        },
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_ROUTERS = ['bot.routers.BotReadRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators